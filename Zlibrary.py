@@ -7,7 +7,103 @@ For more information, see:
 https://github.com/bipinkrish/Zlibrary-API/
 """
 
-import requests
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+# JSON解码器：已安装orjson时使用orjson（解码更快），否则使用标准库json
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+def setJsonDecoder(loads=None):
+    """
+    设置解析接口响应使用的JSON解码函数
+
+    Args:
+        loads: 接收bytes、返回Python对象的函数（如orjson.loads、ujson.loads），
+               None表示恢复默认（orjson，未安装时为json.loads）
+    """
+    global _json_loads
+    if loads is None:
+        try:
+            import orjson
+
+            loads = orjson.loads
+        except ImportError:
+            loads = json.loads
+    _json_loads = loads
+
+
+def getJsonDecoder():
+    """当前使用的JSON解码函数"""
+    return _json_loads
+
+
+# 网络请求观察者（见 setNetworkObserver），默认不记录
+_network_observer = None
+
+
+def setNetworkObserver(observer=None):
+    """
+    设置网络请求观察者（性能分析时统计网络等待时间）
+
+    Args:
+        observer: 接收请求类型（如 "search"）、返回上下文管理器的函数，
+                  每一次HTTP请求（含重试）都在这个上下文中执行；None表示不记录
+    """
+    global _network_observer
+    _network_observer = observer
+
+
+def _trackNetwork(endpoint: str):
+    observer = _network_observer
+    return observer(endpoint) if observer is not None else nullcontext()
+
+
+# HTTP会话包装（见 setSessionFactory），默认直接使用 requests.Session
+_session_factory = None
+_use_session_cache = True
+
+
+def setSessionFactory(factory=None, use_session_cache: bool = True):
+    """
+    设置HTTP会话的包装函数（录制/回放请求等）
+
+    Args:
+        factory: 接收新建的 requests.Session、返回具有 get/post/close 方法的对象的函数，
+                 之后新建的会话都经过它包装；None表示直接使用 requests.Session
+        use_session_cache: 是否读取/写入/删除登录缓存文件；录制和回放时为False，
+                           总是实际登录，登录请求一定在录制文件中，也不影响真实的登录缓存
+    """
+    global _session_factory, _use_session_cache
+    _session_factory = factory
+    _use_session_cache = use_session_cache
+
+
+# 登录缓存的默认有效期（秒），过期后重新登录
+DEFAULT_SESSION_TTL = 7 * 24 * 3600
+
+# 各类请求的超时设置（秒）: (连接超时, 读取超时, 总时限)
+# 总时限包含所有重试；读取超时是两次收到数据之间的最长等待
+DEFAULT_TIMEOUTS = {
+    "default": (5, 15, 45),
+    "login": (5, 15, 45),
+    "profile": (3, 10, 30),
+    "search": (5, 30, 90),
+    "info": (5, 15, 45),  # 书籍详情
+    "file": (5, 15, 45),  # 获取下载链接
+    "download": (10, 60, 1800),  # 下载文件内容
+    "image": (5, 10, 30),
+    "health": (3, 5, 10),  # 连接测试，快速失败
+}
 
 
 class Zlibrary:
@@ -17,6 +113,9 @@ class Zlibrary:
         password: str = None,
         remix_userid: [int, str] = None,
         remix_userkey: str = None,
+        session_file: str = None,
+        session_ttl: float = DEFAULT_SESSION_TTL,
+        timeouts: dict = None,
     ):
         self.__email: str
         self.__name: str
@@ -35,8 +134,39 @@ class Zlibrary:
         self.__cookies = {
             "siteLanguageV2": "en",
         }
-
-        if email is not None and password is not None:
+        self.__session = None
+
+        # 超时设置（按请求类型覆盖默认值）、整批截止时间和取消标志
+        self.__timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.__deadline = None
+        self.__cancelled = False
+        # 最近一次获取下载文件失败的原因（见 getLastFileError）
+        self.__last_file_error = None
+
+        # 对冲请求（默认关闭，见 enableHedging）
+        self.__hedge = None
+        self.__hedge_lock = threading.Lock()
+        self.__hedge_executor = None
+        # 调用线程上进行中的主请求对应的对冲请求（对冲请求已成功时主请求不再重试）
+        self.__hedge_local = threading.local()
+        self.__latencies = {}
+        self.__hedge_stats = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+        # 已决定对冲、定时器还没触发的请求数（预先占用对冲名额，避免并发请求同时通过比例检查）
+        self.__hedge_reserved = 0
+
+        # 登录会话缓存（cookie + 最近一次的个人资料），用于跳过启动时的登录请求
+        # 恢复缓存时不发起网络请求，只有需要登录的请求返回认证失败时才重新登录
+        self.__session_file = session_file
+        self.__session_ttl = session_ttl
+        self.__session_restored = False
+        self.__profile = None
+        self.__profile_time = None
+        # 仅保存在内存中，用于缓存失效时重新登录（不写入缓存文件）
+        self.__credentials = (email, password, remix_userid, remix_userkey)
+
+        if session_file is not None and _use_session_cache and self.__restoreSession(email, remix_userid):
+            self.__session_restored = True
+        elif email is not None and password is not None:
             self.login(email, password)
         elif remix_userid is not None and remix_userkey is not None:
             self.loginWithToken(remix_userid, remix_userkey)
@@ -52,8 +182,118 @@ class Zlibrary:
         self.__cookies["remix_userid"] = self.__remix_userid
         self.__cookies["remix_userkey"] = self.__remix_userkey
         self.__loggedin = True
+        self.__profile = response
+        self.__profile_time = time.time()
+        self.__saveSession()
         return response
 
+    def __restoreSession(self, email: str = None, remix_userid: [int, str] = None) -> bool:
+        try:
+            with open(self.__session_file, "r", encoding="utf-8") as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        # 过期的缓存不再使用
+        if time.time() - session.get("saved_at", 0) > self.__session_ttl:
+            return False
+
+        # 缓存的账号必须与本次指定的账号一致
+        if email is not None and session.get("email") != email:
+            return False
+        if remix_userid is not None and session.get("remix_userid") != str(remix_userid):
+            return False
+        if not session.get("remix_userid") or not session.get("remix_userkey"):
+            return False
+
+        self.__email = session.get("email")
+        self.__name = session.get("name")
+        self.__kindle_email = session.get("kindle_email")
+        self.__remix_userid = session["remix_userid"]
+        self.__remix_userkey = session["remix_userkey"]
+        self.__cookies["remix_userid"] = self.__remix_userid
+        self.__cookies["remix_userkey"] = self.__remix_userkey
+        self.__profile = session.get("profile")
+        self.__profile_time = session.get("profile_time")
+        self.__loggedin = True
+        return True
+
+    def __saveSession(self):
+        if self.__session_file is None or not self.__loggedin or not _use_session_cache:
+            return
+        session = {
+            "email": self.__email,
+            "name": self.__name,
+            "kindle_email": self.__kindle_email,
+            "remix_userid": self.__remix_userid,
+            "remix_userkey": self.__remix_userkey,
+            "profile": self.__profile,
+            "profile_time": self.__profile_time,
+            "saved_at": time.time(),
+        }
+        # 缓存中含有登录凭据，只允许当前用户读写；先写临时文件再替换，避免写一半的文件
+        # （临时文件名含进程号和线程号，多个分片进程同时保存时互不覆盖）
+        tmp_file = f"{self.__session_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(session, f, ensure_ascii=False)
+            os.chmod(tmp_file, 0o600)
+            os.replace(tmp_file, self.__session_file)
+        except OSError as e:
+            print(f"  [警告] 保存登录缓存失败: {e}")
+
+    def __clearSession(self):
+        if self.__session_file is None or not _use_session_cache:
+            return
+        try:
+            os.remove(self.__session_file)
+        except OSError:
+            pass
+
+    def __isAuthFailure(self, status_code: int, result) -> bool:
+        if status_code in (401, 403):
+            return True
+        if isinstance(result, dict) and not result.get("success"):
+            message = str(result.get("error") or result.get("message") or "").lower()
+            return any(word in message for word in ("login", "auth", "unauthorized"))
+        return False
+
+    def __revalidate(self) -> bool:
+        # 每个实例最多重新登录一次，避免认证失败时反复重试
+        self.__session_restored = False
+        print("  [状态] 登录缓存已失效，正在重新登录...")
+
+        email, password, remix_userid, remix_userkey = self.__credentials
+        self.__loggedin = False
+        if email is not None and password is not None:
+            response = self.__login(email, password)
+        else:
+            response = self.__checkIDandKey(
+                remix_userid if remix_userid is not None else self.__remix_userid,
+                remix_userkey if remix_userkey is not None else self.__remix_userkey,
+            )
+
+        if response and response.get("success"):
+            return True
+        print("  ❌ 重新登录失败")
+        self.__clearSession()
+        return False
+
+    def getCachedProfile(self, max_age: float = None) -> [dict, None]:
+        """
+        返回最近一次获取的个人资料（不发起网络请求）\n
+        max_age 秒内的才算有效，超出或没有缓存时返回 None
+        """
+        if self.__profile is None or self.__profile_time is None:
+            return None
+        if max_age is not None and time.time() - self.__profile_time > max_age:
+            return None
+        return self.__profile
+
+    def getCachedProfileTime(self) -> [float, None]:
+        return self.__profile_time
+
     def __login(self, email, password) -> dict[str, str]:
         return self.__setValues(
             self.__makePostRequest(
@@ -86,68 +326,338 @@ class Zlibrary:
     ) -> dict[str, str]:
         return self.__checkIDandKey(remix_userid, remix_userkey)
 
+    def __getSession(self):
+        # 每个实例使用独立的Session，复用连接池；多线程并发请求时共享
+        if self.__session is None:
+            import requests
+
+            self.__session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            self.__session.mount("https://", adapter)
+            self.__session.mount("http://", adapter)
+            if _session_factory is not None:
+                self.__session = _session_factory(self.__session)
+        return self.__session
+
+    @staticmethod
+    def __endpointOf(url: str) -> str:
+        if url.endswith("/book/search"):
+            return "search"
+        if url.endswith("/user/login"):
+            return "login"
+        if url.endswith("/user/profile"):
+            return "profile"
+        if url.endswith("/file"):
+            return "file"
+        if url.startswith("/eapi/book/") and url.count("/") == 4:
+            return "info"
+        return "default"
+
+    def getRemainingTime(self) -> [float, None]:
+        """距整批截止时间的剩余秒数，未设置截止时间时返回 None"""
+        if self.__deadline is None:
+            return None
+        return self.__deadline - time.monotonic()
+
+    def setDeadline(self, seconds: [float, None]):
+        """设置整批截止时间（从现在起的秒数），None 表示取消截止时间"""
+        self.__deadline = None if seconds is None else time.monotonic() + seconds
+
+    def getTimeout(self, endpoint: str = "default", started: float = None) -> [(float, float), None]:
+        """
+        返回某类请求本次可用的 (连接超时, 读取超时)\n
+        不超过该类请求的总时限（从 started 起算）和整批截止时间；时间已用完时返回 None
+        """
+        connect, read, total = self.__timeouts.get(endpoint, self.__timeouts["default"])
+        remaining = total
+        if started is not None:
+            remaining = total - (time.monotonic() - started)
+        if self.__deadline is not None:
+            remaining = min(remaining, self.getRemainingTime())
+        if self.__cancelled or remaining <= 0:
+            return None
+        return min(connect, remaining), min(read, remaining)
+
+    def getTotalTimeout(self, endpoint: str = "default") -> float:
+        return self.__timeouts.get(endpoint, self.__timeouts["default"])[2]
+
+    def enableHedging(
+        self,
+        percentile: float = 95,
+        max_ratio: float = 0.1,
+        mirrors: list = None,
+        min_samples: int = 20,
+        endpoints: tuple = ("search", "info"),
+    ):
+        """
+        开启对冲请求：search/getBookInfo 超过最近延迟的 percentile 分位仍未返回时，
+        再发一个相同的请求（有 mirrors 时轮流发往镜像域名）\n
+        主请求在调用线程中进行，对冲请求在线程池中进行；对冲请求先成功时主请求不再重试，使用对冲的结果\n
+        max_ratio 限制对冲请求占总请求数的比例；样本数不足 min_samples 时不对冲
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.__hedge = {
+            "percentile": percentile,
+            "max_ratio": max_ratio,
+            "mirrors": list(mirrors or []),
+            "min_samples": min_samples,
+            "endpoints": tuple(endpoints),
+            "next_mirror": 0,
+        }
+        # 只用于对冲请求（主请求在调用线程中进行），数量受 max_ratio 限制
+        if self.__hedge_executor is None:
+            self.__hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="zlib-hedge")
+
+    def getHedgeStats(self) -> dict:
+        """对冲统计: 请求数、对冲数、对冲胜出数、对冲率、各类请求的延迟分位"""
+        with self.__hedge_lock:
+            stats = dict(self.__hedge_stats)
+            stats["hedge_rate"] = stats["hedged"] / stats["requests"] if stats["requests"] else 0.0
+            for endpoint, samples in self.__latencies.items():
+                ordered = sorted(samples)
+                if ordered:
+                    stats[f"{endpoint}_p50"] = ordered[len(ordered) // 2]
+                    stats[f"{endpoint}_p99"] = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        return stats
+
+    def __recordLatency(self, endpoint: str, elapsed: float):
+        with self.__hedge_lock:
+            self.__latencies.setdefault(endpoint, deque(maxlen=200)).append(elapsed)
+
+    def __hedgeDelay(self, endpoint: str) -> [float, None]:
+        # 返回对冲前的等待时间并占用一个对冲名额（发出对冲请求或取消定时器时释放）；
+        # 样本不足或已超过对冲比例上限时返回 None（不对冲）
+        with self.__hedge_lock:
+            samples = sorted(self.__latencies.get(endpoint, ()))
+            if len(samples) < self.__hedge["min_samples"]:
+                return None
+            stats = self.__hedge_stats
+            if stats["hedged"] + self.__hedge_reserved + 1 > stats["requests"] * self.__hedge["max_ratio"]:
+                return None
+            self.__hedge_reserved += 1
+            index = min(len(samples) - 1, int(len(samples) * self.__hedge["percentile"] / 100))
+            return samples[index]
+
+    def __nextHedgeDomain(self) -> [str, None]:
+        with self.__hedge_lock:
+            mirrors = self.__hedge["mirrors"]
+            if not mirrors:
+                return None
+            domain = mirrors[self.__hedge["next_mirror"] % len(mirrors)]
+            self.__hedge["next_mirror"] += 1
+            return domain
+
+    def __hedgeSucceeded(self) -> bool:
+        # 当前线程的主请求已被对冲请求抢先成功返回（之后的重试没有意义）
+        state = getattr(self.__hedge_local, "state", None)
+        backup = state["backup"] if state else None
+        if backup is None or not backup.done() or backup.cancelled():
+            return False
+        result = backup.result()
+        return bool(result and result.get("success"))
+
+    def __hedged(self, endpoint: str, call) -> dict[str, str]:
+        # call(domain) 发起一次请求；domain 为 None 时使用默认域名
+        def timed(domain):
+            started = time.monotonic()
+            result = call(domain)
+            self.__recordLatency(endpoint, time.monotonic() - started)
+            return result
+
+        if self.__hedge is None or endpoint not in self.__hedge["endpoints"]:
+            return timed(None)
+
+        with self.__hedge_lock:
+            self.__hedge_stats["requests"] += 1
+        delay = self.__hedgeDelay(endpoint)
+        if delay is None:
+            return timed(None)
+
+        # 主请求在调用线程中进行，不占用线程池；超过 delay 仍未返回时由定时器把对冲请求提交到线程池
+        state = {"done": False, "backup": None}
+        state_lock = threading.Lock()
+
+        def send_hedge():
+            with state_lock:
+                if state["done"]:
+                    return
+                backup = self.__hedge_executor.submit(timed, self.__nextHedgeDomain())
+                with self.__hedge_lock:
+                    self.__hedge_reserved -= 1
+                    self.__hedge_stats["hedged"] += 1
+                state["backup"] = backup
+
+        timer = threading.Timer(delay, send_hedge)
+        timer.daemon = True
+        self.__hedge_local.state = state
+        try:
+            timer.start()
+            result = timed(None)
+        finally:
+            self.__hedge_local.state = None
+            timer.cancel()
+            with state_lock:
+                state["done"] = True
+                backup = state["backup"]
+            if backup is None:
+                # 主请求在定时器触发前结束，对冲请求没有发出：释放占用的名额
+                with self.__hedge_lock:
+                    self.__hedge_reserved -= 1
+        if backup is None:
+            return result
+
+        def succeeded(response):
+            return bool(response and response.get("success"))
+
+        # 对冲请求先完成且成功时使用它的结果；否则主请求成功时取消还没开始的对冲请求，
+        # 已在进行的对冲请求结果丢弃（非流式响应已整个读入并归还连接，无需关闭）
+        if succeeded(result) and not (backup.done() and succeeded(backup.result())):
+            backup.cancel()
+            return result
+        # 主请求失败（或对冲请求先成功）时使用对冲请求的结果
+        hedge_result = backup.result()
+        if succeeded(hedge_result):
+            with self.__hedge_lock:
+                self.__hedge_stats["hedge_wins"] += 1
+            return hedge_result
+        return result
+
+    def cancel(self):
+        """取消后续所有请求并关闭连接池，流式下载在下一个数据块时停止"""
+        self.__cancelled = True
+        if self.__session is not None:
+            self.__session.close()
+
+    def isCancelled(self) -> bool:
+        return self.__cancelled
+
+    @staticmethod
+    def __describeTimeout(timeout) -> str:
+        if isinstance(timeout, tuple):
+            return f"连接{timeout[0]:.0f}秒/读取{timeout[1]:.0f}秒"
+        return f"{timeout}秒"
+
+    def __timeoutResult(self) -> dict[str, str]:
+        if self.__cancelled:
+            return {"success": False, "message": "请求已取消", "retryable": True}
+        return {"success": False, "message": "请求超过时限", "retryable": True}
+
+    @staticmethod
+    def __decode(response):
+        # 直接解码响应的原始字节，解码失败时交给 response.json() 处理（保持原有的异常类型）
+        try:
+            return _json_loads(response.content)
+        except ValueError:
+            return response.json()
+
     def __makePostRequest(
-        self, url: str, data: dict = {}, override=False, timeout: int = 2, max_retries: int = 3
+        self, url: str, data: dict = {}, override=False, timeout=None, max_retries: int = 3,
+        domain: str = None,
     ) -> dict[str, str]:
         if not self.isLoggedIn() and override is False:
             print("Not logged in")
             return
 
+        import requests
+
+        endpoint = self.__endpointOf(url)
+        started = time.monotonic()
         for attempt in range(max_retries):
+            request_timeout = timeout if timeout is not None else self.getTimeout(endpoint, started)
+            if request_timeout is None or self.__cancelled or self.__hedgeSucceeded():
+                return self.__timeoutResult()
             try:
-                response = requests.post(
-                    "https://" + self.__domain + url,
-                    data=data,
-                    cookies=self.__cookies,
-                    headers=self.__headers,
-                    timeout=timeout,
-                )
-                return response.json()
+                with _trackNetwork(endpoint):
+                    response = self.__getSession().post(
+                        "https://" + (domain or self.__domain) + url,
+                        data=data,
+                        cookies=self.__cookies,
+                        headers=self.__headers,
+                        timeout=request_timeout,
+                    )
+                # 401/403 可能不是JSON，交给认证检查处理
+                result = self.__decode(response) if response.status_code not in (401, 403) else None
+                if (
+                    not override
+                    and self.__session_restored
+                    and self.__isAuthFailure(response.status_code, result)
+                    and self.__revalidate()
+                ):
+                    return self.__makePostRequest(url, data, override, timeout, max_retries, domain)
+                return result if result is not None else self.__decode(response)
             except requests.exceptions.Timeout:
                 if attempt < max_retries - 1:
-                    print(f"  [警告] 请求超时 (2秒)，正在重试... ({attempt + 1}/{max_retries})")
+                    print(f"  [警告] 请求超时 ({self.__describeTimeout(request_timeout)})，正在重试... ({attempt + 1}/{max_retries})")
                 else:
-                    print(f"  ❌ 请求超时 (2秒)，已重试{max_retries}次，失败")
-                    return {"success": False, "message": f"请求超时 (已重试{max_retries}次)"}
+                    print(f"  ❌ 请求超时 ({self.__describeTimeout(request_timeout)})，已重试{max_retries}次，失败")
+                    return {"success": False, "message": f"请求超时 (已重试{max_retries}次)", "retryable": True}
             except requests.exceptions.RequestException as e:
+                if self.__cancelled:
+                    return self.__timeoutResult()
                 if attempt < max_retries - 1:
                     print(f"  [警告] 请求异常: {e}，正在重试... ({attempt + 1}/{max_retries})")
                 else:
                     print(f"  ❌ 请求异常: {e}，已重试{max_retries}次，失败")
-                    return {"success": False, "message": f"请求异常: {e}"}
+                    return {"success": False, "message": f"请求异常: {e}", "retryable": True}
 
     def __makeGetRequest(
-        self, url: str, params: dict = {}, cookies=None, timeout: int = 2, max_retries: int = 3
+        self, url: str, params: dict = {}, cookies=None, timeout=None, max_retries: int = 3,
+        domain: str = None,
     ) -> dict[str, str]:
         if not self.isLoggedIn() and cookies is None:
             print("Not logged in")
             return
 
+        import requests
+
+        endpoint = self.__endpointOf(url)
+        started = time.monotonic()
         for attempt in range(max_retries):
+            request_timeout = timeout if timeout is not None else self.getTimeout(endpoint, started)
+            if request_timeout is None or self.__cancelled or self.__hedgeSucceeded():
+                return self.__timeoutResult()
             try:
-                response = requests.get(
-                    "https://" + self.__domain + url,
-                    params=params,
-                    cookies=self.__cookies if cookies is None else cookies,
-                    headers=self.__headers,
-                    timeout=timeout,
-                )
-                return response.json()
+                with _trackNetwork(endpoint):
+                    response = self.__getSession().get(
+                        "https://" + (domain or self.__domain) + url,
+                        params=params,
+                        cookies=self.__cookies if cookies is None else cookies,
+                        headers=self.__headers,
+                        timeout=request_timeout,
+                    )
+                # 401/403 可能不是JSON，交给认证检查处理
+                result = self.__decode(response) if response.status_code not in (401, 403) else None
+                if (
+                    cookies is None
+                    and self.__session_restored
+                    and self.__isAuthFailure(response.status_code, result)
+                    and self.__revalidate()
+                ):
+                    return self.__makeGetRequest(url, params, cookies, timeout, max_retries, domain)
+                return result if result is not None else self.__decode(response)
             except requests.exceptions.Timeout:
                 if attempt < max_retries - 1:
-                    print(f"  [警告] 请求超时 (2秒)，正在重试... ({attempt + 1}/{max_retries})")
+                    print(f"  [警告] 请求超时 ({self.__describeTimeout(request_timeout)})，正在重试... ({attempt + 1}/{max_retries})")
                 else:
-                    print(f"  ❌ 请求超时 (2秒)，已重试{max_retries}次，失败")
-                    return {"success": False, "message": f"请求超时 (已重试{max_retries}次)"}
+                    print(f"  ❌ 请求超时 ({self.__describeTimeout(request_timeout)})，已重试{max_retries}次，失败")
+                    return {"success": False, "message": f"请求超时 (已重试{max_retries}次)", "retryable": True}
             except requests.exceptions.RequestException as e:
+                if self.__cancelled:
+                    return self.__timeoutResult()
                 if attempt < max_retries - 1:
                     print(f"  [警告] 请求异常: {e}，正在重试... ({attempt + 1}/{max_retries})")
                 else:
                     print(f"  ❌ 请求异常: {e}，已重试{max_retries}次，失败")
-                    return {"success": False, "message": f"请求异常: {e}"}
+                    return {"success": False, "message": f"请求异常: {e}", "retryable": True}
 
     def getProfile(self) -> dict[str, str]:
-        return self.__makeGetRequest("/eapi/user/profile")
+        response = self.__makeGetRequest("/eapi/user/profile")
+        if response and response.get("success"):
+            self.__profile = response
+            self.__profile_time = time.time()
+            self.__saveSession()
+        return response
 
     def getMostPopular(self, switch_language: str = None) -> dict[str, str]:
         if switch_language is not None:
@@ -246,17 +756,20 @@ class Zlibrary:
     def saveBook(self, bookid: [int, str]) -> dict[str, str]:
         return self.__makeGetRequest(f"/eapi/user/book/{bookid}/save")
 
-    def sendTo(self, bookid: [int, str], hashid: str, totype: str) -> dict[str, str]:
-        return self.__makeGetRequest(f"/eapi/book/{bookid}/{hashid}/send-to-{totype}")
+    def sendTo(self, bookid: [int, str], hashid: str, totype: str, max_retries: int = 3) -> dict[str, str]:
+        # max_retries=1: 由调用方控制重试（如按发送速率限制退避），避免一次调用重复发送
+        return self.__makeGetRequest(f"/eapi/book/{bookid}/{hashid}/send-to-{totype}", max_retries=max_retries)
 
     def getBookInfo(
         self, bookid: [int, str], hashid: str, switch_language: str = None
     ) -> dict[str, str]:
-        if switch_language is not None:
-            return self.__makeGetRequest(
-                f"/eapi/book/{bookid}/{hashid}", {"switch-language": switch_language}
-            )
-        return self.__makeGetRequest(f"/eapi/book/{bookid}/{hashid}")
+        params = {"switch-language": switch_language} if switch_language is not None else {}
+        return self.__hedged(
+            "info",
+            lambda domain: self.__makeGetRequest(
+                f"/eapi/book/{bookid}/{hashid}", params, domain=domain
+            ),
+        )
 
     def getSimilar(self, bookid: [int, str], hashid: str) -> dict[str, str]:
         return self.__makeGetRequest(f"/eapi/book/{bookid}/{hashid}/similar")
@@ -294,40 +807,89 @@ class Zlibrary:
         message: str = None,
         yearFrom: int = None,
         yearTo: int = None,
-        languages: str = None,
+        languages: [str] = None,
         extensions: [str] = None,
         order: str = None,
         page: int = None,
         limit: int = None,
+        timeout=None,
     ) -> dict[str, str]:
-        return self.__makePostRequest(
-            "/eapi/book/search",
-            {
-                k: v
-                for k, v in {
-                    "message": message,
-                    "yearFrom": yearFrom,
-                    "yearTo": yearTo,
-                    "languages": languages,
-                    "extensions[]": extensions,
-                    "order": order,
-                    "page": page,
-                    "limit": limit,
-                }.items()
-                if v is not None
-            },
+        """
+        timeout 可指定 (连接超时, 读取超时)，默认使用 "search" 类请求的设置
+
+        languages 为列表时与 extensions 一样按 languages[] 发送（重复的 languages 字段服务器只取最后一个）
+        """
+        if isinstance(languages, str):
+            languages = [languages]
+        data = {
+            k: v
+            for k, v in {
+                "message": message,
+                "yearFrom": yearFrom,
+                "yearTo": yearTo,
+                "languages[]": languages,
+                "extensions[]": extensions,
+                "order": order,
+                "page": page,
+                "limit": limit,
+            }.items()
+            if v is not None
+        }
+        return self.__hedged(
+            "search",
+            lambda domain: self.__makePostRequest(
+                "/eapi/book/search", data, timeout=timeout, domain=domain
+            ),
         )
 
-    def __getImageData(self, url: str) -> requests.Response.content:
-        res = requests.get(url, headers=self.__headers)
+    def __getImageData(self, url: str, timeout=None) -> bytes:
+        timeout = timeout if timeout is not None else self.getTimeout("image")
+        if timeout is None:
+            return None
+        with _trackNetwork("image"):
+            res = self.__getSession().get(url, headers=self.__headers, timeout=timeout)
         if res.status_code == 200:
             return res.content
 
-    def getImage(self, book: dict[str, str]) -> requests.Response.content:
+    def getImage(self, book: dict[str, str]) -> bytes:
         return self.__getImageData(book["cover"])
 
-    def __getBookFile(self, bookid: [int, str], hashid: str) -> [(str, bytes), None]:
+    def getImageConditional(
+        self, url: str, etag: str = None, timeout=None
+    ) -> (int, [bytes, None], [str, None]):
+        """
+        按ETag条件获取图片\n
+        返回 (状态码, 内容, ETag)；图片未变化时状态码为304、内容为None；超过时限时状态码为0
+        """
+        timeout = timeout if timeout is not None else self.getTimeout("image")
+        if timeout is None:
+            return 0, None, etag
+        headers = self.__headers.copy()
+        if etag:
+            headers["If-None-Match"] = etag
+        with _trackNetwork("image"):
+            res = self.__getSession().get(url, headers=headers, timeout=timeout)
+        content = res.content if res.status_code == 200 else None
+        return res.status_code, content, res.headers.get("ETag", etag)
+
+    def getLastFileError(self) -> [dict, None]:
+        """
+        最近一次 downloadBook/downloadBookStream 返回 None 的原因\n
+        返回 {"retryable": 是否为网络错误/超时/服务器临时错误, "status": HTTP状态码或None, "message": 说明}
+        """
+        return self.__last_file_error
+
+    def __openBookFile(self, bookid: [int, str], hashid: str, stream: bool = False):
+        self.__last_file_error = None
         response = self.__makeGetRequest(f"/eapi/book/{bookid}/{hashid}/file")
+        if not response or "file" not in response:
+            response = response or {}
+            self.__last_file_error = {
+                "retryable": bool(response.get("retryable")),
+                "status": None,
+                "message": response.get("error") or response.get("message") or "没有下载链接",
+            }
+            return None
         filename = response["file"]["description"]
 
         try:
@@ -341,13 +903,37 @@ class Zlibrary:
         headers = self.__headers.copy()
         headers["authority"] = ddl.split("/")[2]
 
-        res = requests.get(ddl, headers=headers)
+        timeout = self.getTimeout("download")
+        if timeout is None:
+            self.__last_file_error = {"retryable": True, "status": None, "message": "请求超过时限"}
+            return None
+        with _trackNetwork("download"):
+            res = self.__getSession().get(ddl, headers=headers, stream=stream, timeout=timeout)
         if res.status_code == 200:
+            return filename, res
+        res.close()
+        self.__last_file_error = {
+            "retryable": res.status_code >= 500 or res.status_code == 429,
+            "status": res.status_code,
+            "message": f"下载服务器返回 HTTP {res.status_code}",
+        }
+
+    def __getBookFile(self, bookid: [int, str], hashid: str) -> [(str, bytes), None]:
+        result = self.__openBookFile(bookid, hashid)
+        if result is not None:
+            filename, res = result
             return filename, res.content
 
     def downloadBook(self, book: dict[str, str]) -> [(str, bytes), None]:
         return self.__getBookFile(book["id"], book["hash"])
 
+    def downloadBookStream(self, book: dict[str, str]):
+        """
+        以流式方式下载书籍，不把整个文件读入内存\n
+        返回 (文件名, 响应对象)，调用方用 iter_content() 读取内容并负责 close()；失败时返回 None
+        """
+        return self.__openBookFile(book["id"], book["hash"], stream=True)
+
     def isLoggedIn(self) -> bool:
         return self.__loggedin
 
@@ -12,7 +12,14 @@ import io
 import json
 import re
 import time
-from datetime import datetime
+import hashlib
+import heapq
+import itertools
+import shutil
+import signal
+import threading
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 # Windows终端设置UTF-8编码（立即输出）
@@ -24,6 +31,7 @@ if sys.platform == "win32":
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from Zlibrary import Zlibrary
+import profiling
 
 # ========== 配置区域 ==========
 # 默认登录信息
@@ -34,16 +42,74 @@ DEFAULT_PASSWORD = ""
 DEFAULT_REMIX_USERID = ""
 DEFAULT_REMIX_USERKEY = ""
 
+# 多账号配置（非空时忽略上面的单账号配置），各账号并行下载、共享同一个状态文件
+# 每项可以是 Remix Token 或 邮箱+密码，例如:
+#   {"name": "账号A", "remix_userid": "123", "remix_userkey": "abc"},
+#   {"name": "账号B", "email": "b@example.com", "password": "..."},
+DEFAULT_ACCOUNTS = []
+
 # 下载配置
 DEFAULT_INPUT_FILE = "list.txt"
 DEFAULT_OUTPUT_DIR = "downloads"
 DEFAULT_STATE_FILE = "download_state.json"
+DEFAULT_CONTENT_INDEX_FILE = "content_index.json"  # 已下载文件的内容索引（SHA-256）
+DEFAULT_OWNED_INDEX_FILE = "owned_books.json"  # 服务器端下载/收藏记录的本地索引
+DEFAULT_METADATA_INDEX_FILE = "book_metadata.json"  # 下载后校验结果和内嵌元数据
+VALIDATE_WORKERS = 2  # 下载后校验的进程数（与下载并行），0表示不校验
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 流式下载每次写入的块大小（字节）
 DEFAULT_MAX_DOWNLOADS_PER_DAY = 10  # 每日最大下载次数
 
-# 网络超时设置（秒）
-REQUEST_TIMEOUT = 2
+# 下载配额设置
+QUOTA_RESYNC_INTERVAL = 600  # 本地配额计数与服务器重新同步的间隔（秒）
+# 待下载队列排序策略: "input"(按输入顺序), "smallest"(文件小的优先), "oldest"(等待最久的优先)
+DEFAULT_QUEUE_POLICY = "input"
+
+# 失败重试：网络错误/超时/文件不完整按指数退避自动重试（第n次失败后等待 BASE x 2^(n-1) 秒，不超过 MAX）
+# 文件不存在等永久错误不再重试，不再占用下载次数
+RETRY_MAX_ATTEMPTS = 5  # 最多尝试次数（含第一次）
+RETRY_BASE_DELAY = 60  # 第一次重试前等待的秒数
+RETRY_MAX_DELAY = 6 * 3600  # 重试等待的上限（秒）
+RETRY_MAX_WAIT = 300  # 本次运行中最多等待多少秒来重试，更晚的重试留到下次运行（0表示本次不重试）
+
+# 服务器端记录同步：下载前同步各账号的下载记录和收藏，已在其他设备下载过的书不再消耗下载次数
+# 增量同步：从最新的记录开始翻页，遇到上次同步时最新的记录即停止
+OWNED_SYNC_PAGE_SIZE = 100  # 每页记录数
+OWNED_SYNC_MAX_PAGES = 100  # 每个列表最多翻页数
+# 哪些记录视为已拥有（下载前跳过）；收藏（"saved"）通常是待下载的书，默认只同步不跳过
+OWNED_SKIP_SOURCES = ("downloaded",)
+
+# 守护进程模式（--daemon）：常驻运行并保持登录，输入文件有变化或每日下载次数重置后立即下载
+DAEMON_POLL_INTERVAL = 30  # 检查输入文件变化的间隔（秒）
+DAEMON_STATUS_HOST = "127.0.0.1"  # 状态接口只监听本机
+DAEMON_STATUS_PORT = 8765  # 状态接口端口（GET /status），0表示不开启；也可用 --status-port 指定
+QUOTA_RESET_UTC_HOUR = 0  # 每日下载次数重置的时间（UTC整点）；从个人资料观察到重置后按观察到的时间
+
+# 共享下载队列（--shared-queue <文件>）：多台机器从同一个队列取书
+SHARED_QUEUE_LEASE = 600  # 租约时长（秒），节点失联超过这个时间后，它取走的书回到队列
+SHARED_QUEUE_POLL_INTERVAL = 5  # 等待其他节点的书或重试时间时，重新检查的间隔（秒）
+
+# 网络超时设置（秒）: 各类请求的 (连接超时, 读取超时, 总时限含重试)
+# 未列出的请求类型使用 Zlibrary.DEFAULT_TIMEOUTS
+REQUEST_TIMEOUTS = {
+    "file": (5, 15, 45),  # 获取下载链接
+    "download": (10, 60, 1800),  # 下载单个文件
+}
+# 整批下载的总时限（秒），到时停止下载、取消进行中的下载；None表示不限（也可用 --deadline 指定）
+BATCH_DEADLINE = None
+
+# 登录缓存：保存cookie和个人资料，启动时直接复用，跳过登录请求
+SESSION_CACHE_FILE = ".zlib_session.json"
+PROFILE_CACHE_MAX_AGE = 600  # 缓存的个人资料在多少秒内可直接使用
 # ===============================
 
+# 下载错误分类
+ERROR_TRANSIENT = "transient"  # 网络错误、超时、文件不完整：退避后自动重试
+ERROR_MISSING = "missing"  # 文件不存在、无法获取下载链接：不再重试
+ERROR_QUOTA = "quota"  # 下载次数用尽：放回队列，不算失败
+
+# 失败记录中的附加字段（重新下载时去掉）
+FAILED_FIELDS = ("fail_reason", "fail_count", "error_class", "next_retry_at", "gave_up")
+
 
 class DownloadState:
     """下载状态管理类"""
@@ -51,6 +117,8 @@ class DownloadState:
     def __init__(self, state_file: str):
         self.state_file = state_file
         self.state = self._load_state()
+        # 多账号并行下载时共享同一个实例
+        self._lock = threading.RLock()
 
     def _load_state(self) -> dict:
         """加载状态文件"""
@@ -69,40 +137,106 @@ class DownloadState:
 
     def save(self):
         """保存状态到文件"""
-        self.state["last_update"] = datetime.now().isoformat()
-        with open(self.state_file, 'w', encoding='utf-8') as f:
-            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        with self._lock:
+            self.state["last_update"] = datetime.now().isoformat()
+            with open(self.state_file, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, ensure_ascii=False, indent=2)
 
     def add_downloaded(self, book: dict):
         """添加已下载的书籍"""
-        book_key = self._get_book_key(book)
-        if book_key not in [self._get_book_key(b) for b in self.state["downloaded"]]:
-            self.state["downloaded"].append(book)
-        # 从待下载列表中移除
-        self.state["pending"] = [b for b in self.state["pending"]
-                              if self._get_book_key(b) != book_key]
+        with self._lock:
+            book_key = self._get_book_key(book)
+            if book_key not in [self._get_book_key(b) for b in self.state["downloaded"]]:
+                self.state["downloaded"].append(book)
+            # 从待下载和失败列表中移除
+            self.state["pending"] = [b for b in self.state["pending"]
+                                  if self._get_book_key(b) != book_key]
+            self.state["failed"] = [b for b in self.state["failed"]
+                                 if self._get_book_key(b) != book_key]
+
+    def remove_downloaded(self, book: dict):
+        """移除已下载记录（文件校验失败，需要重新下载）"""
+        with self._lock:
+            book_key = self._get_book_key(book)
+            self.state["downloaded"] = [b for b in self.state["downloaded"]
+                                     if self._get_book_key(b) != book_key]
+
+    def remove_pending(self, book: dict):
+        """从待下载列表中移除（不需要本地下载的书，如账号中已拥有）"""
+        with self._lock:
+            book_key = self._get_book_key(book)
+            self.state["pending"] = [b for b in self.state["pending"]
+                                  if self._get_book_key(b) != book_key]
 
     def add_pending(self, book: dict):
         """添加待下载的书籍"""
-        book_key = self._get_book_key(book)
-        if book_key not in [self._get_book_key(b) for b in self.state["pending"]]:
-            self.state["pending"].append(book)
-
-    def add_failed(self, book: dict, reason: str):
-        """添加下载失败的书籍"""
-        book_key = self._get_book_key(book)
-        # 检查是否已存在
-        existing = next((b for b in self.state["failed"]
-                       if self._get_book_key(b) == book_key), None)
-        if existing:
+        with self._lock:
+            book_key = self._get_book_key(book)
+            if book_key not in [self._get_book_key(b) for b in self.state["pending"]]:
+                self.state["pending"].append({
+                    **book,
+                    "pending_since": book.get("pending_since") or datetime.now().isoformat()
+                })
+
+    def add_failed(self, book: dict, reason: str, error_class: str = ERROR_TRANSIENT) -> dict:
+        """
+        添加下载失败的书籍，并安排下一次重试
+
+        临时错误在未超过 RETRY_MAX_ATTEMPTS 时按指数退避安排重试，
+        永久错误或超过最多尝试次数时标记为放弃（gave_up）
+
+        Returns:
+            失败记录（含 fail_count、next_retry_at、gave_up）
+        """
+        with self._lock:
+            existing = self.get_failed(book)
+            if existing is None:
+                existing = {key: value for key, value in book.items() if key not in FAILED_FIELDS}
+                existing["fail_count"] = 0
+                self.state["failed"].append(existing)
             existing["fail_reason"] = reason
             existing["fail_count"] = existing.get("fail_count", 0) + 1
-        else:
-            self.state["failed"].append({
-                **book,
-                "fail_reason": reason,
-                "fail_count": 1
-            })
+            existing["error_class"] = error_class
+
+            if error_class == ERROR_TRANSIENT and existing["fail_count"] < RETRY_MAX_ATTEMPTS:
+                delay = get_retry_delay(existing["fail_count"])
+                existing["next_retry_at"] = (datetime.now() + timedelta(seconds=delay)).isoformat()
+                existing["gave_up"] = False
+            else:
+                existing["next_retry_at"] = None
+                existing["gave_up"] = True
+            return existing
+
+    def get_failed(self, book: dict) -> dict:
+        """查找书籍的失败记录，没有时返回None"""
+        with self._lock:
+            book_key = self._get_book_key(book)
+            return next((b for b in self.state["failed"] if self._get_book_key(b) == book_key), None)
+
+    def get_retry_books(self) -> list:
+        """
+        返回需要重试的书籍
+
+        Returns:
+            [(书籍, 可以重试的时间戳)]，不含已放弃的
+        """
+        with self._lock:
+            retries = []
+            for entry in self.state["failed"]:
+                if not is_retryable(entry):
+                    continue
+                book = {key: value for key, value in entry.items() if key not in FAILED_FIELDS}
+                retries.append((book, get_retry_time(entry)))
+            return retries
+
+    def reset_failed(self) -> int:
+        """清除所有失败记录的尝试次数和放弃标记（--retry-failed），返回重置的数量"""
+        with self._lock:
+            for entry in self.state["failed"]:
+                entry["fail_count"] = 0
+                entry["next_retry_at"] = None
+                entry["gave_up"] = False
+            return len(self.state["failed"])
 
     def _get_book_key(self, book: dict) -> str:
         """生成书籍唯一标识"""
@@ -117,13 +251,524 @@ class DownloadState:
         return len(self.state["downloaded"])
 
 
+def estimate_reset_time(after: float, before: float) -> float:
+    """
+    每日次数在 (after, before] 之间重置时推算重置时间：其中有整点时取第一个整点（按整点重置），否则取 before
+    """
+    hour = (int(after) // 3600 + 1) * 3600
+    return float(hour) if hour <= before else before
+
+
+class QuotaManager:
+    """
+    下载配额管理类
+
+    根据个人资料中的 downloads_limit/downloads_today 在本地维护剩余次数，
+    每次下载成功后本地扣减，只在间隔超时或下载出错时才重新请求服务器同步。
+    两次同步之间 downloads_today 减少说明每日次数已重置，记录重置时间（reset_at），用于推算下一次重置。
+    """
+
+    def __init__(self, zlib: Zlibrary, user_profile: dict = None, resync_interval: float = QUOTA_RESYNC_INTERVAL,
+                 synced_at: float = None):
+        self.zlib = zlib
+        self.resync_interval = resync_interval
+        self.remaining = 0
+        self.last_sync = 0.0
+        self.downloads_today = None
+        self.reset_at = None  # 从个人资料观察到的最近一次每日重置时间
+        if user_profile is not None:
+            self.update_from_profile(user_profile, synced_at)
+        else:
+            self.resync()
+
+    def update_from_profile(self, user_profile: dict, synced_at: float = None) -> int:
+        """根据个人资料（profile['user']）更新剩余次数，synced_at为资料获取时间（默认当前）"""
+        synced_at = synced_at if synced_at is not None else time.time()
+        downloads_today = user_profile.get("downloads_today", 0)
+        if self.downloads_today is not None and downloads_today < self.downloads_today and synced_at > self.last_sync:
+            self.reset_at = estimate_reset_time(self.last_sync, synced_at)
+        self.downloads_today = downloads_today
+        self.remaining = user_profile.get("downloads_limit", DEFAULT_MAX_DOWNLOADS_PER_DAY) - downloads_today
+        self.last_sync = synced_at
+        return self.remaining
+
+    def resync(self) -> int:
+        """从服务器重新同步剩余次数，失败时保留本地计数"""
+        profile = self.zlib.getProfile()
+        if profile and profile.get("success") and "user" in profile:
+            return self.update_from_profile(profile["user"])
+        print(f"      [警告] 同步下载配额失败，使用本地计数: {self.remaining}")
+        return self.remaining
+
+    def has_quota(self) -> bool:
+        """是否还有剩余次数（距上次同步超过间隔时先重新同步）"""
+        if time.time() - self.last_sync >= self.resync_interval:
+            self.resync()
+        return self.remaining > 0
+
+    def consume(self):
+        """下载成功后扣减一次"""
+        self.remaining = max(self.remaining - 1, 0)
+
+
+class ContentIndex:
+    """
+    已下载内容索引
+
+    记录 书籍(id+hash) -> 文件SHA-256/大小/路径，以及 SHA-256 -> 文件路径：
+    - 下载前按书籍查找，文件仍在且大小一致时直接跳过，不消耗下载次数
+    - 下载后按SHA-256查找，不同ID的相同内容只保留一份，新文件名用链接指向已有文件
+    """
+
+    def __init__(self, index_file: str):
+        self.index_file = index_file
+        self.index = self._load_index()
+        self._lock = threading.RLock()
+
+    def _load_index(self) -> dict:
+        """加载索引文件"""
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"[警告] 加载内容索引失败: {e}，使用空索引")
+        return {
+            "books": {},  # {id_hash: {"sha256": ..., "size": ..., "path": ...}}
+            "files": {}   # {sha256: path}
+        }
+
+    def save(self):
+        """保存索引到文件"""
+        with self._lock:
+            with open(self.index_file, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def _is_valid(path: str, size: int) -> bool:
+        """文件存在且大小与记录一致"""
+        return bool(path) and os.path.isfile(path) and os.path.getsize(path) == size
+
+    def find_book(self, book_id: str, book_hash: str) -> str:
+        """按书籍查找已下载的文件路径，找不到或文件已失效时返回None"""
+        with self._lock:
+            entry = self.index["books"].get(f"{book_id}_{book_hash}")
+            if entry and self._is_valid(entry["path"], entry["size"]):
+                return entry["path"]
+        return None
+
+    def find_content(self, sha256: str, size: int) -> str:
+        """按内容查找已有文件路径，找不到或文件已失效时返回None"""
+        with self._lock:
+            path = self.index["files"].get(sha256)
+            if path and self._is_valid(path, size):
+                return path
+        return None
+
+    def add(self, book_id: str, book_hash: str, sha256: str, size: int, path: str):
+        """记录一个已下载的文件"""
+        with self._lock:
+            self.index["books"][f"{book_id}_{book_hash}"] = {"sha256": sha256, "size": size, "path": path}
+            if not self.find_content(sha256, size):
+                self.index["files"][sha256] = path
+            self.save()
+
+    def remove(self, book_id: str, book_hash: str):
+        """删除一本书的记录（文件校验失败）"""
+        with self._lock:
+            entry = self.index["books"].pop(f"{book_id}_{book_hash}", None)
+            if entry and self.index["files"].get(entry["sha256"]) == entry["path"]:
+                del self.index["files"][entry["sha256"]]
+            self.save()
+
+
+class OwnedIndex:
+    """
+    服务器端已拥有书籍的本地索引
+
+    记录 书籍(id+hash) -> 来源（downloaded: 账号的下载记录，saved: 收藏），
+    以及每个账号每个列表上次同步时最新的一条记录（增量同步的终点）。
+    本地状态文件丢失或在其他设备上下载过的书，下载前可以据此跳过。
+    """
+
+    SOURCES = ("downloaded", "saved")
+
+    def __init__(self, index_file: str):
+        self.index_file = index_file
+        self.index = self._load_index()
+        self._lock = threading.RLock()
+
+    def _load_index(self) -> dict:
+        """加载索引文件"""
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"[警告] 加载已拥有书籍索引失败: {e}，使用空索引")
+        return {
+            "books": {},    # {id_hash: {"title": ..., "sources": [...]}}
+            "cursors": {},  # {账号名/列表: 上次同步时最新记录的id_hash}
+            "resume": {},   # {账号名/列表: 未完成的同步的续传点 {"head", "offset", "stop"}}
+            "synced_at": None
+        }
+
+    def save(self):
+        """保存索引到文件"""
+        with self._lock:
+            self.index["synced_at"] = datetime.now().isoformat()
+            with open(self.index_file, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f, ensure_ascii=False, indent=2)
+
+    def find(self, book_id: str, book_hash: str, sources: tuple = OWNED_SKIP_SOURCES) -> str:
+        """按书籍查找，属于给定来源之一时返回该来源，否则返回None"""
+        with self._lock:
+            entry = self.index["books"].get(f"{book_id}_{book_hash}")
+            if entry:
+                return next((source for source in entry["sources"] if source in sources), None)
+        return None
+
+    def add(self, book: dict, source: str):
+        """记录一本服务器端已有的书"""
+        with self._lock:
+            entry = self.index["books"].setdefault(f"{book['id']}_{book['hash']}",
+                                                   {"title": book.get("title"), "sources": []})
+            if source not in entry["sources"]:
+                entry["sources"].append(source)
+
+    def count(self, source: str = None) -> int:
+        """记录数（指定来源时只统计该来源）"""
+        with self._lock:
+            return sum(1 for entry in self.index["books"].values() if source is None or source in entry["sources"])
+
+    def sync_list(self, zlib: Zlibrary, account: str, source: str) -> int:
+        """
+        增量同步一个账号的一个列表（从最新的记录开始翻页，遇到上次同步的终点即停止）
+
+        翻到 OWNED_SYNC_MAX_PAGES 页仍未结束时不移动终点，保存续传点（开始时最新的记录、
+        从它起已检查的条数、本次同步的终点），下次先检查新增的记录，再从续传点继续检查更早的记录。
+
+        Args:
+            zlib: 该账号的Zlibrary实例
+            account: 账号名称
+            source: "downloaded" 或 "saved"
+
+        Returns:
+            新增的记录数
+        """
+        fetch = zlib.getUserDownloaded if source == "downloaded" else zlib.getUserSaved
+        cursor_key = f"{account}/{source}"
+        with self._lock:
+            resume = self.index.setdefault("resume", {}).get(cursor_key)
+            stop = resume["stop"] if resume else self.index["cursors"].get(cursor_key)
+        # 上次未完成的同步开始时最新的记录：遇到时跳过它之后已检查过的 resume["offset"] 条
+        resume_head = resume["head"] if resume else None
+        newest = None
+        offset = 0  # 从最新的记录起已连续检查的条数
+        added = 0
+        complete = False
+        for page in range(OWNED_SYNC_MAX_PAGES):
+            result = fetch(page=offset // OWNED_SYNC_PAGE_SIZE + 1, limit=OWNED_SYNC_PAGE_SIZE)
+            if not result.get("success"):
+                raise RuntimeError(result.get("error") or result.get("message") or "请求失败")
+            page_books = result.get("books", [])
+            skipped = False
+            for book in page_books[offset % OWNED_SYNC_PAGE_SIZE:]:
+                key = f"{book.get('id')}_{book.get('hash')}"
+                if newest is None and page == 0 and book.get("id") and book.get("hash"):
+                    newest = key
+                if key == stop:
+                    complete = True
+                    break
+                if key == resume_head:
+                    offset += resume["offset"]
+                    resume_head = None
+                    skipped = True
+                    break
+                if book.get("id") and book.get("hash"):
+                    self.add(book, source)
+                    added += 1
+                offset += 1
+            if complete or (not skipped and len(page_books) < OWNED_SYNC_PAGE_SIZE):
+                complete = True
+                break
+
+        with self._lock:
+            if complete:
+                self.index["resume"].pop(cursor_key, None)
+                if newest is not None:
+                    self.index["cursors"][cursor_key] = newest
+            else:
+                self.index["resume"][cursor_key] = {"head": newest, "offset": offset, "stop": stop}
+        return added
+
+
+def sync_owned_books(workers: list, owned_index: OwnedIndex):
+    """
+    同步所有账号的下载记录和收藏到本地索引（各账号各列表并发同步）
+
+    Args:
+        workers: [(账号名称, Zlibrary实例, 配额管理器)]
+        owned_index: 已拥有书籍索引
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    print(f"\n🔄 同步服务器端下载记录和收藏...")
+    start_time = time.time()
+    tasks = [(name, zlib, source) for name, zlib, _ in workers for source in OwnedIndex.SOURCES]
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = [(name, source, executor.submit(owned_index.sync_list, zlib, name, source))
+                   for name, zlib, source in tasks]
+        for name, source, future in futures:
+            label = "下载记录" if source == "downloaded" else "收藏"
+            try:
+                added = future.result()
+                if added:
+                    print(f"  ✅ [{name}] {label}: 新增 {added} 条")
+            except Exception as e:
+                print(f"  ⚠️  [{name}] 同步{label}失败: {e}（使用上次同步的记录）")
+    owned_index.save()
+    print(f"✅ 同步完成 ({time.time() - start_time:.2f}秒)：下载记录 {owned_index.count('downloaded')} 本，"
+          f"收藏 {owned_index.count('saved')} 本")
+
+
+class DownloadValidator:
+    """
+    下载后校验：在进程池中与下载并行检查文件结构（EPUB/PDF）并提取内嵌元数据
+
+    结果写入元数据索引；文件损坏或格式不符时改名为 .corrupt，
+    从已下载记录和内容索引中移除，并按临时错误安排重新下载
+    （使用共享队列时同时放回共享队列，由任意节点重新下载）。
+    """
+
+    def __init__(self, download_state: DownloadState, content_index: ContentIndex,
+                 metadata_index: "MetadataIndex", workers: int = VALIDATE_WORKERS,
+                 shared_queue: "SharedWorkQueue" = None):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.download_state = download_state
+        self.content_index = content_index
+        self.metadata_index = metadata_index
+        self.shared_queue = shared_queue
+        self.stats = {"valid": 0, "corrupt": 0}
+        self._lock = threading.Lock()
+        self._pool = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, book: dict, path: str):
+        """提交一个刚下载完成的文件"""
+        from validate import validate_file
+
+        future = self._pool.submit(validate_file, path)
+        future.add_done_callback(lambda done: self._on_done(book, done))
+
+    def _on_done(self, book: dict, future):
+        """处理校验结果（在进程池的结果线程中调用）"""
+        try:
+            result = future.result()
+        except Exception as e:
+            # 校验进程异常不代表文件损坏，只提示
+            print(f"  [警告] 校验文件失败: {book.get('title')} ({e})")
+            return
+        self.metadata_index.add(book['id'], book['hash'], result)
+        if result["valid"]:
+            with self._lock:
+                self.stats["valid"] += 1
+            return
+
+        with self._lock:
+            self.stats["corrupt"] += 1
+        path = result["path"]
+        try:
+            os.replace(path, path + ".corrupt")
+        except OSError:
+            pass
+        self.content_index.remove(book['id'], book['hash'])
+        self.download_state.remove_downloaded(book)
+        entry = self.download_state.add_failed(book, f"文件校验失败: {result['error']}", ERROR_TRANSIENT)
+        self.download_state.save()
+        if self.shared_queue is not None:
+            if entry["gave_up"]:
+                self.shared_queue.complete(book, failed=True)
+            else:
+                self.shared_queue.put(book, self.shared_queue.PRIORITY_RETRY, get_retry_time(entry))
+        print(f"  ⚠️  文件校验失败: {os.path.basename(path)}（{result['error']}），"
+              f"{'已放弃' if entry['gave_up'] else '已安排重新下载'}")
+
+    def close(self):
+        """等待所有校验完成并保存元数据索引"""
+        self._pool.shutdown(wait=True)
+        self.metadata_index.save()
+
+
+def get_retry_delay(fail_count: int) -> float:
+    """第 fail_count 次失败后到下一次重试的等待秒数（指数退避）"""
+    return min(RETRY_BASE_DELAY * 2 ** (fail_count - 1), RETRY_MAX_DELAY)
+
+
+def get_retry_time(entry: dict) -> float:
+    """失败记录的下一次重试时间戳（没有记录时为0，即立即重试）"""
+    if not entry.get("next_retry_at"):
+        return 0.0
+    try:
+        return datetime.fromisoformat(entry["next_retry_at"]).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def is_retryable(entry: dict) -> bool:
+    """失败记录是否还会重试（旧版本状态文件中没有 gave_up 字段，按尝试次数判断）"""
+    return not entry.get("gave_up") and entry.get("fail_count", 0) < RETRY_MAX_ATTEMPTS
+
+
+def classify_error(code: str, message: str) -> str:
+    """
+    下载错误分类
+
+    Args:
+        code: download_book 返回的错误代码（未知异常时为异常信息）
+        message: 错误信息
+
+    Returns:
+        ERROR_TRANSIENT / ERROR_MISSING / ERROR_QUOTA
+    """
+    if code == "download_limit_reached":
+        return ERROR_QUOTA
+    if code == "file_unavailable":
+        return ERROR_MISSING
+    if code in ("download_failed", "download_timeout", "download_truncated"):
+        return ERROR_TRANSIENT
+    # 其他异常按错误信息判断
+    text = f"{code} {message}".lower()
+    if "404" in text or "410" in text or "not found" in text:
+        return ERROR_MISSING
+    return ERROR_TRANSIENT
+
+
+def link_duplicate(src: str, dst: str) -> str:
+    """
+    为重复内容创建链接，依次尝试 reflink、硬链接，都不支持时复制
+
+    Args:
+        src: 已有文件
+        dst: 新文件路径
+
+    Returns:
+        使用的方式: "reflink" / "hardlink" / "copy"
+    """
+    try:
+        import fcntl
+        FICLONE = 0x40049409  # Linux ioctl，btrfs/xfs等支持写时复制的文件系统可用
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return "reflink"
+    except (ImportError, OSError):
+        if os.path.exists(dst):
+            os.remove(dst)
+
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        shutil.copyfile(src, dst)
+        return "copy"
+
+
+def get_unique_path(filepath: str) -> str:
+    """文件已存在时生成不冲突的文件名，如 书名 (1).epub"""
+    if not os.path.exists(filepath):
+        return filepath
+    root, ext = os.path.splitext(filepath)
+    idx = 1
+    while os.path.exists(f"{root} ({idx}){ext}"):
+        idx += 1
+    return f"{root} ({idx}){ext}"
+
+
+def parse_file_size(size_str) -> int:
+    """
+    将文件大小字符串转换为字节数
+
+    Args:
+        size_str: 文件大小（如 "8.2 MB"、"1024"、"N/A"）
+
+    Returns:
+        字节数，无法解析时返回None
+    """
+    if size_str is None:
+        return None
+    if isinstance(size_str, (int, float)):
+        return int(size_str)
+    match = re.match(r'^\s*([\d.]+)\s*([KMGT]?B?)\s*$', str(size_str), re.IGNORECASE)
+    if not match:
+        return None
+    units = {"": 1, "B": 1, "K": 1024, "KB": 1024, "M": 1024 ** 2, "MB": 1024 ** 2,
+             "G": 1024 ** 3, "GB": 1024 ** 3, "T": 1024 ** 4, "TB": 1024 ** 4}
+    try:
+        return int(float(match.group(1)) * units[match.group(2).upper()])
+    except (ValueError, KeyError):
+        return None
+
+
+def prioritize_books(books: list, policy: str = DEFAULT_QUEUE_POLICY) -> list:
+    """
+    按策略对待下载列表排序（稳定排序，同级保持原顺序）
+
+    Args:
+        books: 待下载书籍列表
+        policy: "input" / "smallest" / "oldest"
+
+    Returns:
+        排序后的书籍列表
+    """
+    if policy == "smallest":
+        # 未知大小的排在最后
+        def size_key(book):
+            size = parse_file_size(book.get("file_size"))
+            return (size is None, size or 0)
+        return sorted(books, key=size_key)
+    if policy == "oldest":
+        # 没有等待记录的（本次新增）排在最后
+        return sorted(books, key=lambda b: (b.get("pending_since") is None, b.get("pending_since") or ""))
+    return list(books)
+
+
+def is_deadline_passed(zlib: Zlibrary) -> bool:
+    """是否已超过整批下载时限（未设置时限时返回False）"""
+    remaining = zlib.getRemainingTime()
+    return remaining is not None and remaining <= 0
+
+
+def get_arg_value(name: str, default: str = None) -> str:
+    """
+    读取命令行参数值，支持 "--name value" 和 "--name=value" 两种写法
+
+    Args:
+        name: 参数名（如 "--policy"）
+        default: 默认值
+
+    Returns:
+        参数值
+    """
+    for idx, arg in enumerate(sys.argv):
+        if arg == name and idx + 1 < len(sys.argv):
+            return sys.argv[idx + 1]
+        if arg.startswith(name + "="):
+            return arg.split("=", 1)[1]
+    return default
+
+
+# 结果文件中以此开头的行表示只下载标记了v的版本（与 batch_search.MANUAL_SELECTION_LINE 一致）
+MANUAL_SELECTION_MARK = "下载方式: 只下载标记了v的版本"
+
+
 def parse_list_file(input_file: str) -> list:
     """
     解析list.txt文件，提取要下载的版本
 
     规则:
     1. 有 v 标记的版本优先下载
-    2. 如果没有 v 标记但只有一个版本，自动下载
+    2. 如果没有 v 标记但只有一个版本，自动下载（文件中有 MANUAL_SELECTION_MARK 时不自动下载，
+       如 crawl_similar.py 生成的候选列表）
 
     Args:
         input_file: list.txt文件路径
@@ -138,6 +783,7 @@ def parse_list_file(input_file: str) -> list:
 
     current_book_info = {}
     in_version_block = False
+    auto_single = not any(line.startswith(MANUAL_SELECTION_MARK) for line in lines)
     marked_versions = {}  # {book_key: book_info}
     all_versions = {}     # {book_title: [book_info_list]}
 
@@ -167,6 +813,8 @@ def parse_list_file(input_file: str) -> list:
                 current_book_info['year'] = stripped_line.split(':', 1)[1].strip()
             elif stripped_line.startswith('语言:'):
                 current_book_info['language'] = stripped_line.split(':', 1)[1].strip()
+            elif stripped_line.startswith('文件大小:'):
+                current_book_info['file_size'] = stripped_line.split(':', 1)[1].strip()
             elif stripped_line.startswith('ID:'):
                 current_book_info['id'] = stripped_line.split(':', 1)[1].strip()
             elif stripped_line.startswith('Hash:'):
@@ -240,17 +888,21 @@ def parse_list_file(input_file: str) -> list:
                 break
 
         # 如果没有标记且只有一个版本，自动下载
-        if not has_marked and len(versions) == 1:
+        if auto_single and not has_marked and len(versions) == 1:
             if versions[0]['id'] not in [b['id'] for b in books_to_download]:
                 books_to_download.append(versions[0])
 
     return books_to_download
 
 
-def download_book(zlib: Zlibrary, book_id: str, book_hash: str, output_dir: str, title: str, author: str, publisher: str) -> tuple:
+def download_book(zlib: Zlibrary, book_id: str, book_hash: str, output_dir: str, title: str, author: str, publisher: str,
+                  quota: QuotaManager = None, content_index: ContentIndex = None) -> tuple:
     """
     下载单本书籍
 
+    边下载边写入临时文件并计算SHA-256，不把整个文件读入内存；
+    收到的字节数与Content-Length不符时视为下载不完整，不保存。
+
     Args:
         zlib: Zlibrary实例
         book_id: 书籍ID
@@ -259,51 +911,114 @@ def download_book(zlib: Zlibrary, book_id: str, book_hash: str, output_dir: str,
         title: 书名（用于显示）
         author: 作者（用于显示）
         publisher: 出版社（用于显示）
+        quota: 配额管理器（提供时出错后通过它同步剩余次数）
+        content_index: 内容索引（提供时对相同内容去重）
 
     Returns:
         (成功标志, 文件路径或错误信息)
     """
+    part_path = None
     try:
         print(f"      [下载请求] 正在获取下载链接...")
         start_time = time.time()
 
-        # 使用 downloadBook 方法
+        # 使用 downloadBookStream 方法
         book_dict = {
             "id": book_id,
             "hash": book_hash
         }
 
-        result = zlib.downloadBook(book_dict)
+        result = zlib.downloadBookStream(book_dict)
 
         elapsed_time = time.time() - start_time
 
         if result is None:
             print(f"      [下载请求] 完成 (耗时: {elapsed_time:.2f}秒)")
+            if is_deadline_passed(zlib):
+                return False, "deadline_exceeded", "已达到整批下载时限，下载已取消"
             # 检查是否是次数限制
-            downloads_left = zlib.getDownloadsLeft()
+            downloads_left = quota.resync() if quota is not None else zlib.getDownloadsLeft()
             if downloads_left <= 0:
                 return False, "download_limit_reached", "今日下载次数已用尽"
-            return False, "download_failed", "下载失败，返回结果为空"
+            error = zlib.getLastFileError() or {}
+            if error.get("retryable"):
+                return False, "download_failed", error.get("message")
+            return False, "file_unavailable", f"文件不可用: {error.get('message', '没有下载链接')}"
 
-        filename, content = result
+        filename, response = result
         print(f"      [下载请求] 完成 (耗时: {elapsed_time:.2f}秒)")
 
-        # 保存文件
+        # 保存文件（流式写入临时文件，同时计算SHA-256）
         print(f"      [文件保存] 正在保存: {filename}")
         save_start = time.time()
 
         # 创建输出目录
         os.makedirs(output_dir, exist_ok=True)
         filepath = os.path.join(output_dir, filename)
+        part_path = filepath + ".part"
+
+        # 有Content-Encoding时Content-Length是压缩后的长度，无法用于校验
+        expected_size = None
+        if not response.headers.get("Content-Encoding") and response.headers.get("Content-Length"):
+            expected_size = int(response.headers["Content-Length"])
+
+        sha256 = hashlib.sha256()
+        file_size = 0
+        # 单个文件的总时限；每个数据块之间检查是否超时或被取消
+        download_deadline = time.monotonic() + zlib.getTotalTimeout("download")
+        aborted = None
+        try:
+            with open(part_path, 'wb') as f:
+                for chunk in profiling.track_network(response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE),
+                                                     "download"):
+                    if chunk:
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        file_size += len(chunk)
+                    if is_deadline_passed(zlib):
+                        aborted = ("deadline_exceeded", "已达到整批下载时限，下载已取消")
+                        break
+                    if time.monotonic() > download_deadline:
+                        aborted = ("download_timeout", f"下载超过时限 ({zlib.getTotalTimeout('download'):.0f}秒)")
+                        break
+        finally:
+            response.close()
+
+        if aborted:
+            os.remove(part_path)
+            print(f"      [文件保存] 中止: {aborted[1]}")
+            return False, aborted[0], aborted[1]
+
+        if file_size == 0 or (expected_size is not None and file_size != expected_size):
+            os.remove(part_path)
+            message = f"文件不完整 (收到 {file_size} 字节，应为 {expected_size if expected_size is not None else '未知'} 字节)"
+            print(f"      [文件保存] 失败: {message}")
+            return False, "download_truncated", message
+
+        digest = sha256.hexdigest()
+        existing_path = content_index.find_content(digest, file_size) if content_index is not None else None
+
+        if existing_path:
+            # 相同内容已下载过（可能是不同ID），不保存第二份
+            os.remove(part_path)
+            if os.path.abspath(existing_path) != os.path.abspath(filepath):
+                filepath = get_unique_path(filepath)
+                method = link_duplicate(existing_path, filepath)
+            else:
+                method = "same"
+            print(f"      [文件保存] 内容与已有文件相同: {existing_path} ({method})")
+        else:
+            filepath = get_unique_path(filepath)
+            os.replace(part_path, filepath)
+        part_path = None
 
-        with open(filepath, 'wb') as f:
-            f.write(content)
+        if content_index is not None:
+            content_index.add(book_id, book_hash, digest, file_size, filepath)
 
         save_elapsed = time.time() - save_start
-        file_size = os.path.getsize(filepath)
         file_size_mb = file_size / (1024 * 1024)
 
-        print(f"      [文件保存] 完成 (大小: {file_size_mb:.2f}MB, 耗时: {save_elapsed:.2f}秒)")
+        print(f"      [文件保存] 完成 (大小: {file_size_mb:.2f}MB, SHA-256: {digest[:16]}..., 耗时: {save_elapsed:.2f}秒)")
 
         return True, filepath, "下载成功"
 
@@ -313,61 +1028,318 @@ def download_book(zlib: Zlibrary, book_id: str, book_hash: str, output_dir: str,
         print(f"      [下载请求] 失败 (耗时: {elapsed_time:.2f}秒)")
         print(f"      [错误详情] {error_msg}")
 
+        # 清理未完成的临时文件
+        if part_path and os.path.exists(part_path):
+            os.remove(part_path)
+
         # 检查是否是次数限制
         if "limit" in error_msg.lower() or "quota" in error_msg.lower():
             return False, "download_limit_reached", error_msg
         return False, error_msg, error_msg
 
+class DownloadQueue:
+    """
+    线程安全的优先级下载队列
 
-def main():
-    """主函数"""
-    import requests  # 导入requests库
-
-    print("=" * 100)
-    print("Zlibrary 批量下载工具")
-    print("=" * 100)
+    多个账号的下载线程从同一个队列取书，每本书只会被一个线程取走，因此不会重复下载。
+    按 (优先级, 可开始时间, 入队顺序) 出队:
+    - PRIORITY_PUT_BACK: 因次数限制未能下载、放回的书，由其他账号优先继续处理
+    - PRIORITY_NORMAL: 本次标记的书和上次留下的待下载任务
+    - PRIORITY_RETRY: 失败后等待重试的书，退避时间到达前不会被取出
+    """
 
-    # 检查命令行参数
-    dry_run = "--dry-run" in sys.argv or "-d" in sys.argv
-    force = "--force" in sys.argv or "-f" in sys.argv
+    PRIORITY_PUT_BACK = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_RETRY = 2
+
+    # 队列只在内存中，结束时剩余的书需要保存为待下载任务
+    persistent = False
+
+    def __init__(self, books: list, retries: list = None):
+        """
+        Args:
+            books: 待下载书籍列表（按此顺序下载）
+            retries: 需要重试的书籍 [(书籍, 可以重试的时间戳)]
+        """
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        for book in books:
+            self.put(book)
+        for book, ready_at in retries or []:
+            self.put(book, self.PRIORITY_RETRY, ready_at)
+
+    def put(self, book: dict, priority: int = PRIORITY_NORMAL, ready_at: float = 0.0):
+        """加入一本书，ready_at为最早可以开始下载的时间戳"""
+        with self._cond:
+            heapq.heappush(self._heap, (priority, ready_at, next(self._counter), book))
+            self._cond.notify()
+
+    def put_back(self, book: dict):
+        """将未能下载的书放回队首"""
+        self.put(book, self.PRIORITY_PUT_BACK)
+
+    def complete(self, book: dict, failed: bool = False) -> bool:
+        """标记下载完成（取出时已从队列中移除，无需处理；与 SharedWorkQueue 接口相同）"""
+        return True
+
+    def take(self, max_wait: float = 0) -> dict:
+        """
+        取出下一本可以开始下载的书
+
+        Args:
+            max_wait: 只剩等待重试的书时，最多等待的秒数
+
+        Returns:
+            书籍字典，队列为空或最近的重试超过等待时间时返回None
+        """
+        with self._cond:
+            while self._heap:
+                ready_at = self._heap[0][1]
+                delay = ready_at - time.time()
+                if delay <= 0:
+                    return heapq.heappop(self._heap)[3]
+                if delay > max_wait:
+                    return None
+                # 等待期间有新书放回时会被唤醒
+                self._cond.wait(timeout=delay)
+            return None
+
+    def remaining(self, include_retries: bool = False) -> list:
+        """返回队列中剩余的书籍（默认不含等待重试的书，它们已记录在失败列表中）"""
+        with self._cond:
+            return [item[3] for item in sorted(self._heap)
+                    if include_retries or item[0] != self.PRIORITY_RETRY]
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+
+def get_accounts() -> list:
+    """
+    获取要使用的账号列表
 
-    if dry_run:
-        print("\n🔍 Dry-run模式：仅预览，不实际下载")
-    elif force:
-        print("\n⚠️  强制模式：忽略已下载记录")
+    Returns:
+        账号配置列表（DEFAULT_ACCOUNTS为空时使用单账号配置）
+    """
+    if DEFAULT_ACCOUNTS:
+        # 每个账号使用独立的登录缓存文件
+        root, ext = os.path.splitext(SESSION_CACHE_FILE)
+        return [{"name": account.get("name") or f"账号{idx}",
+                 "session_file": f"{root}_{idx}{ext}",
+                 **account}
+                for idx, account in enumerate(DEFAULT_ACCOUNTS, 1)]
+    return [{
+        "name": "默认账号",
+        "session_file": SESSION_CACHE_FILE,
+        "email": DEFAULT_EMAIL,
+        "password": DEFAULT_PASSWORD,
+        "remix_userid": DEFAULT_REMIX_USERID,
+        "remix_userkey": DEFAULT_REMIX_USERKEY,
+    }]
+
+
+def login_account(account: dict) -> Zlibrary:
+    """
+    登录单个账号
 
-    print("=" * 100)
+    Args:
+        account: 账号配置
 
-    # 登录
-    if DEFAULT_REMIX_USERID and DEFAULT_REMIX_USERKEY:
-        print(f"\n使用Remix Token登录...")
-        zlib = Zlibrary(remix_userid=DEFAULT_REMIX_USERID, remix_userkey=DEFAULT_REMIX_USERKEY)
+    Returns:
+        Zlibrary实例（登录失败时返回None）
+    """
+    session_file = account.get("session_file")
+    if account.get("remix_userid") and account.get("remix_userkey"):
+        print(f"\n[{account['name']}] 使用Remix Token登录...")
+        zlib = Zlibrary(remix_userid=account["remix_userid"], remix_userkey=account["remix_userkey"],
+                        session_file=session_file, timeouts=REQUEST_TIMEOUTS)
     else:
-        print(f"\n使用邮箱+密码登录: {DEFAULT_EMAIL}")
-        print(f"  [状态] 正在连接服务器...")
-        zlib = Zlibrary(email=DEFAULT_EMAIL, password=DEFAULT_PASSWORD)
+        print(f"\n[{account['name']}] 使用邮箱+密码登录: {account.get('email')}")
+        zlib = Zlibrary(email=account.get("email"), password=account.get("password"),
+                        session_file=session_file, timeouts=REQUEST_TIMEOUTS)
 
     if not zlib.isLoggedIn():
-        print("\n❌ 登录失败！请检查配置")
-        return
+        print(f"  ❌ [{account['name']}] 登录失败！请检查配置")
+        return None
+    return zlib
 
-    profile = zlib.getProfile()
-    print(f"\n✅ 登录成功!")
-    print(f"   用户: {profile['user']['name']}")
-    downloads_left = zlib.getDownloadsLeft()
-    print(f"   今日剩余下载次数: {downloads_left}")
 
-    # 加载下载状态
-    download_state = DownloadState(DEFAULT_STATE_FILE)
+def download_worker(name: str, zlib: Zlibrary, quota: QuotaManager, queue,
+                    download_state: DownloadState, output_dir: str, total: int,
+                    content_index: ContentIndex = None, owned_index: OwnedIndex = None,
+                    validator: DownloadValidator = None) -> dict:
+    """
+    单个账号的下载线程：从共享队列取书下载，直到队列为空或本账号次数用尽
 
+    Args:
+        name: 账号名称（用于显示）
+        zlib: 该账号的Zlibrary实例
+        quota: 该账号的配额管理器
+        queue: 共享的待下载队列（DownloadQueue，或多台机器共用的 SharedWorkQueue）
+        download_state: 共享的下载状态
+        output_dir: 输出目录
+        total: 待下载总数（用于显示进度）
+        content_index: 共享的内容索引
+        owned_index: 服务器端已拥有书籍索引（为None时不检查）
+        validator: 下载后校验（为None时不校验）
+
+    Returns:
+        统计信息 {"downloaded": n, "failed": n, "retried": n, "skipped": n, "owned": n, "limited": bool}
+    """
+    stats = {"downloaded": 0, "failed": 0, "retried": 0, "skipped": 0, "owned": 0, "limited": False}
+
+    while True:
+        if is_deadline_passed(zlib):
+            print(f"\n⏰ [{name}] 已达到整批下载时限，停止下载")
+            break
+
+        if not quota.has_quota():
+            print(f"\n⚠️  [{name}] 已达到今日下载限制 (本次已下载 {stats['downloaded']} 次)")
+            stats["limited"] = True
+            break
+
+        # 只剩等待重试的书时，在本次运行允许的时间内等待
+        max_wait = RETRY_MAX_WAIT
+        remaining_time = zlib.getRemainingTime()
+        if remaining_time is not None:
+            max_wait = min(max_wait, remaining_time)
+        book = queue.take(max_wait=max_wait)
+        if book is None:
+            break
+
+        # 合并为一次输出，避免多账号并行时内容交错
+        print(f"\n{'─' * 100}\n"
+              f" [{name}] [{total - len(queue)}/{total}] {book['title']}\n"
+              f"{'─' * 100}\n"
+              f"   ID: {book['id']} | Hash: {book['hash']}\n"
+              f"   作者: {book['author']}\n"
+              f"   出版社: {book['publisher']}")
+
+        # 本地已有该书的完整文件时直接跳过，不消耗下载次数
+        existing_path = content_index.find_book(book['id'], book['hash']) if content_index is not None else None
+        if existing_path:
+            download_state.add_downloaded(book)
+            download_state.save()
+            queue.complete(book)
+            stats["skipped"] += 1
+            print(f"  ⏭️  [{name}] 文件已存在，跳过下载: {existing_path}")
+            continue
+
+        # 服务器端记录中已下载过（如在其他设备上），跳过，不消耗下载次数。
+        # 本地有失败记录（下载重试、文件校验失败后重新下载）的书需要本地文件，不跳过：
+        # 服务器的下载记录中也包含本机之前下载的书。本地没有文件，不记为已下载
+        owned_source = None
+        if owned_index is not None and download_state.get_failed(book) is None:
+            owned_source = owned_index.find(book['id'], book['hash'])
+        if owned_source:
+            download_state.remove_pending(book)
+            download_state.save()
+            queue.complete(book)
+            stats["owned"] += 1
+            label = "下载记录" if owned_source == "downloaded" else "收藏"
+            print(f"  ⏭️  [{name}] 账号{label}中已有，跳过下载（使用 --ignore-owned 重新下载）")
+            continue
+
+        success, result, message = download_book(
+            zlib, book['id'], book['hash'], output_dir,
+            book.get('title', ''), book.get('author', ''), book.get('publisher', ''),
+            quota=quota, content_index=content_index
+        )
+
+        if success:
+            # 下载成功
+            download_state.add_downloaded(book)
+            download_state.save()
+            queue.complete(book)
+            stats["downloaded"] += 1
+            quota.consume()
+            print(f"  ✅ [{name}] 下载成功: {result}")
+            if validator is not None:
+                validator.submit(book, result)
+        elif result == "deadline_exceeded":
+            # 整批时限已到：放回队列，保存为待下载任务
+            print(f"  ⏰ [{name}] {message}")
+            queue.put_back(book)
+            break
+        elif result == "download_limit_reached":
+            # 下载次数限制：放回队列，由其他账号继续下载
+            print(f"  ⚠️  [{name}] {message}")
+            queue.put_back(book)
+            stats["limited"] = True
+            break
+        else:
+            # 下载失败：临时错误按退避时间重新入队，永久错误不再重试
+            error_class = classify_error(result, message)
+            entry = download_state.add_failed(book, message, error_class)
+            download_state.save()
+            if entry["gave_up"]:
+                queue.complete(book, failed=True)
+                reason = "文件不可用" if error_class == ERROR_MISSING else f"已尝试 {entry['fail_count']} 次"
+                print(f"  ❌ [{name}] 下载失败: {message}（{reason}，不再重试）")
+                stats["failed"] += 1
+            else:
+                delay = get_retry_delay(entry["fail_count"])
+                print(f"  🔁 [{name}] 下载失败: {message}（{delay:g}秒后重试，"
+                      f"第 {entry['fail_count']}/{RETRY_MAX_ATTEMPTS} 次）")
+                queue.put(book, DownloadQueue.PRIORITY_RETRY, get_retry_time(entry))
+                stats["retried"] += 1
+
+    return stats
+
+
+def login_workers() -> list:
+    """
+    登录所有账号（每个账号独立的会话和配额）
+
+    Returns:
+        [(账号名称, Zlibrary实例, 配额管理器)]，登录失败的账号不包含在内
+    """
+    workers = []
+    for account in get_accounts():
+        zlib = login_account(account)
+        if zlib is None:
+            continue
+
+        # 优先使用缓存的个人资料，避免启动时的网络请求
+        profile = zlib.getCachedProfile(PROFILE_CACHE_MAX_AGE)
+        if profile is None:
+            profile = zlib.getProfile()
+        else:
+            print(f"  [状态] 使用缓存的个人资料")
+        # 配额在本地计数，下载成功后扣减，仅在出错或超过同步间隔时再请求服务器
+        quota = QuotaManager(zlib, profile['user'], synced_at=zlib.getCachedProfileTime())
+        print(f"\n✅ [{account['name']}] 登录成功!")
+        print(f"   用户: {profile['user']['name']}")
+        print(f"   今日剩余下载次数: {quota.remaining}")
+        workers.append((account['name'], zlib, quota))
+    return workers
+
+
+def collect_books(download_state: DownloadState, force: bool = False, retry_failed: bool = False,
+                  policy: str = DEFAULT_QUEUE_POLICY, input_file: str = DEFAULT_INPUT_FILE) -> tuple:
+    """
+    汇总要下载的书：list.txt中标记的版本 + 上次留下的待下载任务 + 需要重试的失败任务
+
+    Args:
+        download_state: 下载状态
+        force: 忽略已下载和失败记录
+        retry_failed: 重置所有失败记录
+        policy: 待下载队列排序策略
+        input_file: 输入文件（batch_search 或 crawl_similar 的结果文件）
+
+    Returns:
+        (待下载书籍列表, 需要重试的书籍 [(书籍, 可以重试的时间戳)])，没有标记的版本时返回None
+    """
     # 解析list.txt
-    print(f"\n正在解析文件: {DEFAULT_INPUT_FILE}")
+    print(f"\n正在解析文件: {input_file}")
     print(f"[状态] 正在读取文件...", flush=True)
-    books_to_download = parse_list_file(DEFAULT_INPUT_FILE)
+    books_to_download = parse_list_file(input_file)
 
     if not books_to_download:
         print("❌ 未找到标记了v的版本")
-        return
+        return None
 
     print(f"✅ 找到 {len(books_to_download)} 个标记版本")
 
@@ -377,7 +1349,6 @@ def main():
         print(f"[状态] 正在合并待下载列表...", flush=True)
         pending_books = download_state.state["pending"]
         # 去重：基于id+hash
-        pending_keys = set(f"{b['id']}_{b['hash']}" for b in pending_books)
         existing_keys = set(f"{b['id']}_{b['hash']}" for b in books_to_download)
 
         for book in pending_books:
@@ -395,10 +1366,507 @@ def main():
         print(f"[注意] 已下载: {download_state.get_downloaded_count()} 本")
         print(f"✅ 过滤后待下载: {len(books_to_download)} 本")
 
-    if not books_to_download:
+    # 失败重试：已放弃的书不再下载，未到重试时间的书按退避时间排队
+    retry_books = []
+    if retry_failed:
+        print(f"[注意] 已重置 {download_state.reset_failed()} 个失败记录，全部重新尝试")
+    if not force:
+        gave_up_count = 0
+        normal_books = []
+        for book in books_to_download:
+            entry = download_state.get_failed(book)
+            if entry is None:
+                normal_books.append(book)
+            elif not is_retryable(entry):
+                gave_up_count += 1
+            elif get_retry_time(entry) > time.time():
+                retry_books.append((book, get_retry_time(entry)))
+            else:
+                normal_books.append(book)
+        books_to_download = normal_books
+
+        # 失败列表中其他需要重试的书（上次运行失败、不在本次列表中）
+        queued_keys = set(f"{b['id']}_{b['hash']}" for b in books_to_download)
+        queued_keys.update(f"{b['id']}_{b['hash']}" for b, _ in retry_books)
+        for book, ready_at in download_state.get_retry_books():
+            book_key = f"{book['id']}_{book['hash']}"
+            if book_key not in queued_keys:
+                retry_books.append((book, ready_at))
+                queued_keys.add(book_key)
+
+        if gave_up_count:
+            print(f"[注意] 跳过 {gave_up_count} 本已放弃的书（文件不可用或超过最多尝试次数，可用 --retry-failed 重新尝试）")
+        if retry_books:
+            due_count = sum(1 for _, ready_at in retry_books if ready_at <= time.time())
+            print(f"[注意] 失败重试: {len(retry_books)} 本（其中 {due_count} 本已到重试时间）")
+
+    # 按策略排序待下载队列
+    if books_to_download and policy != "input":
+        books_to_download = prioritize_books(books_to_download, policy)
+        print(f"[注意] 待下载队列排序策略: {policy}")
+
+    return books_to_download, retry_books
+
+
+def fill_shared_queue(shared_queue: "SharedWorkQueue", books_to_download: list, retry_books: list,
+                      requeue: tuple = ()) -> int:
+    """
+    把本机汇总的待下载书籍加入共享队列（已在队列中、其他节点正在下载或已完成的书不变）
+
+    Args:
+        shared_queue: 共享下载队列
+        books_to_download: 待下载书籍列表
+        retry_books: 需要重试的书籍 [(书籍, 可以重试的时间戳)]
+        requeue: 这些状态的已有任务重新放回队列（--force: done和failed，--retry-failed: failed）
+
+    Returns:
+        新加入共享队列的数量
+    """
+    added = shared_queue.enqueue(books_to_download, requeue=requeue)
+    for book, ready_at in retry_books:
+        added += shared_queue.enqueue([book], shared_queue.PRIORITY_RETRY, ready_at, requeue)
+    counts = shared_queue.counts()
+    print(f"\n🌐 共享队列: 新加入 {added} 本 | 等待下载 {counts['queued']} 本 | "
+          f"其他节点下载中 {counts['leased']} 本 | 已完成 {counts['done']} 本 | 已放弃 {counts['failed']} 本")
+    return added
+
+
+def run_downloads(workers: list, download_state: DownloadState, books_to_download: list,
+                  retry_books: list, owned_index: OwnedIndex = None,
+                  shared_queue: "SharedWorkQueue" = None) -> dict:
+    """
+    各账号并行从共享队列取书下载，结束后把未下载的书保存为待下载任务
+
+    Args:
+        workers: [(账号名称, Zlibrary实例, 配额管理器)]
+        download_state: 下载状态
+        books_to_download: 待下载书籍列表
+        retry_books: 需要重试的书籍 [(书籍, 可以重试的时间戳)]
+        owned_index: 服务器端已拥有书籍索引（为None时不检查）
+        shared_queue: 多台机器共用的下载队列（为None时使用本机内存中的队列）；
+                      books_to_download / retry_books 需要先用 fill_shared_queue 加入
+
+    Returns:
+        本次统计 {"downloaded", "failed", "skipped", "owned", "corrupt", "pending", "retrying"}
+    """
+    print("\n" + "=" * 100)
+    print("开始下载...")
+    print("=" * 100)
+
+    # 各账号并行从共享队列取书，按各自剩余次数自然分摊
+    queue = shared_queue if shared_queue is not None else DownloadQueue(books_to_download, retry_books)
+    content_index = ContentIndex(DEFAULT_CONTENT_INDEX_FILE)
+    validator = None
+    if VALIDATE_WORKERS > 0:
+        from validate import MetadataIndex
+
+        validator = DownloadValidator(download_state, content_index,
+                                      MetadataIndex(DEFAULT_METADATA_INDEX_FILE), VALIDATE_WORKERS,
+                                      shared_queue)
+    results = [None] * len(workers)
+    total = len(queue)
+
+    def run_worker(idx, name, zlib, quota):
+        results[idx] = download_worker(name, zlib, quota, queue, download_state,
+                                       DEFAULT_OUTPUT_DIR, total, content_index, owned_index, validator)
+
+    threads = [threading.Thread(target=run_worker, args=(idx, name, zlib, quota), daemon=True)
+               for idx, (name, zlib, quota) in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if validator is not None:
+        validator.close()
+
+    # 队列中剩余的书籍（所有账号次数都已用尽或已到时限）保存为待下载任务
+    remaining_books = queue.remaining()
+    if remaining_books and queue.persistent:
+        print(f"\n🌐 共享队列中还有 {len(remaining_books)} 本等待下载（由其他节点或下次运行继续）")
+    elif remaining_books:
+        if any(is_deadline_passed(zlib) for _, zlib, _ in workers):
+            print(f"\n⏰ 已达到整批下载时限")
+        else:
+            print(f"\n⚠️  所有账号已达到今日下载限制")
+        print(f"   将剩余 {len(remaining_books)} 本保存为待下载任务")
+        for remaining_book in remaining_books:
+            download_state.add_pending(remaining_book)
+        download_state.save()
+
+    return {
+        "downloaded": sum(r["downloaded"] for r in results if r),
+        "failed": sum(r["failed"] for r in results if r),
+        "skipped": sum(r["skipped"] for r in results if r),
+        "owned": sum(r["owned"] for r in results if r),
+        "corrupt": validator.stats["corrupt"] if validator is not None else 0,
+        "pending": len(remaining_books),
+        "retrying": len(queue.remaining(include_retries=True)) - len(remaining_books),
+    }
+
+
+def print_summary(stats: dict, download_state: DownloadState):
+    """输出本次和累计统计"""
+    print("\n" + "=" * 100)
+    print(f"✅ 下载完成！")
+    print("=" * 100)
+    print(f"\n📊 本次统计:")
+    print(f"  成功: {stats['downloaded']} 本")
+    if stats["skipped"]:
+        print(f"  跳过: {stats['skipped']} 本（本地已有文件）")
+    if stats["owned"]:
+        print(f"  跳过: {stats['owned']} 本（账号下载记录中已有）")
+    if stats["corrupt"]:
+        print(f"  校验失败: {stats['corrupt']} 本（文件损坏或格式不符，已安排重新下载）")
+    print(f"  待下载: {stats['pending']} 本（因次数限制或时限）")
+    print(f"  失败: {stats['failed']} 本（不再重试）")
+    if stats["retrying"]:
+        print(f"  等待重试: {stats['retrying']} 本（下次运行时到达重试时间后自动重试）")
+
+    print(f"\n📋 累计统计:")
+    print(f"  已下载总数: {download_state.get_downloaded_count()} 本")
+    print(f"  待下载总数: {download_state.get_pending_count()} 本")
+
+    if download_state.get_pending_count() > 0:
+        print(f"\n💡 提示: 下次运行时会自动下载待下载任务")
+
+    print(f"\n📁 文件保存位置: {os.path.abspath(DEFAULT_OUTPUT_DIR)}")
+    print(f"📄 状态文件: {os.path.abspath(DEFAULT_STATE_FILE)}")
+    print("=" * 100)
+
+
+def get_next_quota_reset(workers: list = ()) -> float:
+    """
+    下一次每日下载次数重置的时间戳
+
+    有账号从个人资料观察到过重置（QuotaManager.reset_at）时，按最近一次观察到的时间每24小时重置；
+    否则按每天 QUOTA_RESET_UTC_HOUR 点（UTC）
+    """
+    observed = [quota.reset_at for _, _, quota in workers if quota.reset_at is not None]
+    if observed:
+        last_reset = max(observed)
+        days = max(int((time.time() - last_reset) // 86400) + 1, 1)
+        return last_reset + days * 86400
+    now = datetime.now(timezone.utc)
+    reset = now.replace(hour=QUOTA_RESET_UTC_HOUR, minute=0, second=0, microsecond=0)
+    if reset <= now:
+        reset += timedelta(days=1)
+    return reset.timestamp()
+
+
+def format_timestamp(timestamp: float) -> str:
+    """时间戳 -> 本地时间字符串（None时返回None）"""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp).isoformat(timespec="seconds")
+
+
+class DaemonStatus:
+    """守护进程的运行状态，供状态接口读取"""
+
+    def __init__(self, workers: list, download_state: DownloadState):
+        self._workers = workers
+        self._download_state = download_state
+        self._lock = threading.Lock()
+        self._fields = {
+            "state": "starting",  # starting / downloading / waiting_quota / idle / error
+            "started_at": format_timestamp(time.time()),
+            "last_run_at": None,
+            "last_run": None,
+            "runs": 0,
+            "next_check_at": None,
+            "next_retry_at": None,
+            "next_quota_reset_at": None,
+            "errors": 0,  # 处理出错的次数（出错后等到下一次检查重试）
+            "last_error": None,
+            "last_error_at": None,
+        }
+
+    def update(self, **fields):
+        """更新状态字段"""
+        with self._lock:
+            self._fields.update(fields)
+
+    def snapshot(self) -> dict:
+        """返回当前状态（JSON可序列化）"""
+        with self._lock:
+            status = dict(self._fields)
+        status["accounts"] = [{"name": name, "downloads_left": quota.remaining}
+                              for name, _, quota in self._workers]
+        status["downloaded_total"] = self._download_state.get_downloaded_count()
+        status["pending_total"] = self._download_state.get_pending_count()
+        status["retrying_total"] = len(self._download_state.get_retry_books())
+        return status
+
+
+def start_status_server(status: DaemonStatus, host: str, port: int):
+    """
+    在后台线程中启动状态接口（GET / 或 /status 返回JSON）
+
+    Returns:
+        HTTP服务器（用 shutdown() 停止），启动失败时返回None
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0].rstrip("/") not in ("", "/status"):
+                self.send_error(404)
+                return
+            body = json.dumps(status.snapshot(), ensure_ascii=False, indent=2).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # 不输出访问日志
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), StatusHandler)
+    except OSError as e:
+        print(f"[警告] 状态接口启动失败 ({host}:{port}): {e}")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_daemon(workers: list, download_state: DownloadState, policy: str, status_port: int,
+               input_file: str = DEFAULT_INPUT_FILE, owned_index: OwnedIndex = None,
+               shared_queue: "SharedWorkQueue" = None):
+    """
+    守护进程模式：常驻运行，保持登录状态
+
+    - 输入文件有变化时立即处理新标记的书
+    - 下载次数用尽后等到每日重置时间，重新同步配额后立即继续下载
+    - 失败重试到达重试时间时自动下载
+    - 本地状态接口: http://DAEMON_STATUS_HOST:端口/status
+
+    Args:
+        workers: [(账号名称, Zlibrary实例, 配额管理器)]
+        download_state: 下载状态
+        policy: 待下载队列排序策略
+        status_port: 状态接口端口，0表示不开启
+        input_file: 监视的输入文件
+        owned_index: 服务器端已拥有书籍索引（为None时不同步、不检查）
+        shared_queue: 多台机器共用的下载队列（为None时不使用）；其他节点加入的书也会下载
+    """
+    status = DaemonStatus(workers, download_state)
+    server = start_status_server(status, DAEMON_STATUS_HOST, status_port) if status_port else None
+
+    print("\n" + "=" * 100)
+    print("🛰️  守护进程模式：常驻运行，按 Ctrl+C 停止")
+    print(f"   监视输入文件: {os.path.abspath(input_file)}（每 {DAEMON_POLL_INTERVAL:g} 秒检查一次）")
+    if server is not None:
+        print(f"   状态接口: http://{DAEMON_STATUS_HOST}:{server.server_address[1]}/status")
+    print("=" * 100)
+
+    # 服务管理器（systemd等）用 SIGTERM 停止进程时，与 Ctrl+C 一样正常退出
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    input_mtime = None
+    next_reset = get_next_quota_reset(workers)
+    next_retry = None
+    need_run = True
+    error_count = 0
+
+    try:
+        while True:
+            try:
+                now = time.time()
+
+                # 输入文件有变化
+                mtime = os.path.getmtime(input_file) if os.path.exists(input_file) else None
+                if mtime != input_mtime:
+                    if input_mtime is not None:
+                        print(f"\n📝 [{format_timestamp(now)}] 输入文件有变化")
+                    input_mtime = mtime
+                    need_run = True
+
+                # 到达每日重置时间：重新同步所有账号的配额
+                if now >= next_reset:
+                    print(f"\n🔄 [{format_timestamp(now)}] 每日下载次数已重置，同步配额...")
+                    for _, _, quota in workers:
+                        quota.resync()
+                    next_reset = get_next_quota_reset(workers)
+                    need_run = True
+
+                # 失败重试到达重试时间
+                if next_retry is not None and now >= next_retry:
+                    next_retry = None
+                    need_run = True
+
+                # 共享队列中有可以下载的书（其他节点加入、重试时间已到或租约已过期）
+                if shared_queue is not None and shared_queue.ready_count() > 0:
+                    need_run = True
+
+                # has_quota 超过同步间隔时会请求服务器，同时保持会话活跃
+                was_exhausted = status.snapshot()["state"] == "waiting_quota"
+                has_quota = any(quota.has_quota() for _, _, quota in workers)
+                if was_exhausted and has_quota:
+                    need_run = True
+                # 同步时可能从个人资料观察到了重置，按观察到的时间推算下一次重置
+                next_reset = get_next_quota_reset(workers)
+
+                if need_run and has_quota:
+                    need_run = False
+                    collected = None
+                    if os.path.exists(input_file):
+                        collected = collect_books(download_state, policy=policy, input_file=input_file)
+                    if shared_queue is not None:
+                        if collected:
+                            fill_shared_queue(shared_queue, *collected)
+                        collected = ([], []) if shared_queue.ready_count() > 0 else None
+                    if collected and (collected[0] or collected[1] or shared_queue is not None):
+                        status.update(state="downloading")
+                        if owned_index is not None:
+                            sync_owned_books(workers, owned_index)
+                        stats = run_downloads(workers, download_state, *collected, owned_index=owned_index,
+                                              shared_queue=shared_queue)
+                        print_summary(stats, download_state)
+                        status.update(last_run_at=format_timestamp(time.time()), last_run=stats,
+                                      runs=status.snapshot()["runs"] + 1)
+                    retry_times = [ready_at for _, ready_at in download_state.get_retry_books()]
+                    next_retry = min(retry_times) if retry_times else None
+                    has_quota = any(quota.remaining > 0 for _, _, quota in workers)
+
+                next_check = time.time() + DAEMON_POLL_INTERVAL
+                status.update(
+                    state="idle" if has_quota else "waiting_quota",
+                    next_check_at=format_timestamp(next_check),
+                    next_retry_at=format_timestamp(next_retry),
+                    next_quota_reset_at=format_timestamp(next_reset),
+                )
+            except Exception as e:
+                # 单次处理出错（输入文件被删除、数据库被锁、写状态文件失败等）不退出，记录后等到下一次检查重试
+                need_run = True
+                error_count += 1
+                next_check = time.time() + DAEMON_POLL_INTERVAL
+                print(f"\n❌ [{format_timestamp(time.time())}] 处理出错: {type(e).__name__}: {e}"
+                      f"（{DAEMON_POLL_INTERVAL:g}秒后重试）")
+                status.update(state="error", last_error=f"{type(e).__name__}: {e}",
+                              last_error_at=format_timestamp(time.time()), errors=error_count,
+                              next_check_at=format_timestamp(next_check))
+
+            # 睡到下一次检查、失败重试或配额重置中最早的时间
+            wake_at = min(t for t in (next_check, next_retry, next_reset) if t is not None and t > time.time())
+            time.sleep(max(wake_at - time.time(), 0.1))
+    except KeyboardInterrupt:
+        print("\n🛑 守护进程已停止")
+    finally:
+        if server is not None:
+            server.shutdown()
+        download_state.save()
+
+
+def main():
+    """主函数"""
+    print("=" * 100)
+    print("Zlibrary 批量下载工具")
+    print("=" * 100)
+
+    # 检查命令行参数
+    dry_run = "--dry-run" in sys.argv or "-d" in sys.argv
+    force = "--force" in sys.argv or "-f" in sys.argv
+    retry_failed = "--retry-failed" in sys.argv
+    daemon = "--daemon" in sys.argv
+    check_owned = "--ignore-owned" not in sys.argv
+    policy = get_arg_value("--policy", DEFAULT_QUEUE_POLICY)
+    input_file = get_arg_value("--input", DEFAULT_INPUT_FILE)
+    shared_queue_file = get_arg_value("--shared-queue")
+    if policy not in ("input", "smallest", "oldest"):
+        print(f"\n❌ 未知的排序策略: {policy}（可选: input, smallest, oldest）")
+        return
+    if daemon and (dry_run or force):
+        print("\n❌ --daemon 不能与 --dry-run / --force 同时使用")
+        return
+
+    if dry_run:
+        print("\n🔍 Dry-run模式：仅预览，不实际下载")
+    elif force:
+        print("\n⚠️  强制模式：忽略已下载记录")
+
+    print("=" * 100)
+
+    # 登录（每个账号独立的会话和配额）
+    workers = login_workers()
+    if not workers:
+        print("\n❌ 登录失败！请检查配置")
+        return
+
+    # 整批时限：到时后进行中的请求超时返回，进行中的下载在下一个数据块时取消
+    deadline = get_arg_value("--deadline", BATCH_DEADLINE)
+    if deadline is not None and not daemon:
+        for _, zlib, _ in workers:
+            zlib.setDeadline(float(deadline))
+        print(f"\n⏰ 整批下载时限: {float(deadline):g}秒")
+
+    downloads_left = sum(quota.remaining for _, _, quota in workers)
+    if len(workers) > 1:
+        print(f"\n✅ 共 {len(workers)} 个账号，今日剩余下载次数合计: {downloads_left}")
+
+    # 加载下载状态
+    download_state = DownloadState(DEFAULT_STATE_FILE)
+    owned_index = OwnedIndex(DEFAULT_OWNED_INDEX_FILE) if check_owned else None
+
+    # 共享下载队列：多台机器（各自的账号）从同一个队列取书，租约保证同一本书只由一个节点下载
+    shared_queue = None
+    if shared_queue_file and not dry_run:
+        from work_queue import SharedWorkQueue
+
+        shared_queue = SharedWorkQueue(shared_queue_file, lease_seconds=SHARED_QUEUE_LEASE,
+                                       poll_interval=SHARED_QUEUE_POLL_INTERVAL)
+        print(f"\n🌐 共享下载队列: {os.path.abspath(shared_queue_file)}（节点: {shared_queue.owner}）")
+    try:
+        run_main(workers, download_state, owned_index, shared_queue, dry_run, force, retry_failed,
+                 daemon, policy, input_file, downloads_left)
+    finally:
+        if shared_queue is not None:
+            shared_queue.close()
+
+
+def run_main(workers: list, download_state: DownloadState, owned_index: OwnedIndex,
+             shared_queue: "SharedWorkQueue", dry_run: bool, force: bool, retry_failed: bool,
+             daemon: bool, policy: str, input_file: str, downloads_left: int):
+    """登录后的主流程：守护进程、Dry-run预览或下载一批"""
+    if daemon:
+        if retry_failed:
+            print(f"[注意] 已重置 {download_state.reset_failed()} 个失败记录，全部重新尝试")
+            if shared_queue is not None:
+                failed_books = [{key: value for key, value in entry.items() if key not in FAILED_FIELDS}
+                                for entry in download_state.state["failed"]]
+                shared_queue.enqueue(failed_books, requeue=("failed",))
+        run_daemon(workers, download_state, policy, int(get_arg_value("--status-port", DAEMON_STATUS_PORT)),
+                   input_file, owned_index, shared_queue)
+        return
+
+    if shared_queue is not None and not os.path.exists(input_file):
+        print(f"\n[注意] 没有输入文件 {input_file}，只下载共享队列中已有的书")
+        collected = None
+    else:
+        collected = collect_books(download_state, force, retry_failed, policy, input_file)
+    if collected is None and shared_queue is None:
+        return
+    books_to_download, retry_books = collected or ([], [])
+
+    # 共享队列：本机的书加入队列后，和其他节点一起从队列取书
+    if shared_queue is not None:
+        requeue = ("done", "failed") if force else ("failed",) if retry_failed else ()
+        fill_shared_queue(shared_queue, books_to_download, retry_books, requeue)
+        if len(shared_queue) == 0:
+            print("\n🎉 共享队列中的书籍已全部下载完成！")
+            return
+    elif not books_to_download and not retry_books:
         print("\n🎉 所有书籍已下载完成！")
         return
 
+    # 同步服务器端下载记录，已在其他设备下载过的书不再消耗下载次数（Dry-run 不同步，按上次同步的记录预览）
+    if owned_index is not None and not dry_run:
+        sync_owned_books(workers, owned_index)
+
     # Dry-run模式：只显示预览
     if dry_run:
         print("\n" + "=" * 100)
@@ -407,14 +1875,25 @@ def main():
         print(f"\n待下载书籍列表 ({len(books_to_download)} 本):\n")
 
         for idx, book in enumerate(books_to_download, 1):
-            print(f"{idx}. {book['title']}")
+            owned = owned_index is not None and download_state.get_failed(book) is None and \
+                owned_index.find(book['id'], book['hash'])
+            print(f"{idx}. {book['title']}{'（账号下载记录中已有，将跳过）' if owned else ''}")
             print(f"   作者: {book['author']}")
             print(f"   出版社: {book['publisher']}")
             print(f"   ID: {book['id']} | Hash: {book['hash']}")
 
+        if retry_books:
+            print(f"\n等待重试的书籍 ({len(retry_books)} 本):\n")
+            for idx, (book, ready_at) in enumerate(retry_books, 1):
+                when = "已到重试时间" if ready_at <= time.time() else \
+                    f"{datetime.fromtimestamp(ready_at).strftime('%Y-%m-%d %H:%M:%S')} 后重试"
+                print(f"{idx}. {book['title']} ({when})")
+
         print("\n" + "=" * 100)
         print(f"\n📊 统计信息:")
         print(f"  待下载: {len(books_to_download)} 本")
+        if retry_books:
+            print(f"  等待重试: {len(retry_books)} 本")
         print(f"  今日剩余次数: {downloads_left}")
         print(f"  最大每日下载: {DEFAULT_MAX_DOWNLOADS_PER_DAY} 次")
 
@@ -427,81 +1906,16 @@ def main():
         return
 
     # 实际下载
-    print("\n" + "=" * 100)
-    print("开始下载...")
-    print("=" * 100)
-
-    downloaded_count = 0
-    pending_count = 0
-    failed_count = 0
-
-    for idx, book in enumerate(books_to_download, 1):
-        if downloaded_count >= downloads_left:
-            print(f"\n⚠️  已达到今日下载限制 ({downloads_left}次)")
-            print(f"   将剩余 {len(books_to_download) - idx + 1} 本保存为待下载任务")
-
-            # 保存剩余书籍到待下载列表
-            remaining_books = books_to_download[idx-1:]
-            for remaining_book in remaining_books:
-                download_state.add_pending(remaining_book)
-            download_state.save()
-
-            break
-
-        print(f"\n{'─' * 100}")
-        print(f" [{idx}/{len(books_to_download)}] {book['title']}")
-        print(f"{'─' * 100}")
-        print(f"   ID: {book['id']} | Hash: {book['hash']}")
-        print(f"   作者: {book['author']}")
-        print(f"   出版社: {book['publisher']}")
-
-        success, result, message = download_book(
-            zlib, book['id'], book['hash'], DEFAULT_OUTPUT_DIR,
-            book.get('title', ''), book.get('author', ''), book.get('publisher', '')
-        )
-
-        if success:
-            # 下载成功
-            download_state.add_downloaded(book)
-            download_state.save()
-            downloaded_count += 1
-            print(f"  ✅ 下载成功: {result}")
-        elif result == "download_limit_reached":
-            # 下载次数限制
-            print(f"  ⚠️  {message}")
-            download_state.add_pending(book)
-            download_state.save()
-            pending_count += 1
-            print(f"  📋 已保存到待下载任务")
-            # 达到限制，停止下载
-            break
-        else:
-            # 下载失败
-            print(f"  ❌ 下载失败: {message}")
-            download_state.add_failed(book, message)
-            download_state.save()
-            failed_count += 1
-
-    # 统计信息
-    print("\n" + "=" * 100)
-    print(f"✅ 下载完成！")
-    print("=" * 100)
-    print(f"\n📊 本次统计:")
-    print(f"  成功: {downloaded_count} 本")
-    print(f"  待下载: {pending_count} 本（因次数限制）")
-    print(f"  失败: {failed_count} 本")
-
-    print(f"\n📋 累计统计:")
-    print(f"  已下载总数: {download_state.get_downloaded_count()} 本")
-    print(f"  待下载总数: {download_state.get_pending_count()} 本")
-
-    if download_state.get_pending_count() > 0:
-        print(f"\n💡 提示: 下次运行时会自动下载待下载任务")
-
-    print(f"\n📁 文件保存位置: {os.path.abspath(DEFAULT_OUTPUT_DIR)}")
-    print(f"📄 状态文件: {os.path.abspath(DEFAULT_STATE_FILE)}")
-    print("=" * 100)
+    stats = run_downloads(workers, download_state, books_to_download, retry_books, owned_index, shared_queue)
+    print_summary(stats, download_state)
 
 
 if __name__ == "__main__":
-    main()
+    record_file, replay_file = get_arg_value("--record"), get_arg_value("--replay")
+    recording = nullcontext()
+    if record_file or replay_file:
+        import cassette
+
+        recording = cassette.session(record_file, replay_file, "--replay-fast" not in sys.argv)
+    with recording, profiling.session("batch_download"):
+        main()
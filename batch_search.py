@@ -6,6 +6,13 @@ import os
 import io
 import json
 import re
+import hashlib
+import heapq
+import queue
+import shutil
+import threading
+import traceback
+from contextlib import nullcontext
 from datetime import datetime
 from pathlib import Path
 
@@ -35,6 +42,9 @@ else:
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from Zlibrary import Zlibrary
+from catalog import Catalog
+from records import BookRecord
+import profiling
 import time
 
 # ========== 配置区域 ==========
@@ -46,74 +56,363 @@ DEFAULT_PASSWORD = "YourPASSWORD"
 DEFAULT_REMIX_USERID = ""
 DEFAULT_REMIX_USERKEY = ""
 
-# 网络超时设置（秒）
-REQUEST_TIMEOUT = 30
+# 网络超时设置（秒）: 各类请求的 (连接超时, 读取超时, 总时限含重试)
+# 未列出的请求类型使用 Zlibrary.DEFAULT_TIMEOUTS
+REQUEST_TIMEOUTS = {
+    "search": (5, 30, 90),
+    "health": (3, 5, 10),  # 前置连接测试，快速失败
+}
+# 对冲请求（--hedge 开启）：搜索/书籍详情超过最近延迟的该分位仍未返回时，再发一个相同请求，主请求失败或超时时用它的结果
+HEDGE_PERCENTILE = 95
+HEDGE_MAX_RATIO = 0.1  # 对冲请求最多占总请求数的比例
+HEDGE_MIRRORS = []  # 对冲请求轮流发往的镜像域名，为空时发往同一域名
+
+# 整批搜索的总时限（秒），到时停止搜索并取消进行中的请求；None表示不限（也可用 --deadline 指定）
+BATCH_DEADLINE = None
+
+# 登录缓存：保存cookie和个人资料，启动时直接复用，跳过登录和前置检查
+SESSION_CACHE_FILE = ".zlib_session.json"
+PROFILE_CACHE_MAX_AGE = 600  # 缓存的个人资料在多少秒内视为连接正常
+
+# 本地书目索引：保存所有搜索过的书籍，重复的搜索直接从本地返回
+DEFAULT_CATALOG_FILE = "catalog.db"
+CATALOG_QUERY_MAX_AGE = 24 * 3600  # 缓存的搜索结果在多少秒内直接使用
+
+# 未找到结果的负缓存（保存在本地书目中）：到复查时间前直接跳过，不再在线搜索
+# 第一次未找到后 NEGATIVE_CACHE_TTL 秒复查，每次复查仍未找到时间隔乘以 NEGATIVE_CACHE_GROWTH，最长 NEGATIVE_CACHE_MAX_TTL
+NEGATIVE_CACHE_TTL = 24 * 3600
+NEGATIVE_CACHE_GROWTH = 2
+NEGATIVE_CACHE_MAX_TTL = 30 * 24 * 3600
+NEGATIVE_RECHECK_LIMIT = 50  # 每次运行最多复查的条数（到期的其余记录继续跳过，留到下次）
+
+# 输入文件流式读取：每次读取的字符数；重复的搜索请求最多逐条提示的数量
+INPUT_READ_CHUNK = 64 * 1024
+MAX_DUPLICATE_WARNINGS = 50
+INPUT_MAX_ELEMENT_SIZE = 1024 * 1024  # JSON数组中单个元素的最大字符数，超过时视为格式错误
+
+# 格式偏好列表（靠前的优先）：每本书选用第一个能找到的格式，也可用 --formats epub,pdf,mobi 指定
+DEFAULT_FORMATS = ["epub"]
+SEARCH_LIMIT_PER_FORMAT = 50  # 每种格式的候选数量（一次搜索的结果数 = 该值 x 格式数）
+
+# 默认限定条件（由服务器筛选，减少返回的候选），搜索请求中的 language/year_from/year_to 优先
+# 也可用 --language chinese,english --year-from 2000 --year-to 2020 指定
+DEFAULT_LANGUAGES = []  # 如 ["chinese"]，为空表示不限
+DEFAULT_YEAR_FROM = None
+DEFAULT_YEAR_TO = None
+
+# 多进程分片搜索（--shards K）：按搜索请求的稳定哈希分成K片，每片一个进程（各自的会话），结束后按输入顺序合并
+SHARD_PROGRESS_INTERVAL = 5  # 汇总进度的输出间隔（秒）
+SHARD_CATALOG_BUSY_TIMEOUT = 300  # 各分片进程同时写入本地书目时，等待其他进程写锁的最长时间（秒）
+
+# 搜索请求中可用的限定条件字段
+CONSTRAINT_FIELDS = ("language", "year_from", "year_to", "extension")
 
 # 连接测试搜索词
 TEST_SEARCH_TERM = "python"
 # ===============================
 
 
-def load_search_requests(input_file: str) -> list:
+def request_key(request: dict) -> str:
+    """搜索请求的唯一标识（书名|作者|出版社，有限定条件时附加在后面）"""
+    key = f"{request.get('title', '')}|{request.get('author', '')}|{request.get('publisher', '')}"
+    extra = [request.get(field) for field in CONSTRAINT_FIELDS]
+    if any(value not in (None, "", []) for value in extra):
+        key += "|" + json.dumps(extra, ensure_ascii=False)
+    return key
+
+
+def shard_of(search_key: str, shards: int) -> int:
+    """
+    搜索请求所属的分片
+
+    按 build_search_key 的稳定哈希，与搜索时去重用同一个键：重复的请求
+    （包括写明了默认限定条件和省略它的请求）一定在同一片
+    """
+    digest = hashlib.blake2b(search_key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards
+
+
+class CompactKeySet:
+    """
+    紧凑的字符串集合，用于重复检测
+
+    只保存每个字符串的64位哈希（blake2b），内存占用与字符串长度无关；
+    百万级数据下哈希碰撞的概率可以忽略
     """
-    从JSON文件加载搜索请求
+
+    __slots__ = ("_hashes",)
+
+    def __init__(self):
+        self._hashes = set()
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def add(self, key: str) -> bool:
+        """加入集合，返回是否为新加入（已存在时返回False）"""
+        key_hash = self._hash(key)
+        if key_hash in self._hashes:
+            return False
+        self._hashes.add(key_hash)
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        return self._hash(key) in self._hashes
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+
+def _iter_json_array(f, buffer: str):
+    """增量解析JSON数组的元素（buffer为已读取的、以"["开头的内容），每次只保留一个元素在内存中"""
+    decoder = json.JSONDecoder()
+    pos = 1
+    eof = False
+    state = "first"  # first: 元素或"]"；value: 元素；separator: ","或"]"
+
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos >= len(buffer):
+            if eof:
+                raise ValueError("JSON数组未结束")
+            chunk = f.read(INPUT_READ_CHUNK)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        char = buffer[pos]
+        if state != "value" and char == "]":
+            return
+        if state == "separator":
+            if char != ",":
+                raise ValueError(f"JSON数组元素之间缺少逗号（附近内容: {buffer[pos:pos + 20]!r}）")
+            pos += 1
+            state = "value"
+            continue
+
+        try:
+            value, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            # 只有错误出在已读内容的末尾（字符串未结束，或末尾不超过一个不完整的字面量/数字/转义）时，
+            # 才可能是元素还没读完；出错位置在已读内容中间的是格式错误，直接报错，不再读入后面的内容
+            truncated = e.msg.startswith("Unterminated string") or e.pos >= len(buffer) - 10
+            if eof or not truncated:
+                raise
+            if len(buffer) - pos > INPUT_MAX_ELEMENT_SIZE:
+                raise ValueError(f"JSON数组元素超过 {INPUT_MAX_ELEMENT_SIZE} 个字符（附近内容: {buffer[pos:pos + 20]!r}）")
+            # 元素不完整，读取更多内容后重试
+            chunk = f.read(INPUT_READ_CHUNK)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield value
+        state = "separator"
+
+
+def iter_search_requests(input_file: str):
+    """
+    流式读取搜索请求，内存占用与输入文件大小无关
+
+    支持两种格式:
+    - JSON数组: [{"title": ...}, {...}]，增量解析
+    - JSONL: 每行一个JSON对象（文件第一个非空字符不是"["时按此格式读取）
 
     Args:
-        input_file: JSON文件路径
+        input_file: 输入文件路径
+
+    Yields:
+        (序号（从1开始）, 搜索请求字典)
+
+    Raises:
+        FileNotFoundError: 文件不存在
+        ValueError: 格式错误（json.JSONDecodeError 也是 ValueError）
+    """
+    with open(input_file, 'r', encoding='utf-8') as f:
+        buffer = ""
+        while True:
+            chunk = f.read(INPUT_READ_CHUNK)
+            buffer += chunk
+            if not chunk or buffer.strip():
+                break
+        buffer = buffer.lstrip()
+        if not buffer:
+            return
+
+        if buffer.startswith("["):
+            items = _iter_json_array(f, buffer)
+        else:
+            f.seek(0)
+            items = (json.loads(line) for line in f if line.strip())
+
+        for idx, request in enumerate(items, 1):
+            if not isinstance(request, dict):
+                raise ValueError(f"第 {idx} 个搜索请求不是JSON对象")
+            yield idx, request
+
+
+def scan_search_requests(input_file: str):
+    """
+    检查输入文件并统计搜索请求（流式读取，同时提示重复的搜索请求）
+
+    Args:
+        input_file: 输入文件路径
 
     Returns:
-        搜索请求列表
+        (搜索请求总数, 去重后的数量)，文件不存在或格式错误时返回None
     """
+    seen = CompactKeySet()
+    total = 0
+    duplicate_count = 0
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            requests = json.load(f)
-
-        if not isinstance(requests, list):
-            print(f"错误: 输入文件必须包含JSON数组")
-            return []
-
-        # 检测重复的搜索请求
-        seen = {}
-        duplicates = []
-        for idx, req in enumerate(requests, 1):
-            title = req.get('title', '')
-            author = req.get('author', '')
-            publisher = req.get('publisher', '')
-
-            # 生成唯一标识
-            search_key = f"{title}|{author}|{publisher}"
-
-            if search_key in seen:
-                duplicates.append({
-                    'index': idx,
-                    'duplicate_index': seen[search_key],
-                    'title': title,
-                    'author': author,
-                    'publisher': publisher
-                })
-            else:
-                seen[search_key] = idx
-
-        if duplicates:
-            print("\n" + "=" * 100)
-            print("⚠️  警告: 检测到重复的搜索请求！")
-            print("=" * 100)
-            for dup in duplicates:
-                print(f"\n重复项 #{dup['index']} 与 #{dup['duplicate_index']}:")
-                print(f"  书名: {dup['title']}")
-                print(f"  作者: {dup['author']}")
-                print(f"  出版社: {dup['publisher']}")
-            print("\n💡 提示: 后续的搜索结果会覆盖前面的结果")
-            print("=" * 100)
-
-        return requests
-
+        for idx, req in iter_search_requests(input_file):
+            total = idx
+            if seen.add(request_key(req)):
+                continue
+
+            duplicate_count += 1
+            if duplicate_count == 1:
+                print("\n" + "=" * 100)
+                print("⚠️  警告: 检测到重复的搜索请求！")
+                print("=" * 100)
+            if duplicate_count <= MAX_DUPLICATE_WARNINGS:
+                print(f"\n重复项 #{idx}:")
+                print(f"  书名: {req.get('title', '')}")
+                print(f"  作者: {req.get('author', '')}")
+                print(f"  出版社: {req.get('publisher', '')}")
     except FileNotFoundError:
         print(f"错误: 文件不存在 - {input_file}")
-        return []
-    except json.JSONDecodeError as e:
+        return None
+    except ValueError as e:
         print(f"错误: JSON解析失败 - {e}")
+        return None
+
+    if duplicate_count:
+        if duplicate_count > MAX_DUPLICATE_WARNINGS:
+            print(f"\n... 另有 {duplicate_count - MAX_DUPLICATE_WARNINGS} 个重复项未显示")
+        print("\n💡 提示: 重复的搜索请求只搜索一次")
+        print("=" * 100)
+
+    return total, len(seen)
+
+
+def load_search_requests(input_file: str) -> list:
+    """
+    从JSON文件加载全部搜索请求（小文件使用；大文件请用 iter_search_requests 流式处理）
+
+    Args:
+        input_file: JSON或JSONL文件路径
+
+    Returns:
+        搜索请求列表
+    """
+    if scan_search_requests(input_file) is None:
+        return []
+    return [req for _, req in iter_search_requests(input_file)]
+
+
+def normalize_list(value) -> list:
+    """逗号分隔的字符串或列表 -> 小写、去重、保持顺序的列表"""
+    if not value:
         return []
+    items = value.split(",") if isinstance(value, str) else value
+    result = []
+    for item in items:
+        item = str(item).strip().lower().lstrip(".")
+        if item and item not in result:
+            result.append(item)
+    return result
+
+
+def parse_year(value) -> int:
+    """从年份字段中提取4位年份（如 "2015"、"2015-03"），无法解析时返回None"""
+    if value is None:
+        return None
+    match = re.search(r'\d{4}', str(value))
+    return int(match.group()) if match else None
+
+
+def build_constraints(request: dict, defaults: dict = None) -> dict:
+    """
+    合并搜索请求中的限定条件和全局默认值（请求中的值优先）
+
+    请求中可选的字段:
+    - language: 语言，字符串（可逗号分隔）或列表，如 "chinese" / ["chinese", "english"]
+    - year_from / year_to: 出版年份范围（含）
+    - extension: 格式，字符串或列表，覆盖全局的格式偏好列表
+
+    Args:
+        request: 搜索请求
+        defaults: 全局默认值（同样的字段名）
+
+    Returns:
+        {"languages": [...], "year_from": 年份或None, "year_to": 年份或None, "formats": [...]或None}
+    """
+    defaults = defaults or {}
+
+    def pick(field):
+        value = request.get(field)
+        return value if value not in (None, "", []) else defaults.get(field)
+
+    return {
+        "languages": normalize_list(pick("language")),
+        "year_from": parse_year(pick("year_from")),
+        "year_to": parse_year(pick("year_to")),
+        "formats": normalize_list(request.get("extension")) or None,
+    }
+
+
+def build_search_key(request: dict, constraints: dict) -> str:
+    """搜索条件描述（结果中的"搜索条件"行，也是搜索时去重和分片的键）"""
+    search_key = (f"书名: {request.get('title') or 'N/A'} | 作者: {request.get('author') or 'N/A'} | "
+                  f"出版社: {request.get('publisher') or 'N/A'}")
+    if describe_constraints(constraints):
+        search_key += f" | {describe_constraints(constraints)}"
+    return search_key
+
+
+def describe_constraints(constraints: dict) -> str:
+    """限定条件的说明文字，如 "语言: chinese | 年份: 2000-2010"（没有限定条件时返回空字符串）"""
+    if not constraints:
+        return ""
+    parts = []
+    if constraints.get("languages"):
+        parts.append(f"语言: {','.join(constraints['languages'])}")
+    if constraints.get("year_from") or constraints.get("year_to"):
+        parts.append(f"年份: {constraints.get('year_from') or ''}-{constraints.get('year_to') or ''}")
+    if constraints.get("formats"):
+        parts.append(f"格式: {format_label(constraints['formats'])}")
+    return " | ".join(parts)
+
+
+def filter_books_by_constraints(books: list, constraints: dict) -> list:
+    """
+    按语言和年份范围在本地复查书籍（与下推到服务器的条件相同；缓存和离线结果也经过同样的筛选）
+
+    Args:
+        books: 书籍列表
+        constraints: build_constraints 返回的限定条件
+
+    Returns:
+        符合条件的书籍列表（限定了年份时，年份未知的书不保留）
+    """
+    if not constraints:
+        return books[:]
+    languages = constraints.get("languages")
+    year_from = constraints.get("year_from")
+    year_to = constraints.get("year_to")
+
+    filtered = []
+    for book in books:
+        if languages and (book.get("language") or "").lower() not in languages:
+            continue
+        if year_from or year_to:
+            year = parse_year(book.get("year"))
+            if year is None or (year_from and year < year_from) or (year_to and year > year_to):
+                continue
+        filtered.append(book)
+    return filtered
 
 
 def build_search_term(title: str = None, author: str = None, publisher: str = None) -> str:
@@ -169,36 +468,61 @@ def fuzzy_match(search_term: str, target: str) -> bool:
     return normalize_string(search_term) in normalize_string(target)
 
 
-def search_books_by_condition(zlib: Zlibrary, search_term: str, limit: int = 50, extensions: str = None) -> list:
+def search_books_by_condition(zlib: Zlibrary, search_term: str, limit: int = 50, extensions: str = None,
+                              catalog: Catalog = None, offline: bool = False, languages: list = None,
+                              year_from: int = None, year_to: int = None) -> list:
     """
     根据搜索条件搜索书籍
     注意：这里使用较大的limit以获取更多候选
 
     Args:
-        zlib: Zlibrary实例
+        zlib: Zlibrary实例（离线模式下可为None）
         search_term: 搜索关键词
         limit: 返回结果数量限制
         extensions: 文件扩展名筛选（如"epub"）
+        catalog: 本地书目索引（提供时先查本地缓存，在线结果写入索引）
+        offline: 离线模式，只在本地书目中搜索
+        languages: 语言筛选（如["chinese"]），由服务器筛选
+        year_from: 出版年份下限，由服务器筛选
+        year_to: 出版年份上限，由服务器筛选
 
     Returns:
-        书籍列表
+        书籍列表（BookRecord，只保留需要的字段）；搜索失败（超时、网络错误等）时返回None，与没有结果区分
     """
+    if catalog is not None:
+        if offline:
+            books = catalog.search(search_term, extensions=extensions, limit=limit)
+            safe_print(f"      [本地书目] 离线搜索完成 (找到 {len(books)} 本)")
+            return books
+
+        # 带限定条件的搜索与不带的分开缓存
+        filters = describe_constraints({"languages": languages, "year_from": year_from, "year_to": year_to})
+        cached = catalog.get_search(search_term, extensions, max_age=CATALOG_QUERY_MAX_AGE, filters=filters)
+        if cached is not None:
+            safe_print(f"      [本地书目] 命中缓存的搜索结果 ({len(cached)} 本)")
+            return cached[:limit]
+
     safe_print(f"      [网络请求] 正在连接服务器搜索...")
     start_time = time.time()
 
-    result = zlib.search(message=search_term, limit=limit, extensions=extensions)
+    result = zlib.search(message=search_term, limit=limit, extensions=extensions, languages=languages or None,
+                         yearFrom=year_from, yearTo=year_to)
 
     elapsed_time = time.time() - start_time
     safe_print(f"      [网络请求] 完成 (耗时: {elapsed_time:.2f}秒)")
 
     if not result.get("success"):
         safe_print(f"    ❌ 搜索失败: {result.get('message', '未知错误')}")
-        return []
+        return None
 
-    return result.get("books", [])
+    # 只保留需要的字段，完整的响应字典随即释放
+    books = BookRecord.from_books(result.get("books", []))
+    if catalog is not None:
+        catalog.add_search(search_term, extensions, books, filters=filters)
+    return books
 
 
-def is_epub_available(zlib: Zlibrary, book_id: str, book_hash: str) -> bool:
+def is_epub_available(zlib: Zlibrary, book_id: str, book_hash: str, catalog: Catalog = None) -> bool:
     """
     检查书籍是否有EPUB格式
 
@@ -206,6 +530,7 @@ def is_epub_available(zlib: Zlibrary, book_id: str, book_hash: str) -> bool:
         zlib: Zlibrary实例
         book_id: 书籍ID
         book_hash: 书籍Hash
+        catalog: 本地书目索引（提供时保存书籍详情）
 
     Returns:
         是否有EPUB格式
@@ -213,6 +538,8 @@ def is_epub_available(zlib: Zlibrary, book_id: str, book_hash: str) -> bool:
     try:
         book_info = zlib.getBookInfo(book_id, book_hash)
         if book_info.get("success"):
+            if catalog is not None:
+                catalog.add_book(book_info.get("book", {}))
             formats = book_info.get("book", {}).get("formats", {})
             return formats.get("epub") is not None
     except Exception as e:
@@ -220,7 +547,8 @@ def is_epub_available(zlib: Zlibrary, book_id: str, book_hash: str) -> bool:
     return False
 
 
-def get_epub_book_details(zlib: Zlibrary, book_id: str, book_hash: str, original_book: dict) -> dict:
+def get_epub_book_details(zlib: Zlibrary, book_id: str, book_hash: str, original_book: dict,
+                          catalog: Catalog = None) -> dict:
     """
     获取EPUB书籍的详细信息
 
@@ -229,6 +557,7 @@ def get_epub_book_details(zlib: Zlibrary, book_id: str, book_hash: str, original
         book_id: 书籍ID
         book_hash: 书籍Hash
         original_book: 原始书籍信息
+        catalog: 本地书目索引（提供时保存书籍详情）
 
     Returns:
         包含EPUB信息的书籍字典
@@ -236,6 +565,8 @@ def get_epub_book_details(zlib: Zlibrary, book_id: str, book_hash: str, original
     try:
         book_info = zlib.getBookInfo(book_id, book_hash)
         if book_info.get("success"):
+            if catalog is not None:
+                catalog.add_book(book_info.get("book", {}))
             formats = book_info.get("book", {}).get("formats", {})
             epub_info = formats.get("epub", {})
             return {
@@ -337,7 +668,7 @@ def test_connection(zlib: Zlibrary) -> bool:
     start_time = time.time()
 
     try:
-        result = zlib.search(message=TEST_SEARCH_TERM, limit=5)
+        result = zlib.search(message=TEST_SEARCH_TERM, limit=5, timeout=zlib.getTimeout("health"))
 
         elapsed_time = time.time() - start_time
         print(f"  [步骤1] 完成 (耗时: {elapsed_time:.2f}秒)")
@@ -361,60 +692,42 @@ def test_connection(zlib: Zlibrary) -> bool:
         return False
 
 
-def search_epub_books_with_strategy(zlib: Zlibrary, title: str = None, author: str = None, publisher: str = None) -> tuple:
-    """
-    使用智能约束策略搜索EPUB格式书籍
-    优化版本：一次在线搜索获取所有EPUB格式书籍，然后本地筛选
+def format_label(formats: list) -> str:
+    """格式列表的显示名称，如 ["epub", "pdf"] -> EPUB/PDF"""
+    return "/".join(fmt.upper() for fmt in formats)
 
-    策略顺序:
-    1. 使用书名（或最具体的搜索词）一次性搜索（直接筛选EPUB格式）
-    2. 本地逐步筛选：先按书名，再按出版社，最后按作者
-    3. 如果筛选后无结果，回退到上一步
+
+def parse_formats(value: str) -> list:
+    """解析格式偏好列表，如 "epub,pdf, mobi" -> ["epub", "pdf", "mobi"]（去重，保持顺序）"""
+    formats = []
+    for fmt in value.split(","):
+        fmt = fmt.strip().lower().lstrip(".")
+        if fmt and fmt not in formats:
+            formats.append(fmt)
+    return formats
+
+
+def narrow_books(books: list, title: str, author: str, publisher: str, strategy_log: list) -> list:
+    """
+    本地逐步筛选：先按书名，再按出版社，最后按作者；出版社/作者筛选无结果时回退到上一步
 
     Args:
-        zlib: Zlibrary实例
+        books: 候选书籍列表
         title: 书名
         author: 作者
         publisher: 出版社
+        strategy_log: 搜索策略日志（追加筛选过程）
 
     Returns:
-        (书籍列表, 使用的搜索策略描述)
+        筛选后的书籍列表（按书名筛选无结果时为空）
     """
-    if not title and not author and not publisher:
-        return [], "错误: 至少需要提供一个搜索条件"
-
-    strategy_log = []
-    search_start_time = time.time()
-
-    # 步骤0: 确定初始搜索词
-    # 优先使用书名，如果没有书名则使用最具体的条件
-    if title:
-        initial_search_term = title
-        strategy_log.append(f"初始搜索词: '{title}'")
-    elif publisher:
-        initial_search_term = publisher
-        strategy_log.append(f"初始搜索词: '{publisher}' (无书名，使用出版社)")
-    else:
-        initial_search_term = author
-        strategy_log.append(f"初始搜索词: '{author}' (无书名和出版社，使用作者)")
-
-    # 步骤1: 在线搜索 - 直接获取EPUB格式书籍，避免后续逐个检查
-    safe_print(f"    正在搜索EPUB格式书籍: {initial_search_term}...")
-    epub_books = search_books_by_condition(zlib, initial_search_term, limit=50, extensions="epub")
-    strategy_log.append(f"步骤1 - 在线搜索EPUB: '{initial_search_term}' -> 找到 {len(epub_books)} 本EPUB书籍")
-
-    if not epub_books:
-        elapsed_time = time.time() - search_start_time
-        strategy_log.append(f"    未找到EPUB格式的书籍 (总耗时: {elapsed_time:.2f}秒)")
-        return [], "\n".join(strategy_log)
-
-    # 步骤2: 本地逐步筛选 - 按书名
+    # 步骤2: 按书名
     if title:
         safe_print(f"      [本地处理] 按书名筛选: '{title}'...")
-        by_title = filter_books_by_title(epub_books, title)
+        by_title = filter_books_by_title(books, title)
         strategy_log.append(f"步骤2 - 按书名筛选: '{title}' -> {len(by_title)} 本匹配")
     else:
-        by_title = epub_books[:]
+        by_title = books[:]
 
     # 步骤3: 如果结果>1，按出版社筛选
     if len(by_title) > 1 and publisher:
@@ -440,31 +753,107 @@ def search_epub_books_with_strategy(zlib: Zlibrary, title: str = None, author: s
         if len(by_author) == 0:
             # 作者筛选无结果，回退到上一步的结果
             strategy_log.append(f"    作者筛选无结果，回退到上一步结果 ({len(final_books)} 本)")
-            # 保持final_books不变
         else:
             final_books = by_author
 
+    return final_books
+
+
+def search_books_with_strategy(zlib: Zlibrary, title: str = None, author: str = None, publisher: str = None,
+                               formats: list = None, catalog: Catalog = None, offline: bool = False,
+                               constraints: dict = None) -> tuple:
+    """
+    使用智能约束策略搜索书籍，按格式偏好选出最合适的格式
+    一次在线搜索获取所有偏好格式的书籍，然后在本地按格式分组、筛选
+
+    策略顺序:
+    1. 使用书名（或最具体的搜索词）一次性搜索（服务器端只返回偏好列表中的格式）
+    2. 按格式分组，依偏好顺序逐个格式在本地筛选：先按书名，再按出版社，最后按作者
+    3. 出版社/作者筛选无结果时回退到上一步；按书名筛选无结果时尝试下一个格式
+
+    Args:
+        zlib: Zlibrary实例
+        title: 书名
+        author: 作者
+        publisher: 出版社
+        formats: 格式偏好列表（如 ["epub", "pdf"]，靠前的优先），默认 DEFAULT_FORMATS
+        catalog: 本地书目索引
+        offline: 离线模式，只在本地书目中搜索
+        constraints: 语言/年份/格式限定条件（见 build_constraints），下推到在线搜索并在本地复查
+
+    Returns:
+        (书籍列表（同一种格式）, 使用的搜索策略描述)；在线搜索失败时书籍列表为None（不是未找到）
+    """
+    if not title and not author and not publisher:
+        return [], "错误: 至少需要提供一个搜索条件"
+
+    constraints = constraints or {}
+    formats = constraints.get("formats") or formats or DEFAULT_FORMATS
+    label = format_label(formats)
+    strategy_log = []
+    search_start_time = time.time()
+
+    # 步骤0: 确定初始搜索词
+    # 优先使用书名，如果没有书名则使用最具体的条件
+    if title:
+        initial_search_term = title
+        strategy_log.append(f"初始搜索词: '{title}'")
+    elif publisher:
+        initial_search_term = publisher
+        strategy_log.append(f"初始搜索词: '{publisher}' (无书名，使用出版社)")
+    else:
+        initial_search_term = author
+        strategy_log.append(f"初始搜索词: '{author}' (无书名和出版社，使用作者)")
+
+    # 步骤1: 在线搜索 - 直接按格式筛选，避免后续逐个检查
+    safe_print(f"    正在搜索{label}格式书籍: {initial_search_term}...")
+    extensions = formats[0] if len(formats) == 1 else formats
+    candidates = search_books_by_condition(zlib, initial_search_term, limit=SEARCH_LIMIT_PER_FORMAT * len(formats),
+                                           extensions=extensions, catalog=catalog, offline=offline,
+                                           languages=constraints.get("languages"),
+                                           year_from=constraints.get("year_from"), year_to=constraints.get("year_to"))
+    if candidates is None:
+        strategy_log.append(f"步骤1 - 在线搜索{label}: '{initial_search_term}' -> 搜索失败")
+        return None, "\n".join(strategy_log)
+    strategy_log.append(f"步骤1 - 在线搜索{label}: '{initial_search_term}' -> 找到 {len(candidates)} 本{label}书籍")
+
+    # 本地复查语言/年份条件（服务器已按同样的条件筛选，这里保证缓存和离线结果也符合条件）
+    if constraints.get("languages") or constraints.get("year_from") or constraints.get("year_to"):
+        checked = filter_books_by_constraints(candidates, constraints)
+        strategy_log.append(f"    限定条件 ({describe_constraints(constraints)}) -> {len(checked)} 本符合")
+        candidates = checked
+
+    if not candidates:
+        elapsed_time = time.time() - search_start_time
+        strategy_log.append(f"    未找到{label}格式的书籍 (总耗时: {elapsed_time:.2f}秒)")
+        return [], "\n".join(strategy_log)
+
+    if len(formats) == 1:
+        final_books = narrow_books(candidates, title, author, publisher, strategy_log)
+    else:
+        # 按格式分组，依偏好顺序选出第一个有匹配书籍的格式
+        buckets = {}
+        for book in candidates:
+            buckets.setdefault((book.get("extension") or "").lower(), []).append(book)
+        strategy_log.append("    按格式分组: " + ", ".join(
+            f"{fmt.upper()} {len(buckets.get(fmt, []))} 本" for fmt in formats))
+
+        final_books = []
+        for fmt in formats:
+            if not buckets.get(fmt):
+                continue
+            strategy_log.append(f"  [{fmt.upper()}]")
+            final_books = narrow_books(buckets[fmt], title, author, publisher, strategy_log)
+            if final_books:
+                strategy_log.append(f"    选用格式: {fmt.upper()}")
+                break
+
     # 转换为详细格式
     safe_print(f"      [本地处理] 整理书籍信息...")
     detail_start = time.time()
-    result_books = []
-
     # 搜索返回的书籍已经包含了所有必要信息，直接使用
-    for idx, book in enumerate(final_books, 1):
-        # 尝试获取文件大小（可选，因为需要额外网络请求）
-        # 如果不需要文件大小，可以直接使用搜索结果
-        result_books.append({
-            "id": book.get("id"),
-            "hash": book.get("hash"),
-            "title": book.get("title"),
-            "author": book.get("author"),
-            "publisher": book.get("publisher"),
-            "year": book.get("year"),
-            "language": book.get("language"),
-            "file_size": "N/A",  # 搜索结果中不包含文件大小，需要单独获取
-            "pages": book.get("pages"),
-            "cover": book.get("cover"),
-        })
+    # 文件大小需要额外的网络请求才能获取，这里不获取
+    result_books = [BookRecord.from_dict(book, file_size="N/A") for book in final_books]
 
     detail_time = time.time() - detail_start
     safe_print(f"      [本地处理] 完成 (耗时: {detail_time:.2f}秒)")
@@ -476,6 +865,13 @@ def search_epub_books_with_strategy(zlib: Zlibrary, title: str = None, author: s
     return result_books, strategy_desc
 
 
+def search_epub_books_with_strategy(zlib: Zlibrary, title: str = None, author: str = None, publisher: str = None,
+                                    catalog: Catalog = None, offline: bool = False) -> tuple:
+    """使用智能约束策略搜索EPUB格式书籍（保留兼容性，见 search_books_with_strategy）"""
+    return search_books_with_strategy(zlib, title, author, publisher, formats=["epub"],
+                                      catalog=catalog, offline=offline)
+
+
 def search_epub_books(zlib: Zlibrary, title: str = None, author: str = None, publisher: str = None) -> list:
     """
     搜索符合条件的EPUB格式书籍（旧版本，保留兼容性）
@@ -572,6 +968,120 @@ def sort_books_by_year(books: list, descending: bool = True) -> list:
     return sorted(books, key=extract_year, reverse=descending)
 
 
+def format_results_header(search_time: str, total: int, found: int, not_found: int, unique: int = None,
+                          format_name: str = "EPUB") -> str:
+    """
+    生成结果文件的汇总头
+
+    Args:
+        search_time: 搜索时间
+        total: 总共搜索数量
+        found: 找到的数量
+        not_found: 未找到的数量
+        unique: 去重后实际搜索数量（None表示不输出该行）
+        format_name: 搜索的格式名称（如 "EPUB"、"EPUB/PDF"）
+
+    Returns:
+        汇总头文本
+    """
+    lines = [
+        "=" * 100,
+        "Zlibrary 批量搜索结果",
+        "=" * 100,
+        f"搜索时间: {search_time}",
+        f"总共搜索: {total} 本书",
+        f"找到可下载{format_name}: {found} 本书",
+        f"未找到: {not_found} 本书",
+    ]
+    if unique is not None:
+        lines.append(f"去重后实际搜索: {unique} 本书")
+    lines.append("=" * 100)
+    return "\n".join(lines) + "\n"
+
+
+def format_found_block(search_key: str, books: list, strategy_desc: str = None, format_name: str = "EPUB") -> str:
+    """
+    生成单个搜索条件的结果块（已找到）
+
+    Args:
+        search_key: 搜索条件描述
+        books: 书籍列表
+        strategy_desc: 搜索策略描述
+        format_name: 搜索的格式名称（书籍带有格式信息时显示书籍的实际格式）
+
+    Returns:
+        结果块文本
+    """
+    parts = [
+        f"\n{'─' * 100}\n",
+        f"搜索条件: {search_key}\n",
+        f"{'─' * 100}\n",
+    ]
+
+    # 显示搜索策略
+    if strategy_desc:
+        parts.append(f"\n搜索策略:\n")
+        for line in strategy_desc.split('\n'):
+            parts.append(f"  {line}\n")
+        parts.append(f"\n")
+
+    extension = books[0].get('extension') if books else None
+    parts.append(f"找到 {len(books)} 个可下载的{extension.upper() if extension else format_name}版本:\n\n")
+
+    for idx, book in enumerate(books, 1):
+        parts.append(
+            f"  【版本 {idx}】\n"
+            f"    书名: {book['title']}\n"
+            f"    作者: {book['author'] or 'N/A'}\n"
+            f"    出版社: {book['publisher'] or 'N/A'}\n"
+            f"    年份: {book['year'] or 'N/A'}\n"
+            f"    语言: {book['language'] or 'N/A'}\n"
+            f"    页数: {book['pages'] or 'N/A'}\n"
+            f"    格式: {(book.get('extension') or 'N/A').upper()}\n"
+            f"    文件大小: {format_file_size(book['file_size'])}\n"
+            f"    ID: {book['id']}\n"
+            f"    Hash: {book['hash']}\n"
+        )
+
+    parts.append(f"\n{'─' * 100}\n")
+    return "".join(parts)
+
+
+def format_not_found_block(idx: int, not_found: dict, format_name: str = "EPUB", note: str = None) -> str:
+    """
+    生成单个未找到书籍的结果块
+
+    Args:
+        idx: 序号
+        not_found: 搜索请求
+        format_name: 搜索的格式名称
+        note: 附加说明（如来自负缓存）
+
+    Returns:
+        结果块文本
+    """
+    title = not_found.get('title', 'N/A')
+    author = not_found.get('author', 'N/A')
+    publisher = not_found.get('publisher', 'N/A')
+
+    block = (
+        f"{idx}. 书名: {title}\n"
+        f"   作者: {author}\n"
+        f"   出版社: {publisher}\n"
+        f"   原因: 未找到可下载的{format_name}格式\n"
+    )
+    if note:
+        block += f"   说明: {note}\n"
+    return block + "\n"
+
+
+RESULTS_FOUND_SECTION = "【已找到的书籍列表】\n" + "=" * 100 + "\n"
+# 结果文件中有这一行时，batch_download 只下载标记了v的版本（只有一个版本也不自动下载）
+MANUAL_SELECTION_LINE = "下载方式: 只下载标记了v的版本（只有一个版本也不自动下载）\n"
+RESULTS_NOT_FOUND_SECTION = "\n\n" + "=" * 100 + "\n" + "【未找到的书籍列表】\n" + "=" * 100 + "\n\n"
+RESULTS_FOOTER = "=" * 100 + "\n" + "搜索完成\n" + "=" * 100 + "\n"
+
+
 def save_results_to_file(output_file: str, found_books: dict, not_found_books: list, search_time: str, strategies: dict = None):
     """
     将结果保存到文件
@@ -583,69 +1093,636 @@ def save_results_to_file(output_file: str, found_books: dict, not_found_books: l
         search_time: 搜索时间
         strategies: 搜索策略字典 {search_key: strategy_desc}
     """
+    total = len(found_books) + len(not_found_books)
     with open(output_file, 'w', encoding='utf-8') as f:
-        f.write("=" * 100 + "\n")
-        f.write("Zlibrary 批量搜索结果\n")
-        f.write("=" * 100 + "\n")
-        f.write(f"搜索时间: {search_time}\n")
-        f.write(f"总共搜索: {len(found_books) + len(not_found_books)} 本书\n")
-        f.write(f"找到可下载EPUB: {len(found_books)} 本书\n")
-        f.write(f"未找到: {len(not_found_books)} 本书\n")
-        if strategies:
-            f.write(f"去重后实际搜索: {len(found_books) + len(not_found_books)} 本书\n")
-        f.write("=" * 100 + "\n\n")
+        f.write(format_results_header(search_time, total, len(found_books), len(not_found_books),
+                                      total if strategies else None))
+        f.write("\n")
 
         # 输出找到的书籍
-        f.write("【已找到的书籍列表】\n")
-        f.write("=" * 100 + "\n")
-
+        f.write(RESULTS_FOUND_SECTION)
         for search_key, books in found_books.items():
-            f.write(f"\n{'─' * 100}\n")
-            f.write(f"搜索条件: {search_key}\n")
-            f.write(f"{'─' * 100}\n")
-
-            # 显示搜索策略
-            if strategies and search_key in strategies:
-                f.write(f"\n搜索策略:\n")
-                for line in strategies[search_key].split('\n'):
-                    f.write(f"  {line}\n")
-                f.write(f"\n")
-
-            f.write(f"找到 {len(books)} 个可下载的EPUB版本:\n\n")
-
-            for idx, book in enumerate(books, 1):
-                f.write(f"  【版本 {idx}】\n")
-                f.write(f"    书名: {book['title']}\n")
-                f.write(f"    作者: {book['author'] or 'N/A'}\n")
-                f.write(f"    出版社: {book['publisher'] or 'N/A'}\n")
-                f.write(f"    年份: {book['year'] or 'N/A'}\n")
-                f.write(f"    语言: {book['language'] or 'N/A'}\n")
-                f.write(f"    页数: {book['pages'] or 'N/A'}\n")
-                f.write(f"    文件大小: {format_file_size(book['file_size'])}\n")
-                f.write(f"    ID: {book['id']}\n")
-                f.write(f"    Hash: {book['hash']}\n")
-
-            f.write(f"\n{'─' * 100}\n")
+            strategy_desc = strategies.get(search_key) if strategies else None
+            f.write(format_found_block(search_key, books, strategy_desc))
 
         # 输出未找到的书籍
         if not_found_books:
-            f.write("\n\n" + "=" * 100 + "\n")
-            f.write("【未找到的书籍列表】\n")
-            f.write("=" * 100 + "\n\n")
-
+            f.write(RESULTS_NOT_FOUND_SECTION)
             for idx, not_found in enumerate(not_found_books, 1):
-                title = not_found.get('title', 'N/A')
-                author = not_found.get('author', 'N/A')
-                publisher = not_found.get('publisher', 'N/A')
+                f.write(format_not_found_block(idx, not_found))
+
+        f.write(RESULTS_FOOTER)
+
+
+class ResultWriter:
+    """
+    流式结果写入器
+
+    每个搜索请求完成后立即按输入顺序追加到输出文件，不在内存中保留全部结果：
+    - 乱序完成的结果先进入重排缓冲区，等前面的序号到齐后再写出（支持并发搜索）
+    - 未找到的书籍先写入旁路临时文件，结束时追加到主文件末尾
+    - 文件开头预留固定长度的汇总头，结束时原地回填统计数字
+    """
+
+    # 汇总头预留字节数（不足部分用空格填充）
+    HEADER_RESERVED_BYTES = 1024
+
+    def __init__(self, output_file: str, search_time: str, format_name: str = "EPUB",
+                 manual_selection: bool = False):
+        """
+        Args:
+            output_file: 输出文件
+            search_time: 搜索时间（汇总头中显示）
+            format_name: 搜索的格式名称
+            manual_selection: 写入 MANUAL_SELECTION_LINE，下载时只下载标记了v的版本（如候选书籍列表）
+        """
+        self.output_file = output_file
+        self.search_time = search_time
+        self.format_name = format_name
+        self.not_found_file = output_file + ".notfound.tmp"
+
+        self.found_count = 0
+        self.not_found_count = 0
+
+        self._lock = threading.Lock()
+        self._buffer = {}  # {index: (search_key, request, books, strategy_desc, note)}
+        self._next_index = 1
+
+        self._file = open(output_file, 'w', encoding='utf-8')
+        self._not_found = open(self.not_found_file, 'w', encoding='utf-8')
+        self._file.write(self._render_header())
+        if manual_selection:
+            self._file.write(MANUAL_SELECTION_LINE + "\n")
+        self._file.write(RESULTS_FOUND_SECTION)
+        self._file.flush()
+
+    def _render_header(self) -> str:
+        """生成填充到固定长度的汇总头"""
+        total = self.found_count + self.not_found_count
+        header = format_results_header(self.search_time, total, self.found_count,
+                                       self.not_found_count, total, self.format_name)
+        padding = self.HEADER_RESERVED_BYTES - len(header.encode('utf-8')) - 1
+        return header + " " * max(padding, 0) + "\n"
+
+    def submit(self, index: int, search_key: str, request: dict, books: list, strategy_desc: str = None,
+               note: str = None):
+        """
+        提交一个搜索请求的结果
+
+        Args:
+            index: 请求在输入中的序号（从1开始，连续）
+            search_key: 搜索条件描述
+            request: 原始搜索请求
+            books: 找到的书籍列表（空列表表示未找到）
+            strategy_desc: 搜索策略描述
+            note: 未找到时的附加说明
+        """
+        with self._lock:
+            self._buffer[index] = (search_key, request, books, strategy_desc, note)
+            while self._next_index in self._buffer:
+                self._write(*self._buffer.pop(self._next_index))
+                self._next_index += 1
+            self._file.flush()
+            self._not_found.flush()
+
+    def skip(self, index: int):
+        """标记某个序号无需输出（如重复的搜索请求），避免阻塞后续结果"""
+        self.submit(index, None, None, None)
+
+    def write_unordered(self, search_key: str, request: dict, books: list, strategy_desc: str = None,
+                        note: str = None):
+        """立即写出一个不参与顺序排列的结果（之前用 skip 让出了序号，如低优先级的复查）"""
+        with self._lock:
+            self._write(search_key, request, books, strategy_desc, note)
+            self._file.flush()
+            self._not_found.flush()
+
+    def _write(self, search_key: str, request: dict, books: list, strategy_desc: str, note: str = None):
+        """写出单个结果块"""
+        if search_key is None:
+            return
+        if books:
+            self.found_count += 1
+            self._file.write(format_found_block(search_key, books, strategy_desc, self.format_name))
+        else:
+            self.not_found_count += 1
+            self._not_found.write(format_not_found_block(self.not_found_count, request, self.format_name, note))
+
+    def close(self):
+        """写出未找到列表和结尾，并回填汇总头"""
+        with self._lock:
+            if self._buffer:
+                print(f"[警告] 有 {len(self._buffer)} 个结果因序号不连续未能写出")
+            self._not_found.close()
+
+            if self.not_found_count:
+                self._file.write(RESULTS_NOT_FOUND_SECTION)
+                with open(self.not_found_file, 'r', encoding='utf-8') as f:
+                    shutil.copyfileobj(f, self._file)
+            os.remove(self.not_found_file)
+
+            self._file.write(RESULTS_FOOTER)
+            self._file.close()
+
+            header = self._render_header().encode('utf-8')
+            if len(header) <= self.HEADER_RESERVED_BYTES:
+                with open(self.output_file, 'r+b') as f:
+                    f.write(header)
+            else:
+                print(f"[警告] 汇总头超过预留长度，未回填统计信息")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ShardWriter:
+    """
+    分片进程的结果写入器（接口与 ResultWriter 相同）
+
+    结果按序号写成JSONL（每行一个请求，跳过的请求只有序号），由主进程按序号合并；
+    不参与顺序排列的结果（低优先级复查）写入单独的 .late 文件
+    """
+
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+        self.late_file = output_file + ".late"
+        self.found_count = 0
+        self.not_found_count = 0
+        self._file = open(output_file, 'w', encoding='utf-8')
+        self._late = open(self.late_file, 'w', encoding='utf-8')
+
+    def _record(self, index: int, search_key: str, request: dict, books: list, strategy_desc: str,
+                note: str) -> str:
+        if books:
+            self.found_count += 1
+        else:
+            self.not_found_count += 1
+        return json.dumps({"idx": index, "key": search_key, "request": request, "books": [dict(b) for b in books],
+                           "strategy": strategy_desc, "note": note}, ensure_ascii=False) + "\n"
+
+    def submit(self, index: int, search_key: str, request: dict, books: list, strategy_desc: str = None,
+               note: str = None):
+        self._file.write(self._record(index, search_key, request, books, strategy_desc, note))
+        self._file.flush()
+
+    def skip(self, index: int):
+        self._file.write(json.dumps({"idx": index}) + "\n")
+
+    def write_unordered(self, search_key: str, request: dict, books: list, strategy_desc: str = None,
+                        note: str = None):
+        self._late.write(self._record(0, search_key, request, books, strategy_desc, note))
+        self._late.flush()
+
+    def close(self):
+        self._file.close()
+        self._late.close()
+
+
+def read_shard_records(shard_file: str):
+    """逐行读取分片结果文件（文件不存在时为空）"""
+    if not os.path.exists(shard_file):
+        return
+    with open(shard_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def merge_shard_results(writer: ResultWriter, shard_files: list):
+    """
+    按输入顺序合并各分片的结果（各分片文件内序号递增，多路归并，不全部读入内存）
+
+    分片因时限未完成的序号直接跳过；复查结果在最后追加
+    """
+    next_index = 1
+    streams = [read_shard_records(shard_file) for shard_file in shard_files]
+    for record in heapq.merge(*streams, key=lambda r: r["idx"]):
+        index = record["idx"]
+        for missing in range(next_index, index):
+            writer.skip(missing)
+        if "key" in record:
+            writer.submit(index, record["key"], record["request"], BookRecord.from_books(record["books"]),
+                          record["strategy"], record["note"])
+        else:
+            writer.skip(index)
+        next_index = index + 1
+    for shard_file in shard_files:
+        for record in read_shard_records(shard_file + ".late"):
+            writer.write_unordered(record["key"], record["request"], BookRecord.from_books(record["books"]),
+                                   record["strategy"], record["note"])
+
+
+def miss_cache_key(search_key: str, formats: list) -> str:
+    """负缓存的键：搜索条件 + 格式偏好（换了格式偏好需要重新搜索）"""
+    return f"{search_key} | 格式偏好: {format_label(formats)}"
+
+
+def describe_miss(miss: dict) -> str:
+    """负缓存记录的说明文字"""
+    checked_at = datetime.fromtimestamp(miss["checked_at"]).strftime("%Y-%m-%d %H:%M")
+    next_check_at = datetime.fromtimestamp(miss["next_check_at"]).strftime("%Y-%m-%d %H:%M")
+    return f"之前已确认未找到（{miss['miss_count']}次，最近检查: {checked_at}，下次复查: {next_check_at}）"
+
+
+def record_search_result(catalog: Catalog, miss_key: str, request: dict, found_books: list, strategy_desc: str):
+    """更新负缓存：找到时删除记录，未找到时记录/延长复查间隔"""
+    if found_books:
+        catalog.remove_miss(miss_key)
+    else:
+        catalog.add_miss(miss_key, request, strategy_desc, NEGATIVE_CACHE_TTL,
+                         NEGATIVE_CACHE_MAX_TTL, NEGATIVE_CACHE_GROWTH)
+
+
+def recheck_misses(zlib: Zlibrary, catalog: Catalog, writer: ResultWriter, rechecks: list, formats: list) -> int:
+    """
+    低优先级复查：主搜索完成后，重新搜索已到复查时间的未找到记录
+
+    Args:
+        zlib: Zlibrary实例
+        catalog: 本地书目
+        writer: 结果写入器（复查的序号已让出，结果直接追加）
+        rechecks: [(search_key, request, constraints, miss_key)]
+        formats: 格式偏好列表
+
+    Returns:
+        (因整批时限未能复查的数量, 搜索失败的数量)
+    """
+    print("\n" + "=" * 100)
+    print(f"低优先级复查: {len(rechecks)} 个之前未找到的搜索条件")
+    print("=" * 100)
+
+    failed_count = 0
+    for r_idx, (search_key, request, constraints, miss_key) in enumerate(rechecks, 1):
+        if is_deadline_passed(zlib):
+            return len(rechecks) - r_idx + 1, failed_count
+
+        print(f"\n [复查 {r_idx}/{len(rechecks)}] {search_key}")
+        found_books, strategy_desc = search_books_with_strategy(zlib, request.get('title'), request.get('author'),
+                                                                request.get('publisher'), formats=formats,
+                                                                catalog=catalog, constraints=constraints)
+        if not found_books and is_deadline_passed(zlib):
+            return len(rechecks) - r_idx + 1, failed_count
+
+        # 复查失败（网络错误等）：保留原来的未找到记录，不延长复查间隔，下次运行再复查
+        if found_books is None:
+            failed_count += 1
+            miss = catalog.get_miss(miss_key)
+            writer.write_unordered(search_key, request, [], strategy_desc,
+                                   note=f"{describe_miss(miss)}；本次复查失败，下次运行再复查")
+            print(f"  ⚠️  复查失败，保留原来的未找到记录，下次运行再复查")
+            continue
+
+        record_search_result(catalog, miss_key, request, found_books, strategy_desc)
+        if found_books:
+            sorted_books = sort_books_by_year(found_books, descending=True)
+            writer.write_unordered(search_key, request, sorted_books, strategy_desc)
+            print(f"  ✅ 复查找到 {len(sorted_books)} 个版本，已从未找到记录中删除")
+        else:
+            miss = catalog.get_miss(miss_key)
+            writer.write_unordered(search_key, request, [], strategy_desc, note=describe_miss(miss))
+            print(f"  ❌ 仍未找到，下次复查间隔延长")
+    return 0, failed_count
+
+
+def run_searches(zlib: Zlibrary, catalog: Catalog, input_file: str, writer, formats: list,
+                 default_constraints: dict, total: int, offline: bool = False, skip_misses: bool = False,
+                 shard: tuple = None, recheck_limit: int = NEGATIVE_RECHECK_LIMIT, progress=None) -> dict:
+    """
+    依次搜索输入中的请求，结果按输入序号交给写入器
+
+    Args:
+        zlib: Zlibrary实例（离线模式为None）
+        catalog: 本地书目（为None时不使用）
+        input_file: 输入文件
+        writer: ResultWriter 或 ShardWriter
+        formats: 格式偏好列表
+        default_constraints: 全局限定条件
+        total: 本次要处理的请求数（分片时为该分片的请求数）
+        offline: 离线模式
+        skip_misses: 跳过负缓存中未到复查时间的搜索条件
+        shard: (分片序号, 分片数)，只处理属于该分片的请求；None表示全部
+        recheck_limit: 最多低优先级复查的条数
+        progress: 每处理完一个请求后调用（无参数）
+
+    Returns:
+        {"unfinished": 因时限未完成的数量, "cached_misses": 负缓存跳过的数量, "rechecks": 复查的数量,
+         "failed": 搜索失败（超时、网络错误等）的数量}
+    """
+    format_name = format_label(formats)
+    use_miss_cache = catalog is not None and not offline
+    searched_keys = CompactKeySet()
+    cached_miss_count = 0
+    unfinished_count = 0
+    failed_count = 0
+    rechecks = []
+    position = 0
+
+    for idx, request in iter_search_requests(input_file):
+        constraints = build_constraints(request, default_constraints)
+        search_key = build_search_key(request, constraints)
+        if shard is not None and shard_of(search_key, shard[1]) != shard[0]:
+            continue
+        position += 1
+        if progress is not None and position > 1:
+            progress()
+        if is_deadline_passed(zlib):
+            unfinished_count = total - position + 1
+            break
+
+        title = request.get('title')
+        author = request.get('author')
+        publisher = request.get('publisher')
+
+        search_term = build_search_term(title, author, publisher)
+
+        print(f"\n{'─' * 100}")
+        print(f" [{position}/{total}] 搜索: {search_term}")
+        print(f"{'─' * 100}")
+
+        # 重复的搜索请求只搜索一次
+        if not searched_keys.add(search_key):
+            print(f"  ⏭️  重复的搜索请求，跳过")
+            writer.skip(idx)
+            continue
+
+        # 之前未找到的搜索条件：未到复查时间的直接跳过，到期的让出序号，放到最后低优先级复查
+        miss_key = miss_cache_key(search_key, constraints.get('formats') or formats)
+        miss = catalog.get_miss(miss_key) if skip_misses else None
+        if miss is not None:
+            if miss["next_check_at"] <= time.time() and len(rechecks) < recheck_limit:
+                print(f"  🔁 之前未找到，已到复查时间，放到最后低优先级复查")
+                writer.skip(idx)
+                rechecks.append((search_key, request, constraints, miss_key))
+            else:
+                print(f"  ⏭️  {describe_miss(miss)}，跳过")
+                writer.submit(idx, search_key, request, [], note=describe_miss(miss))
+                cached_miss_count += 1
+            continue
+
+        # 使用智能约束策略搜索
+        found_books, strategy_desc = search_books_with_strategy(zlib, title, author, publisher, formats=formats,
+                                                                catalog=catalog, offline=offline,
+                                                                constraints=constraints)
+
+        # 搜索因整批时限被中断，结果不可信，不写入
+        if not found_books and is_deadline_passed(zlib):
+            unfinished_count = total - position + 1
+            break
+
+        # 搜索失败（超时、网络错误等）不是未找到：不写入负缓存、不计入未找到，下次运行重新搜索
+        if found_books is None:
+            failed_count += 1
+            writer.skip(idx)
+            print(f"  ⚠️  搜索失败，不计入未找到，下次运行重新搜索")
+            continue
+
+        if use_miss_cache:
+            record_search_result(catalog, miss_key, request, found_books, strategy_desc)
+
+        if found_books:
+            # 按年份降序排序
+            sorted_books = sort_books_by_year(found_books, descending=True)
+            writer.submit(idx, search_key, request, sorted_books, strategy_desc)
+            print(f"  ✅ 找到 {len(sorted_books)} 个可下载的{(sorted_books[0].get('extension') or format_name).upper()}版本")
+
+            # 显示找到的版本（已按年份降序排序）
+            for v_idx, book in enumerate(sorted_books, 1):
+                print(f"     版本{v_idx}: {book['title']} - {book['author']} - {book['year']} - {format_file_size(book['file_size'])}")
+        else:
+            writer.submit(idx, search_key, request, [], strategy_desc)
+            print(f"  ❌ 未找到可下载的{format_name}")
+    else:
+        if progress is not None and position:
+            progress()
+
+    if rechecks:
+        if unfinished_count:
+            unfinished_count += len(rechecks)
+        else:
+            unfinished_count, recheck_failed = recheck_misses(zlib, catalog, writer, rechecks, formats)
+            failed_count += recheck_failed
+    return {"unfinished": unfinished_count, "cached_misses": cached_miss_count, "rechecks": len(rechecks),
+            "failed": failed_count}
+
+
+def run_shard(shard: int, shards: int, total: int, input_file: str, shard_file: str, formats: list,
+              default_constraints: dict, options: dict, messages):
+    """
+    分片进程入口：登录（复用主进程保存的登录缓存）、搜索属于本分片的请求，结果写入分片文件
+
+    详细输出写入 <分片文件>.log；进度和统计通过 messages 队列发给主进程:
+    ("progress", 分片, 已处理, 已找到) / ("done", 分片, 统计信息, 耗时)；
+    开启对冲时统计信息中带有本分片的对冲统计（"hedge"）
+    """
+    sys.stdout = open(shard_file + ".log", 'w', encoding='utf-8', buffering=1)
+    start_time = time.time()
+    stats = {"unfinished": total, "cached_misses": 0, "rechecks": 0, "failed": 0}
+    catalog = None
+    zlib = None
+    writer = ShardWriter(shard_file)
+    try:
+        if options["catalog_file"]:
+            catalog = Catalog(options["catalog_file"], busy_timeout=SHARD_CATALOG_BUSY_TIMEOUT)
+        if not options["offline"]:
+            zlib = login_and_check()
+            if zlib is None:
+                raise RuntimeError("登录失败")
+            if options["deadline_at"] is not None:
+                zlib.setDeadline(options["deadline_at"] - time.time())
+            if options["hedge"]:
+                zlib.enableHedging(percentile=HEDGE_PERCENTILE, max_ratio=HEDGE_MAX_RATIO, mirrors=HEDGE_MIRRORS)
+
+        done = [0]
+
+        def progress():
+            done[0] += 1
+            messages.put(("progress", shard, done[0], writer.found_count))
+
+        stats = run_searches(zlib, catalog, input_file, writer, formats, default_constraints, total,
+                             offline=options["offline"], skip_misses=options["skip_misses"], shard=(shard, shards),
+                             recheck_limit=-(-NEGATIVE_RECHECK_LIMIT // shards), progress=progress)
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+        messages.put(("error", shard, traceback.format_exc(limit=1)))
+    finally:
+        writer.close()
+        if catalog is not None:
+            catalog.close()
+        if zlib is not None and options["hedge"]:
+            stats = dict(stats, hedge=zlib.getHedgeStats())
+        messages.put(("done", shard, stats, time.time() - start_time))
+
+
+def run_sharded(input_file: str, output_file: str, writer: ResultWriter, shards: int, formats: list,
+                default_constraints: dict, options: dict) -> dict:
+    """
+    多进程分片搜索：每片一个进程，汇总显示各分片进度，结束后按输入顺序合并到 writer
+
+    Returns:
+        与 run_searches 相同的统计信息（各分片合计）；开启对冲时另有各分片合计的对冲统计（"hedge"）
+    """
+    import multiprocessing
+
+    sizes = [0] * shards
+    for _, request in iter_search_requests(input_file):
+        sizes[shard_of(build_search_key(request, build_constraints(request, default_constraints)), shards)] += 1
+    shard_files = [f"{output_file}.shard{shard + 1}" for shard in range(shards)]
+
+    messages = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=run_shard, args=(shard, shards, sizes[shard], input_file, shard_files[shard],
+                                                        formats, default_constraints, options, messages))
+        for shard in range(shards)
+    ]
+    print(f"🧩 分片搜索: {shards} 个进程，各分片请求数: {', '.join(str(size) for size in sizes)}")
+    print(f"   各分片的详细输出: {output_file}.shardN.log")
+    start_time = time.time()
+    for process in processes:
+        process.start()
+
+    progress = [[0, 0] for _ in range(shards)]  # [已处理, 已找到]
+    results = [None] * shards
+    last_report = 0.0
+    while any(result is None for result in results):
+        try:
+            message = messages.get(timeout=1)
+        except queue.Empty:
+            # 进程异常退出、没有发出完成消息
+            for shard, process in enumerate(processes):
+                if results[shard] is None and not process.is_alive() and messages.empty():
+                    print(f"  ❌ 分片{shard + 1} 异常退出 (退出码 {process.exitcode})")
+                    results[shard] = ({"unfinished": sizes[shard] - progress[shard][0], "cached_misses": 0,
+                                       "rechecks": 0, "failed": 0}, time.time() - start_time)
+            continue
+        kind, shard = message[0], message[1]
+        if kind == "progress":
+            progress[shard] = [message[2], message[3]]
+        elif kind == "error":
+            print(f"  ❌ 分片{shard + 1} 出错: {message[2].strip()}")
+        elif kind == "done":
+            results[shard] = (message[2], message[3])
+            print(f"  ✅ 分片{shard + 1} 完成: {progress[shard][0]}/{sizes[shard]}，"
+                  f"找到 {progress[shard][1]}，耗时 {message[3]:.2f}秒")
+        if time.time() - last_report >= SHARD_PROGRESS_INTERVAL:
+            last_report = time.time()
+            done = sum(p[0] for p in progress)
+            elapsed = time.time() - start_time
+            print(f"  [进度] {done}/{sum(sizes)} ({done / elapsed if elapsed > 0 else 0:.1f} 本/秒) | " +
+                  " | ".join(f"分片{shard + 1} {p[0]}/{sizes[shard]}" for shard, p in enumerate(progress)))
+    for process in processes:
+        process.join()
+
+    print(f"🧩 合并 {shards} 个分片的结果...")
+    merge_shard_results(writer, shard_files)
+    for shard_file in shard_files:
+        for path in (shard_file, shard_file + ".late"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    totals = {key: sum(stats[key] for stats, _ in results)
+              for key in ("unfinished", "cached_misses", "rechecks", "failed")}
+    # 延迟分位不能跨分片合并，只合计请求数、对冲数和对冲胜出数
+    hedge_stats = [stats["hedge"] for stats, _ in results if stats.get("hedge")]
+    if hedge_stats:
+        hedge = {key: sum(h[key] for h in hedge_stats) for key in ("requests", "hedged", "hedge_wins")}
+        hedge["hedge_rate"] = hedge["hedged"] / hedge["requests"] if hedge["requests"] else 0.0
+        totals["hedge"] = hedge
+    return totals
+
+
+def login_and_check() -> Zlibrary:
+    """
+    登录并做前置连接检查（有登录缓存时不发起网络请求）
+
+    Returns:
+        Zlibrary实例，登录或连接测试失败时返回None
+    """
+    if DEFAULT_REMIX_USERID and DEFAULT_REMIX_USERKEY:
+        print(f"\n使用Remix Token登录...")
+        zlib = Zlibrary(remix_userid=DEFAULT_REMIX_USERID, remix_userkey=DEFAULT_REMIX_USERKEY,
+                        session_file=SESSION_CACHE_FILE, timeouts=REQUEST_TIMEOUTS)
+    else:
+        print(f"\n使用邮箱+密码登录: {DEFAULT_EMAIL}")
+        zlib = Zlibrary(email=DEFAULT_EMAIL, password=DEFAULT_PASSWORD, session_file=SESSION_CACHE_FILE,
+                        timeouts=REQUEST_TIMEOUTS)
+
+    if not zlib.isLoggedIn():
+        print("\n❌ 登录失败！请检查配置")
+        print(f"  可能原因:")
+        print(f"  - 网络连接问题")
+        print(f"  - 账号或密码错误")
+        print(f"  - 服务器无响应")
+        return None
+
+    # 缓存的个人资料足够新时，跳过个人资料请求和前置连接测试
+    profile = zlib.getCachedProfile(PROFILE_CACHE_MAX_AGE)
+    profile_cached = profile is not None
+    if not profile_cached:
+        profile = zlib.getProfile()
+    user = profile['user']
+    print(f"\n✅ 登录成功!{'（使用缓存）' if profile_cached else ''}")
+    print(f"   用户: {user['name']}")
+    print(f"   今日剩余下载次数: {user.get('downloads_limit', 10) - user.get('downloads_today', 0)}")
+
+    # 前置连接测试
+    if not profile_cached and not test_connection(zlib):
+        print("\n❌ 连接测试失败，程序终止")
+        print(f"  请检查:")
+        print(f"  - 网络连接是否正常")
+        print(f"  - 防火墙是否阻止了连接")
+        print(f"  - Zlibrary服务器是否正常运行")
+        return None
+
+    return zlib
+
+
+def is_deadline_passed(zlib: Zlibrary) -> bool:
+    """是否已超过整批搜索时限（未设置时限或离线模式时返回False）"""
+    if zlib is None:
+        return False
+    remaining = zlib.getRemainingTime()
+    return remaining is not None and remaining <= 0
+
+
+def get_arg_value(name: str, default: str = None) -> str:
+    """
+    读取命令行参数值，支持 "--name value" 和 "--name=value" 两种写法
+
+    Args:
+        name: 参数名（如 "--catalog"）
+        default: 默认值
+
+    Returns:
+        参数值
+    """
+    for idx, arg in enumerate(sys.argv):
+        if arg == name and idx + 1 < len(sys.argv):
+            return sys.argv[idx + 1]
+        if arg.startswith(name + "="):
+            return arg.split("=", 1)[1]
+    return default
+
 
-                f.write(f"{idx}. 书名: {title}\n")
-                f.write(f"   作者: {author}\n")
-                f.write(f"   出版社: {publisher}\n")
-                f.write(f"   原因: 未找到可下载的EPUB格式\n\n")
+# 需要带值的命令行参数（读取位置参数时跳过其值）
+VALUE_OPTIONS = ("--catalog", "--deadline", "--formats", "--language", "--year-from", "--year-to", "--shards",
+                 "--record", "--replay")
 
-        f.write("=" * 100 + "\n")
-        f.write("搜索完成\n")
-        f.write("=" * 100 + "\n")
+
+def get_positional_args(value_options: tuple = VALUE_OPTIONS) -> list:
+    """读取位置参数（去掉 --xxx 选项及其值，value_options 为需要带值的选项）"""
+    args = []
+    skip_next = False
+    for arg in sys.argv[1:]:
+        if skip_next:
+            skip_next = False
+        elif arg in value_options:
+            skip_next = True
+        elif not arg.startswith("--"):
+            args.append(arg)
+    return args
 
 
 def main():
@@ -663,135 +1740,200 @@ def main():
     print("=" * 100)
 
     # 检查命令行参数
-    if len(sys.argv) < 2:
+    args = get_positional_args()
+    if len(args) < 1:
         print("\n使用方法:")
-        print("  python batch_search.py <输入JSON文件> [输出文件]")
+        print("  python batch_search.py <输入JSON文件> [输出文件] [选项]")
+        print("\n选项:")
+        print("  --offline           离线模式，只在本地书目中搜索")
+        print("  --no-catalog        不使用本地书目")
+        print(f"  --catalog <文件>    本地书目文件（默认: {DEFAULT_CATALOG_FILE}）")
+        print("  --deadline <秒>     整批搜索的总时限，到时停止")
+        print("  --hedge             开启对冲请求，减少慢请求拖长整批耗时")
+        print(f"  --formats <列表>    格式偏好列表，逗号分隔（默认: {','.join(DEFAULT_FORMATS)}）")
+        print("  --language <列表>   只搜索这些语言，逗号分隔（如 chinese,english）")
+        print("  --year-from <年份>  出版年份下限")
+        print("  --year-to <年份>    出版年份上限")
+        print("  --no-miss-cache     不跳过之前未找到的书，全部重新搜索")
+        print("  --shards <K>        分成K个进程并行搜索（各自的会话），结束后按输入顺序合并")
+        print("  --profile           性能分析（cProfile），报告写入 profiles/，含网络等待与本地处理的时间划分")
+        print("  --profile-sample    采样性能分析（开销很小，可长期开启）")
+        print("  --profile-memory    内存分析（tracemalloc），报告峰值时分配最多的位置")
+        print("  --record <文件>     把所有请求和响应（含耗时）录制到文件")
+        print("  --replay <文件>     从录制文件回放，不连接服务器（按录制时的耗时等待）")
+        print("  --replay-fast       回放时不等待，全速回放")
         print("\n示例:")
         print("  python batch_search.py 1.txt")
         print("  python batch_search.py 1.txt output.txt")
+        print("  python batch_search.py 1.txt --offline")
+        print("  python batch_search.py 1.txt --formats epub,azw3,mobi,pdf")
+        print("  python batch_search.py 1.txt --shards 4")
         print("\n默认输入文件: 1.txt")
         print("默认输出文件: list.txt")
         return
 
-    input_file = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else "list.txt"
-
-    # 登录
-    if DEFAULT_REMIX_USERID and DEFAULT_REMIX_USERKEY:
-        print(f"\n使用Remix Token登录...")
-        zlib = Zlibrary(remix_userid=DEFAULT_REMIX_USERID, remix_userkey=DEFAULT_REMIX_USERKEY)
-    else:
-        print(f"\n使用邮箱+密码登录: {DEFAULT_EMAIL}")
-        print(f"  [状态] 正在连接服务器...")
-        zlib = Zlibrary(email=DEFAULT_EMAIL, password=DEFAULT_PASSWORD)
-
-    if not zlib.isLoggedIn():
-        print("\n❌ 登录失败！请检查配置")
-        print(f"  可能原因:")
-        print(f"  - 网络连接问题")
-        print(f"  - 账号或密码错误")
-        print(f"  - 服务器无响应")
+    input_file = args[0]
+    output_file = args[1] if len(args) > 1 else "list.txt"
+    offline = "--offline" in sys.argv
+    formats = parse_formats(get_arg_value("--formats", ",".join(DEFAULT_FORMATS)))
+    if not formats:
+        print("\n❌ --formats 至少需要一种格式")
         return
-
-    profile = zlib.getProfile()
-    print(f"\n✅ 登录成功!")
-    print(f"   用户: {profile['user']['name']}")
-    print(f"   今日剩余下载次数: {zlib.getDownloadsLeft()}")
-
-    # 前置连接测试
-    if not test_connection(zlib):
-        print("\n❌ 连接测试失败，程序终止")
-        print(f"  请检查:")
-        print(f"  - 网络连接是否正常")
-        print(f"  - 防火墙是否阻止了连接")
-        print(f"  - Zlibrary服务器是否正常运行")
+    format_name = format_label(formats)
+    shards = int(get_arg_value("--shards", 1))
+    if shards < 1:
+        print("\n❌ --shards 至少为1")
+        return
+    # 全局限定条件（搜索请求中的字段优先）
+    default_constraints = {
+        "language": get_arg_value("--language", ",".join(DEFAULT_LANGUAGES)),
+        "year_from": get_arg_value("--year-from", DEFAULT_YEAR_FROM),
+        "year_to": get_arg_value("--year-to", DEFAULT_YEAR_TO),
+    }
+    default_desc = describe_constraints(build_constraints({}, default_constraints))
+    catalog = None
+    if "--no-catalog" not in sys.argv:
+        catalog = Catalog(get_arg_value("--catalog", DEFAULT_CATALOG_FILE))
+    elif offline:
+        print("\n❌ 离线模式需要本地书目，不能与 --no-catalog 同时使用")
         return
 
-    # 加载搜索请求
+    # 检查搜索请求（先读本地文件，输入有误时无需联网；流式读取，不把整个文件载入内存）
     print(f"\n[准备] 正在读取搜索条件: {input_file}")
-    search_requests = load_search_requests(input_file)
+    scan = scan_search_requests(input_file)
 
-    if not search_requests:
+    if not scan or not scan[0]:
         print("❌ 错误: 无法加载搜索请求")
         return
+    total_requests, unique_count = scan
 
-    # 统计去重后的数量
-    unique_keys = set()
-    for req in search_requests:
-        key = f"{req.get('title', '')}|{req.get('author', '')}|{req.get('publisher', '')}"
-        unique_keys.add(key)
-
-    print(f"✅ 找到 {len(search_requests)} 个搜索请求（其中 {len(search_requests) - len(unique_keys)} 个重复）")
-    print(f"✅ 实际将搜索 {len(unique_keys)} 本不同的书")
-
-    # 执行搜索
-    found_books = {}
-    not_found_books = []
-    strategies = {}
+    # 登录（离线模式不需要联网；分片模式下各进程复用这里保存的登录缓存）
+    zlib = None
+    deadline = None
+    if offline:
+        print(f"\n📴 离线模式：只在本地书目中搜索 ({catalog.count()} 本书籍记录)")
+    else:
+        zlib = login_and_check()
+        if zlib is None:
+            return
+
+        # 整批时限：到时后进行中的请求超时返回，未搜索的请求不写入结果
+        deadline = get_arg_value("--deadline", BATCH_DEADLINE)
+        if deadline is not None:
+            zlib.setDeadline(float(deadline))
+            print(f"\n⏰ 整批搜索时限: {float(deadline):g}秒")
+
+        if "--hedge" in sys.argv:
+            zlib.enableHedging(percentile=HEDGE_PERCENTILE, max_ratio=HEDGE_MAX_RATIO, mirrors=HEDGE_MIRRORS)
+            print(f"\n🔀 对冲请求已开启 (P{HEDGE_PERCENTILE:g}, 上限 {HEDGE_MAX_RATIO:.0%})")
+
+    print(f"✅ 找到 {total_requests} 个搜索请求（其中 {total_requests - unique_count} 个重复）")
+    print(f"✅ 实际将搜索 {unique_count} 本不同的书")
+    if shards > 1:
+        print(f"✅ 分片搜索: {shards} 个进程")
+    if len(formats) > 1:
+        print(f"✅ 格式偏好: {' > '.join(fmt.upper() for fmt in formats)}（每本书选用第一个能找到的格式）")
+    if default_desc:
+        print(f"✅ 默认限定条件: {default_desc}")
+
+    # 执行搜索（结果按输入顺序流式写入输出文件）
     search_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    writer = ResultWriter(output_file, search_time, format_name)
+
+    # 负缓存（离线模式只查本地，不使用）
+    skip_misses = catalog is not None and not offline and "--no-miss-cache" not in sys.argv
+    if skip_misses and catalog.count_misses():
+        print(f"✅ 负缓存: {catalog.count_misses()} 个之前未找到的搜索条件，到复查时间前跳过")
 
     print("\n" + "=" * 100)
     print("开始批量搜索...（使用智能约束策略）")
+    if shards > 1:
+        print(f"结果将在所有分片完成后按输入顺序写入: {output_file}")
+    else:
+        print(f"结果将实时写入: {output_file}")
     print("=" * 100)
 
     search_total_start = time.time()
+    # 分片进程的设置（时限换算为绝对时间，各进程共用同一个截止时间）
+    shard_options = {
+        "offline": offline,
+        "skip_misses": skip_misses,
+        "catalog_file": catalog.db_file if catalog is not None else None,
+        "deadline_at": search_total_start + float(deadline) if deadline is not None else None,
+        "hedge": "--hedge" in sys.argv,
+    }
+
+    unfinished_count = 0
+    cached_miss_count = 0
+    recheck_count = 0
+    failed_count = 0
+    hedge_stats = None
 
-    for idx, request in enumerate(search_requests, 1):
-        title = request.get('title')
-        author = request.get('author')
-        publisher = request.get('publisher')
-
-        search_term = build_search_term(title, author, publisher)
-        search_key = f"书名: {title or 'N/A'} | 作者: {author or 'N/A'} | 出版社: {publisher or 'N/A'}"
-
-        print(f"\n{'─' * 100}")
-        print(f" [{idx}/{len(search_requests)}] 搜索: {search_term}")
-        print(f"{'─' * 100}")
-
-        # 使用智能约束策略搜索
-        epub_books, strategy_desc = search_epub_books_with_strategy(zlib, title, author, publisher)
-        strategies[search_key] = strategy_desc
-
-        if epub_books:
-            # 按年份降序排序
-            sorted_books = sort_books_by_year(epub_books, descending=True)
-            found_books[search_key] = sorted_books
-            print(f"  ✅ 找到 {len(sorted_books)} 个可下载的EPUB版本")
-
-            # 显示找到的版本（已按年份降序排序）
-            for v_idx, book in enumerate(sorted_books, 1):
-                print(f"     版本{v_idx}: {book['title']} - {book['author']} - {book['year']} - {format_file_size(book['file_size'])}")
+    try:
+        if shards > 1:
+            run_stats = run_sharded(input_file, output_file, writer, shards, formats, default_constraints,
+                                    shard_options)
         else:
-            not_found_books.append(request)
-            print(f"  ❌ 未找到可下载的EPUB")
+            run_stats = run_searches(zlib, catalog, input_file, writer, formats, default_constraints,
+                                     total_requests, offline=offline, skip_misses=skip_misses)
+        unfinished_count = run_stats["unfinished"]
+        cached_miss_count = run_stats["cached_misses"]
+        recheck_count = run_stats["rechecks"]
+        failed_count = run_stats["failed"]
+        hedge_stats = run_stats.get("hedge")
+    finally:
+        search_total_time = time.time() - search_total_start
+
+        # 写出未找到列表并回填汇总头
+        save_start = time.time()
+        writer.close()
+        save_time = time.time() - save_start
+        if catalog is not None:
+            catalog.close()
 
-    search_total_time = time.time() - search_total_start
     print(f"\n{'─' * 100}")
+    if unfinished_count:
+        print(f"⏰ 已达到整批搜索时限，剩余 {unfinished_count} 个搜索请求未完成")
     print(f"✅ 批量搜索完成！")
     print(f"   总耗时: {search_total_time:.2f}秒")
-    print(f"   平均每本: {search_total_time / len(search_requests):.2f}秒")
+    print(f"   平均每本: {search_total_time / total_requests:.2f}秒")
 
-    # 保存结果到文件
     print("\n" + "=" * 100)
-    print(f"正在保存结果到: {output_file}")
-    save_start = time.time()
-    save_results_to_file(output_file, found_books, not_found_books, search_time, strategies)
-    save_time = time.time() - save_start
-    print(f"✅ 结果已保存 (耗时: {save_time:.2f}秒)")
+    print(f"✅ 结果已保存到: {output_file} (汇总耗时: {save_time:.2f}秒)")
 
     total_program_time = time.time() - program_start
     print("=" * 100)
     print(f"\n📊 统计信息:")
-    print(f"  总搜索: {len(search_requests)} 本书")
-    print(f"  找到可下载EPUB: {len(found_books)} 本书")
-    print(f"  未找到: {len(not_found_books)} 本书")
+    print(f"  总搜索: {total_requests} 本书")
+    print(f"  找到可下载{format_name}: {writer.found_count} 本书")
+    print(f"  未找到: {writer.not_found_count} 本书")
+    if cached_miss_count or recheck_count:
+        print(f"  负缓存跳过: {cached_miss_count} 本书，低优先级复查: {recheck_count} 本书")
+    if failed_count:
+        print(f"  搜索失败: {failed_count} 本书（超时、网络错误等，不计入未找到，下次运行重新搜索）")
     print(f"  结果已保存到: {output_file}")
     print(f"\n⏱️  时间统计:")
     print(f"  程序总运行时间: {total_program_time:.2f}秒")
     print(f"  搜索阶段: {search_total_time:.2f}秒")
     print(f"  保存文件: {save_time:.2f}秒")
+    if zlib is not None and "--hedge" in sys.argv and shards == 1:
+        hedge_stats = zlib.getHedgeStats()
+    if hedge_stats is not None:
+        print(f"\n🔀 对冲统计{f'（{shards} 个分片合计）' if shards > 1 else ''}:")
+        print(f"  请求数: {hedge_stats['requests']}")
+        print(f"  对冲数: {hedge_stats['hedged']} (对冲率: {hedge_stats['hedge_rate']:.1%})")
+        print(f"  对冲胜出: {hedge_stats['hedge_wins']}")
+        if "search_p50" in hedge_stats:
+            print(f"  搜索延迟: P50 {hedge_stats['search_p50']:.2f}秒 / P99 {hedge_stats['search_p99']:.2f}秒")
     print("=" * 100)
 
 
 if __name__ == "__main__":
-    main()
+    record_file, replay_file = get_arg_value("--record"), get_arg_value("--replay")
+    recording = nullcontext()
+    if record_file or replay_file:
+        import cassette
+
+        recording = cassette.session(record_file, replay_file, "--replay-fast" not in sys.argv)
+    with recording, profiling.session("batch_search"):
+        main()
@@ -0,0 +1,493 @@
+"""
+请求录制与回放 - 把一次真实运行的所有HTTP请求和响应（含耗时）录制到文件，之后离线回放
+
+- 录制（--record <文件>）: 每个请求一行JSON（方法、路径、参数、状态码、部分响应头、响应内容、耗时），
+                         响应内容用 zlib 压缩后 base64 编码；流式下载的文件内容和超过 CASSETTE_INLINE_LIMIT 的
+                         响应内容保存在 <文件>.bodies/ 目录中（原样保存，录制时边读边写，不整个读入内存）；
+                         网络错误/超时也会录制，回放时抛出同样的异常
+- 回放（--replay <文件>）: 不连接服务器，按 方法+路径+参数 从录制文件中返回响应，
+                         默认按录制时的耗时等待（--replay-fast 不等待，全速回放）
+
+用同一个录制文件反复回放，可以在不访问服务的情况下比较 batch_search / batch_download 本地逻辑修改前后的性能。
+录制文件中密码和 remix_userkey 会被替换为 "***"。录制和回放时都不使用登录缓存文件（不读取、不写入），
+总是实际登录，录制文件不依赖录制时的登录缓存状态，可以在其他机器上回放。
+"""
+import base64
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from Zlibrary import setSessionFactory
+
+CASSETTE_VERSION = 1
+# 超过这个大小的响应内容不写在录制文件的行中，单独保存在 <录制文件>.bodies/ 目录中（流式下载总是单独保存）
+CASSETTE_INLINE_LIMIT = 256 * 1024
+# 回放时从单独保存的文件读取内容的块大小
+CASSETTE_READ_CHUNK = 64 * 1024
+# 录制时保留的响应头
+RECORDED_HEADERS = ("Content-Type", "Content-Length", "Content-Encoding", "ETag")
+# 不写入录制文件的字段（请求参数和响应JSON中）
+SENSITIVE_FIELDS = ("password", "remix_userkey")
+REDACTED = "***"
+
+
+def _redact(value):
+    """把敏感字段替换为 REDACTED（递归处理字典和列表）"""
+    if isinstance(value, dict):
+        return {key: REDACTED if key in SENSITIVE_FIELDS else _redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_redact(item) for item in value]
+    return value
+
+
+def _redact_body(content: bytes) -> bytes:
+    """响应JSON中含有敏感字段时替换掉（不含时原样返回，不重新编码）"""
+    if not any(field.encode() in content for field in SENSITIVE_FIELDS):
+        return content
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return content
+    return json.dumps(_redact(data), ensure_ascii=False).encode("utf-8")
+
+
+def _request_key(method: str, url: str, query) -> tuple:
+    """
+    回放时匹配请求用的键
+
+    Returns:
+        (方法+路径+参数, 方法+路径)；不含域名，镜像域名的请求也能匹配
+    """
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    params = json.dumps(query, sort_keys=True, ensure_ascii=False, default=str) if query else ""
+    return f"{method} {path} {params}", f"{method} {path}"
+
+
+def _query_of(method: str, kwargs: dict):
+    """请求参数（POST的表单数据或GET的查询参数），已去掉敏感字段"""
+    query = kwargs.get("data") if method == "POST" else kwargs.get("params")
+    return _redact(dict(query)) if query else None
+
+
+def _recorded_error(name: str, message: str = None) -> Exception:
+    """按录制的异常类名重建 requests 的异常（未知的类名使用 RequestException）"""
+    import requests
+
+    error_class = getattr(requests.exceptions, name, None)
+    if not (isinstance(error_class, type) and issubclass(error_class, requests.exceptions.RequestException)):
+        error_class = requests.exceptions.RequestException
+    return error_class(message or name)
+
+
+class CassetteResponse:
+    """录制文件中的响应（提供 Zlibrary 和调用方用到的 requests.Response 接口）"""
+
+    def __init__(self, status_code: int, headers: dict, content: bytes, url: str,
+                 body_time: float = 0.0, realtime: bool = False, body_path: str = None,
+                 body_error: Exception = None):
+        """
+        Args:
+            content: 响应内容（body_path 不为None时为None，读取时才从文件加载）
+            body_time: 录制时读取响应内容的耗时（按原耗时回放时在 iter_content 中分摊）
+            body_path: 单独保存响应内容的文件
+            body_error: 读完内容后抛出的异常（录制时读取内容出错，或调用方没有读完）
+        """
+        from requests.structures import CaseInsensitiveDict
+
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers or {})
+        self._content = content
+        self.url = url
+        self.body_time = body_time
+        self.realtime = realtime
+        self.body_path = body_path
+        self.body_error = body_error
+
+    @property
+    def content(self) -> bytes:
+        if self._content is None:
+            self._content = b"".join(self.iter_content(CASSETTE_READ_CHUNK))
+        return self._content
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size: int = 1, decode_unicode: bool = False):
+        """按块返回内容；按原耗时回放时，录制时读取内容的耗时按块大小分摊"""
+        if self._content is not None or self.body_path is None:
+            content = self._content or b""
+            total = len(content)
+            chunks = (content[start:start + chunk_size] for start in range(0, total, chunk_size or total or 1))
+            yield from self._paced(chunks, total)
+        else:
+            with open(self.body_path, "rb") as f:
+                total = os.fstat(f.fileno()).st_size
+                yield from self._paced(iter(lambda: f.read(chunk_size or CASSETTE_READ_CHUNK), b""), total)
+        if self.body_error is not None:
+            raise self.body_error
+
+    def _paced(self, chunks, total: int):
+        for chunk in chunks:
+            if self.realtime and self.body_time > 0:
+                time.sleep(self.body_time * len(chunk) / total)
+            yield chunk
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+
+            raise requests.exceptions.HTTPError(f"HTTP {self.status_code}: {self.url}", response=self)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordingSession:
+    """录制用的会话：请求交给真实的 requests.Session，同时写入录制文件"""
+
+    def __init__(self, session, recorder: "CassetteRecorder"):
+        self._session = session
+        self._recorder = recorder
+
+    def get(self, url: str, **kwargs):
+        return self._request("GET", url, kwargs, self._session.get)
+
+    def post(self, url: str, **kwargs):
+        return self._request("POST", url, kwargs, self._session.post)
+
+    def _request(self, method: str, url: str, kwargs: dict, send):
+        import requests
+
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            response = send(url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self._recorder.add(method, url, kwargs, started_at, time.perf_counter() - started, error=e)
+            raise
+        duration = time.perf_counter() - started
+
+        if kwargs.get("stream"):
+            # 流式响应在调用方读取内容时边读边录制，读完或关闭响应时写入录制文件
+            return RecordingStream(response, self._recorder, (method, url, kwargs, started_at, duration))
+        self._recorder.add(method, url, kwargs, started_at, duration, response=response)
+        return response
+
+    def close(self):
+        self._session.close()
+
+
+class RecordingStream:
+    """
+    录制中的流式响应：调用方通过 iter_content 读取的数据块同时写入单独的文件
+
+    不整个读入内存，调用方按块检查时限/取消的逻辑不变。调用方没有读完就关闭时，
+    录制已读到的部分，回放读到这里时抛出连接错误。
+    """
+
+    def __init__(self, response, recorder: "CassetteRecorder", request: tuple):
+        self._response = response
+        self._recorder = recorder
+        self._request = request  # (方法, URL, 请求参数, 开始时间, 收到响应头的耗时)
+        self._body_name, self._body_file = recorder.open_body()
+        self._body_started = None
+        self._complete = False
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # status_code、headers、ok、raise_for_status 等直接使用真实的响应
+        return getattr(self._response, name)
+
+    @property
+    def content(self) -> bytes:
+        return b"".join(self.iter_content(CASSETTE_READ_CHUNK))
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size: int = 1, decode_unicode: bool = False):
+        import requests
+
+        if self._body_started is None:
+            self._body_started = time.perf_counter()
+        try:
+            for chunk in self._response.iter_content(chunk_size=chunk_size):
+                self._body_file.write(chunk)
+                yield chunk
+        except requests.exceptions.RequestException as e:
+            self._finish(e)
+            raise
+        self._complete = True
+        self._finish()
+
+    def _finish(self, error: Exception = None):
+        """写入录制文件（只写一次）"""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        self._body_file.close()
+        if error is None and not self._complete:
+            import requests
+
+            error = requests.exceptions.ConnectionError("录制时没有读完响应内容")
+        body_time = time.perf_counter() - self._body_started if self._body_started is not None else 0.0
+        method, url, kwargs, started_at, duration = self._request
+        self._recorder.add(method, url, kwargs, started_at, duration, response=self._response,
+                           body_time=body_time, body_name=self._body_name, body_error=error)
+
+    def close(self):
+        self._finish()
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CassetteRecorder:
+    """
+    录制文件写入器
+
+    每个请求一行，用 O_APPEND 一次写入一整行，多线程和 fork 出的分片进程可以同时录制到同一个文件。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.body_dir = path + ".bodies"
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._body_ids = itertools.count(1)
+        # 录制文件中可能含有账号信息，只允许当前用户读写
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o600)
+        self._write({"cassette": CASSETTE_VERSION, "recorded_at": datetime.now().isoformat()})
+        # 上次录制留下的响应内容文件
+        shutil.rmtree(self.body_dir, ignore_errors=True)
+
+    def _write(self, entry: dict):
+        line = (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            os.write(self._fd, line)
+
+    def wrap(self, session) -> RecordingSession:
+        """包装新建的 requests.Session（用于 Zlibrary.setSessionFactory）"""
+        return RecordingSession(session, self)
+
+    def open_body(self) -> tuple:
+        """
+        新建单独保存响应内容的文件
+
+        Returns:
+            (相对于 body_dir 的文件名, 以二进制写入方式打开的文件)
+        """
+        os.makedirs(self.body_dir, mode=0o700, exist_ok=True)
+        # 文件名含进程号，fork 出的分片进程不会重名
+        name = f"{os.getpid()}-{next(self._body_ids)}.bin"
+        fd = os.open(os.path.join(self.body_dir, name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        return name, os.fdopen(fd, "wb")
+
+    def add(self, method: str, url: str, kwargs: dict, started_at: float, duration: float, response=None,
+            body_time: float = 0.0, error: Exception = None, body_name: str = None,
+            body_error: Exception = None):
+        """
+        录制一个请求（response 和 error 二选一）
+
+        Args:
+            started_at: 请求开始的时间戳
+            duration: 到收到响应头的耗时
+            body_time: 读取响应内容的耗时（流式响应）
+            body_name: 响应内容已单独保存时的文件名（open_body 返回的）
+            body_error: 读取响应内容时的异常
+        """
+        entry = {
+            "m": method,
+            "u": url,
+            "q": _query_of(method, kwargs),
+            "t": round(started_at - self._started_at, 4),
+            "d": round(duration, 4),
+        }
+        if error is not None:
+            entry["e"] = type(error).__name__
+            entry["em"] = str(error)
+        else:
+            entry["s"] = response.status_code
+            entry["h"] = {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers}
+            if body_name is None and len(response.content) > CASSETTE_INLINE_LIMIT:
+                body_name, body_file = self.open_body()
+                with body_file:
+                    body_file.write(_redact_body(response.content))
+            if body_name is not None:
+                entry["bf"] = body_name
+            else:
+                entry["b"] = base64.b64encode(zlib.compress(_redact_body(response.content))).decode("ascii")
+            if body_time:
+                entry["bt"] = round(body_time, 4)
+            if body_error is not None:
+                entry["be"] = type(body_error).__name__
+                entry["bem"] = str(body_error)
+        self._write(entry)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class ReplaySession:
+    """回放用的会话：不连接服务器，从录制文件返回响应"""
+
+    def __init__(self, player: "CassettePlayer"):
+        self._player = player
+
+    def get(self, url: str, **kwargs):
+        return self._player.play("GET", url, kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self._player.play("POST", url, kwargs)
+
+    def close(self):
+        pass
+
+
+class CassettePlayer:
+    """
+    录制文件回放
+
+    相同的请求按录制顺序依次返回，录制的次数用完后重复最后一次；
+    参数不同时退而使用相同路径的成功录制（近似匹配），都没有时按连接错误处理。
+    """
+
+    def __init__(self, path: str, realtime: bool = True):
+        """
+        Args:
+            path: 录制文件
+            realtime: 是否按录制时的耗时等待
+        """
+        self.path = path
+        self.body_dir = path + ".bodies"
+        self.realtime = realtime
+        self.stats = {"exact": 0, "nearest": 0, "missing": 0}
+        self._lock = threading.Lock()
+        self._exact = {}  # {键: deque[录制]}
+        self._by_path = {}  # {方法+路径: [成功的录制]}
+        self._path_next = {}
+        self.count = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if "m" not in entry:
+                    continue
+                exact_key, path_key = _request_key(entry["m"], entry["u"], entry.get("q"))
+                self._exact.setdefault(exact_key, deque()).append(entry)
+                if "e" not in entry and "be" not in entry:
+                    self._by_path.setdefault(path_key, []).append(entry)
+                self.count += 1
+
+    def wrap(self, session) -> ReplaySession:
+        """代替新建的 requests.Session（用于 Zlibrary.setSessionFactory）"""
+        return ReplaySession(self)
+
+    def _find(self, method: str, url: str, kwargs: dict) -> dict:
+        exact_key, path_key = _request_key(method, url, _query_of(method, kwargs))
+        with self._lock:
+            entries = self._exact.get(exact_key)
+            if entries:
+                self.stats["exact"] += 1
+                return entries.popleft() if len(entries) > 1 else entries[0]
+            entries = self._by_path.get(path_key)
+            if entries:
+                self.stats["nearest"] += 1
+                index = self._path_next.get(path_key, 0)
+                self._path_next[path_key] = (index + 1) % len(entries)
+                return entries[index]
+            self.stats["missing"] += 1
+            return None
+
+    def play(self, method: str, url: str, kwargs: dict):
+        """返回录制的响应（或抛出录制时的网络异常）"""
+        import requests
+
+        entry = self._find(method, url, kwargs)
+        if entry is None:
+            raise requests.exceptions.ConnectionError(f"录制文件中没有这个请求: {method} {urlsplit(url).path}")
+        if self.realtime:
+            time.sleep(entry["d"])
+        if "e" in entry:
+            raise _recorded_error(entry["e"], entry.get("em"))
+        content = zlib.decompress(base64.b64decode(entry["b"])) if "b" in entry else None
+        body_path = os.path.join(self.body_dir, entry["bf"]) if "bf" in entry else None
+        body_error = _recorded_error(entry["be"], entry.get("bem")) if "be" in entry else None
+        return CassetteResponse(entry["s"], entry.get("h"), content, url, entry.get("bt", 0.0), self.realtime,
+                                body_path, body_error)
+
+
+@contextmanager
+def session(record_file: str = None, replay_file: str = None, realtime: bool = True):
+    """
+    按命令行参数开启录制或回放（都没有指定时什么也不做）
+
+    Args:
+        record_file: 录制到这个文件（--record）
+        replay_file: 从这个文件回放（--replay）
+        realtime: 回放时是否按录制时的耗时等待（--replay-fast 时为False）
+    """
+    if record_file and replay_file:
+        raise SystemExit("❌ --record 和 --replay 不能同时使用")
+    if record_file:
+        recorder = CassetteRecorder(record_file)
+        setSessionFactory(recorder.wrap, use_session_cache=False)
+        print(f"📼 录制模式: 所有请求和响应保存到 {record_file}")
+        try:
+            yield recorder
+        finally:
+            setSessionFactory(None)
+            recorder.close()
+            # 分片进程录制的请求也在同一个文件中，按行数统计
+            with open(record_file, "rb") as f:
+                count = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1024 * 1024), b"")) - 1
+            size = os.path.getsize(record_file)
+            if os.path.isdir(recorder.body_dir):
+                size += sum(entry.stat().st_size for entry in os.scandir(recorder.body_dir))
+            print(f"\n📼 已录制 {count} 个请求到 {os.path.abspath(record_file)}（{size / 1024:.1f} KB）")
+    elif replay_file:
+        player = CassettePlayer(replay_file, realtime)
+        setSessionFactory(player.wrap, use_session_cache=False)
+        print(f"📼 回放模式: {replay_file}（{player.count} 个请求，"
+              f"{'按录制时的耗时' if realtime else '全速'}回放，不连接服务器）")
+        try:
+            yield player
+        finally:
+            setSessionFactory(None)
+            stats = player.stats
+            print(f"\n📼 回放: 完全匹配 {stats['exact']} 次，近似匹配 {stats['nearest']} 次，"
+                  f"未录制 {stats['missing']} 次")
+    else:
+        yield None
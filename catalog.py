@@ -0,0 +1,315 @@
+"""
+本地书目索引 - 保存所有搜索/查询过的书籍信息（SQLite）
+
+- books: 书籍记录（id+hash 唯一），来自 search / getBookInfo / getSimilar 的返回结果
+- books_fts: 书名/作者/出版社的全文索引（FTS5 trigram，支持中文子串匹配；不可用时退化为LIKE）
+- queries: 在线搜索的查询缓存（搜索词+格式 -> 结果书籍列表），重复搜索直接从本地返回
+- misses: 未找到结果的搜索条件（负缓存），到复查时间前不再搜索，每次复查仍未找到时复查间隔加倍
+"""
+import json
+import sqlite3
+import threading
+import time
+
+# 书籍记录保存的字段（与搜索结果字段名一致）
+BOOK_FIELDS = ("id", "hash", "title", "author", "publisher", "year", "language",
+               "extension", "pages", "cover", "filesize")
+
+
+class Catalog:
+    """本地书目索引"""
+
+    def __init__(self, db_file: str, busy_timeout: float = 5):
+        """
+        Args:
+            db_file: 数据库文件
+            busy_timeout: 其他进程持有写锁时最多等待的秒数（多个分片进程同时写入时需要加大）
+        """
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=busy_timeout, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_schema()
+
+    def _init_schema(self):
+        """创建数据表（已存在时跳过）"""
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS books (
+                    id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    title TEXT, author TEXT, publisher TEXT, year TEXT, language TEXT,
+                    extension TEXT, pages TEXT, cover TEXT, filesize TEXT,
+                    updated_at REAL,
+                    PRIMARY KEY (id, hash)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS queries (
+                    message TEXT NOT NULL,
+                    extensions TEXT NOT NULL,
+                    book_keys TEXT NOT NULL,
+                    searched_at REAL,
+                    PRIMARY KEY (message, extensions)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS misses (
+                    query TEXT PRIMARY KEY,
+                    request TEXT NOT NULL,
+                    strategy TEXT,
+                    miss_count INTEGER NOT NULL,
+                    first_checked_at REAL,
+                    checked_at REAL,
+                    next_check_at REAL
+                )
+            """)
+        self.has_fts = self._init_fts()
+
+    def _init_fts(self) -> bool:
+        """创建全文索引，SQLite不支持FTS5 trigram时返回False"""
+        try:
+            with self._conn:
+                self._conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+                        title, author, publisher,
+                        content='books', content_rowid='rowid', tokenize='trigram'
+                    )
+                """)
+                self._conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS books_ai AFTER INSERT ON books BEGIN
+                        INSERT INTO books_fts(rowid, title, author, publisher)
+                        VALUES (new.rowid, new.title, new.author, new.publisher);
+                    END
+                """)
+                self._conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS books_ad AFTER DELETE ON books BEGIN
+                        INSERT INTO books_fts(books_fts, rowid, title, author, publisher)
+                        VALUES ('delete', old.rowid, old.title, old.author, old.publisher);
+                    END
+                """)
+                self._conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS books_au AFTER UPDATE ON books BEGIN
+                        INSERT INTO books_fts(books_fts, rowid, title, author, publisher)
+                        VALUES ('delete', old.rowid, old.title, old.author, old.publisher);
+                        INSERT INTO books_fts(rowid, title, author, publisher)
+                        VALUES (new.rowid, new.title, new.author, new.publisher);
+                    END
+                """)
+            return True
+        except sqlite3.OperationalError as e:
+            print(f"[警告] SQLite不支持FTS5 trigram ({e})，本地搜索使用LIKE匹配")
+            return False
+
+    @staticmethod
+    def _extensions_key(extensions) -> str:
+        """格式筛选 -> 查询缓存的键（None表示不限；多个格式按给定顺序用逗号连接）"""
+        if not extensions:
+            return ""
+        if isinstance(extensions, str):
+            return extensions.lower()
+        return ",".join(ext.lower() for ext in extensions)
+
+    @classmethod
+    def _query_key(cls, extensions, filters: str = "") -> str:
+        """查询缓存的键：格式筛选，有其他筛选条件（语言/年份等）时附加在 ";" 之后"""
+        key = cls._extensions_key(extensions)
+        return f"{key};{filters}" if filters else key
+
+    @staticmethod
+    def _to_row(book: dict, now: float) -> tuple:
+        """书籍字典 -> 数据行"""
+        return tuple(None if book.get(field) is None else str(book.get(field)) for field in BOOK_FIELDS) + (now,)
+
+    def add_books(self, books: list):
+        """
+        保存书籍记录（已存在的更新为最新信息）
+
+        Args:
+            books: 书籍字典列表（至少包含id和hash）
+        """
+        now = time.time()
+        rows = [self._to_row(book, now) for book in books if book.get("id") and book.get("hash")]
+        if not rows:
+            return
+        columns = ", ".join(BOOK_FIELDS)
+        placeholders = ", ".join("?" * (len(BOOK_FIELDS) + 1))
+        updates = ", ".join(f"{field} = COALESCE(excluded.{field}, {field})" for field in BOOK_FIELDS[2:])
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO books ({columns}, updated_at) VALUES ({placeholders}) "
+                f"ON CONFLICT(id, hash) DO UPDATE SET {updates}, updated_at = excluded.updated_at",
+                rows,
+            )
+
+    def add_book(self, book: dict):
+        """保存单条书籍记录"""
+        self.add_books([book])
+
+    def add_search(self, message: str, extensions, books: list, filters: str = ""):
+        """
+        保存一次在线搜索的结果（书籍记录 + 查询缓存）
+
+        Args:
+            message: 搜索词
+            extensions: 格式筛选（如"epub"或["epub", "pdf"]，None表示不限）
+            books: 搜索返回的书籍列表
+            filters: 其他筛选条件的描述（不同条件的搜索分开缓存）
+        """
+        self.add_books(books)
+        book_keys = [[str(book["id"]), str(book["hash"])] for book in books if book.get("id") and book.get("hash")]
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO queries (message, extensions, book_keys, searched_at) VALUES (?, ?, ?, ?)",
+                (message, self._query_key(extensions, filters), json.dumps(book_keys), time.time()),
+            )
+
+    def get_search(self, message: str, extensions=None, max_age: float = None, filters: str = "") -> list:
+        """
+        查找缓存的搜索结果
+
+        Args:
+            message: 搜索词
+            extensions: 格式筛选（如"epub"或["epub", "pdf"]）
+            max_age: 缓存有效期（秒），None表示不过期
+            filters: 其他筛选条件的描述（与 add_search 时相同）
+
+        Returns:
+            书籍列表（按原搜索顺序），没有有效缓存时返回None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT book_keys, searched_at FROM queries WHERE message = ? AND extensions = ?",
+                (message, self._query_key(extensions, filters)),
+            ).fetchone()
+            if row is None:
+                return None
+            if max_age is not None and time.time() - row["searched_at"] > max_age:
+                return None
+            books = []
+            for book_id, book_hash in json.loads(row["book_keys"]):
+                book = self._conn.execute(
+                    "SELECT * FROM books WHERE id = ? AND hash = ?", (book_id, book_hash)
+                ).fetchone()
+                if book is not None:
+                    books.append(self._to_dict(book))
+            return books
+
+    def get_book(self, book_id, book_hash: str) -> dict:
+        """按id+hash查找书籍记录，找不到时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM books WHERE id = ? AND hash = ?", (str(book_id), book_hash)
+            ).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def search(self, message: str, extensions=None, limit: int = 50) -> list:
+        """
+        在本地书目中搜索（书名/作者/出版社包含搜索词）
+
+        Args:
+            message: 搜索词
+            extensions: 格式筛选（如"epub"或["epub", "pdf"]）
+            limit: 返回结果数量限制
+
+        Returns:
+            书籍列表
+        """
+        if not message:
+            return []
+        params = []
+        # trigram 至少需要3个字符，更短的搜索词用LIKE
+        if self.has_fts and len(message) >= 3:
+            sql = ("SELECT books.* FROM books_fts JOIN books ON books.rowid = books_fts.rowid "
+                   "WHERE books_fts MATCH ?")
+            params.append('"' + message.replace('"', '""') + '"')
+        else:
+            pattern = "%" + message.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            sql = ("SELECT * FROM books WHERE (title LIKE ? ESCAPE '\\' OR author LIKE ? ESCAPE '\\' "
+                   "OR publisher LIKE ? ESCAPE '\\')")
+            params.extend([pattern] * 3)
+        if extensions:
+            extensions = self._extensions_key(extensions).split(",")
+            sql += f" AND lower(extension) IN ({', '.join('?' * len(extensions))})"
+            params.extend(extensions)
+        sql += " LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def add_miss(self, query: str, request: dict, strategy: str, base_ttl: float,
+                 max_ttl: float, growth: float = 2.0) -> dict:
+        """
+        记录一次未找到结果的搜索（已记录过的累加次数，复查间隔按次数增长）
+
+        Args:
+            query: 搜索条件的唯一标识
+            request: 原始搜索请求
+            strategy: 搜索策略描述
+            base_ttl: 第一次未找到后的复查间隔（秒）
+            max_ttl: 复查间隔上限（秒）
+            growth: 每次复查仍未找到时复查间隔的增长倍数
+
+        Returns:
+            记录字典
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT miss_count, first_checked_at FROM misses WHERE query = ?", (query,)
+            ).fetchone()
+            miss_count = row["miss_count"] + 1 if row is not None else 1
+            first_checked_at = row["first_checked_at"] if row is not None else now
+            ttl = min(base_ttl * growth ** (miss_count - 1), max_ttl)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO misses (query, request, strategy, miss_count, first_checked_at, "
+                "checked_at, next_check_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (query, json.dumps(request, ensure_ascii=False), strategy, miss_count,
+                 first_checked_at, now, now + ttl),
+            )
+        return {"query": query, "request": request, "strategy": strategy, "miss_count": miss_count,
+                "first_checked_at": first_checked_at, "checked_at": now, "next_check_at": now + ttl}
+
+    def get_miss(self, query: str) -> dict:
+        """查找未找到记录，没有记录时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM misses WHERE query = ?", (query,)).fetchone()
+        if row is None:
+            return None
+        miss = dict(row)
+        miss["request"] = json.loads(miss["request"])
+        return miss
+
+    def remove_miss(self, query: str):
+        """删除未找到记录（之后找到了结果）"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM misses WHERE query = ?", (query,))
+
+    def count_misses(self) -> int:
+        """未找到记录总数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM misses").fetchone()[0]
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        """数据行 -> 书籍字典"""
+        return {field: row[field] for field in BOOK_FIELDS}
+
+    def all_books(self) -> list:
+        """返回全部书籍记录"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM books ORDER BY updated_at").fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def count(self) -> int:
+        """书籍记录总数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+
+    def close(self):
+        """关闭数据库"""
+        with self._lock:
+            self._conn.close()
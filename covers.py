@@ -0,0 +1,239 @@
+"""
+封面图片批量获取工具 - 并发下载封面，保存到按内容寻址的本地缓存，并生成缩略图
+
+缓存目录结构:
+    covers/index.json                  封面URL -> {sha256, etag, ext, fetched_at, thumbnail}
+    covers/objects/ab/abcd....jpg      原图（按SHA-256命名，相同图片只保存一份）
+    covers/thumbs/abcd..._200x300.jpg  缩略图
+
+已缓存的封面在 COVER_MAX_AGE 内不发起任何网络请求，过期后用ETag条件请求重新验证。
+"""
+import sys
+import os
+import io
+import json
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Windows终端设置UTF-8编码
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', write_through=True)
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', write_through=True)
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Zlibrary import Zlibrary
+from catalog import Catalog
+
+# ========== 配置区域 ==========
+DEFAULT_CATALOG_FILE = "catalog.db"
+DEFAULT_COVER_DIR = "covers"
+COVER_WORKERS = 8  # 并发下载线程数
+COVER_MAX_AGE = 30 * 24 * 3600  # 缓存的封面在多少秒内不重新验证
+THUMBNAIL_SIZE = (200, 300)  # 缩略图最大尺寸（宽, 高），保持原比例
+# ===============================
+
+
+class CoverCache:
+    """按内容寻址的封面缓存"""
+
+    def __init__(self, cover_dir: str = DEFAULT_COVER_DIR, thumbnail_size: tuple = THUMBNAIL_SIZE):
+        self.cover_dir = cover_dir
+        self.thumbnail_size = thumbnail_size
+        self.index_file = os.path.join(cover_dir, "index.json")
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cover_dir, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(cover_dir, "thumbs"), exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self) -> dict:
+        """加载索引文件"""
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"[警告] 加载封面索引失败: {e}，使用空索引")
+        return {}
+
+    def save(self):
+        """保存索引到文件"""
+        with self._lock:
+            tmp_file = self.index_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.index_file)
+
+    def object_path(self, sha256: str, ext: str) -> str:
+        """原图路径"""
+        return os.path.join(self.cover_dir, "objects", sha256[:2], sha256 + ext)
+
+    def thumbnail_path(self, sha256: str) -> str:
+        """缩略图路径"""
+        width, height = self.thumbnail_size
+        return os.path.join(self.cover_dir, "thumbs", f"{sha256}_{width}x{height}.jpg")
+
+    def lookup(self, url: str) -> dict:
+        """查找URL对应的缓存记录（原图文件必须存在）"""
+        with self._lock:
+            entry = self.index.get(url)
+        if entry and os.path.exists(self.object_path(entry["sha256"], entry["ext"])):
+            return entry
+        return None
+
+    def store(self, url: str, content: bytes, etag: str = None) -> dict:
+        """保存图片内容并更新索引"""
+        sha256 = hashlib.sha256(content).hexdigest()
+        ext = os.path.splitext(url.split("?", 1)[0])[1].lower() or ".jpg"
+        path = self.object_path(sha256, ext)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+        entry = {"sha256": sha256, "ext": ext, "etag": etag, "fetched_at": time.time(),
+                 "thumbnail": self.make_thumbnail(sha256, path)}
+        with self._lock:
+            self.index[url] = entry
+        return entry
+
+    def touch(self, url: str):
+        """ETag未变化时更新验证时间"""
+        with self._lock:
+            if url in self.index:
+                self.index[url]["fetched_at"] = time.time()
+
+    def make_thumbnail(self, sha256: str, path: str) -> str:
+        """
+        生成缩略图（需要Pillow，未安装时跳过）
+
+        Returns:
+            缩略图路径，无法生成时返回None
+        """
+        thumb_path = self.thumbnail_path(sha256)
+        if os.path.exists(thumb_path):
+            return thumb_path
+        try:
+            from PIL import Image
+        except ImportError:
+            return None
+        try:
+            with Image.open(path) as image:
+                image.thumbnail(self.thumbnail_size)
+                if image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                tmp_path = f"{thumb_path}.{threading.get_ident()}.tmp"
+                image.save(tmp_path, "JPEG", quality=85)
+            os.replace(tmp_path, thumb_path)
+            return thumb_path
+        except Exception as e:
+            print(f"  [警告] 生成缩略图失败 ({path}): {e}")
+            return None
+
+
+def fetch_cover(zlib: Zlibrary, cache: CoverCache, url: str, max_age: float = COVER_MAX_AGE) -> tuple:
+    """
+    获取单个封面
+
+    Args:
+        zlib: Zlibrary实例
+        cache: 封面缓存
+        url: 封面URL
+        max_age: 缓存有效期（秒），有效期内不发起网络请求
+
+    Returns:
+        (状态, 缓存记录)，状态为 "cached" / "not_modified" / "downloaded" / "failed"
+    """
+    entry = cache.lookup(url)
+    if entry and time.time() - entry.get("fetched_at", 0) < max_age:
+        return "cached", entry
+
+    status_code, content, etag = zlib.getImageConditional(url, etag=entry.get("etag") if entry else None)
+    if status_code == 304 and entry:
+        cache.touch(url)
+        return "not_modified", entry
+    if status_code == 200 and content:
+        return "downloaded", cache.store(url, content, etag)
+    return "failed", None
+
+
+def fetch_covers(zlib: Zlibrary, books: list, cache: CoverCache, workers: int = COVER_WORKERS,
+                 max_age: float = COVER_MAX_AGE) -> dict:
+    """
+    并发获取一批书籍的封面
+
+    Args:
+        zlib: Zlibrary实例
+        books: 书籍列表（使用其中的cover字段）
+        cache: 封面缓存
+        workers: 并发线程数
+        max_age: 缓存有效期（秒）
+
+    Returns:
+        统计信息 {状态: 数量}
+    """
+    urls = list(dict.fromkeys(book["cover"] for book in books if book.get("cover")))
+    stats = {"cached": 0, "not_modified": 0, "downloaded": 0, "failed": 0}
+    if not urls:
+        return stats
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_cover, zlib, cache, url, max_age): url for url in urls}
+        for done, future in enumerate(as_completed(futures), 1):
+            url = futures[future]
+            try:
+                status, _ = future.result()
+            except Exception as e:
+                status = "failed"
+                print(f"  ❌ 获取封面失败: {url} ({e})")
+            stats[status] += 1
+            if done % 50 == 0 or done == len(urls):
+                print(f"  [进度] {done}/{len(urls)}")
+
+    cache.save()
+    return stats
+
+
+def main():
+    """主函数"""
+    print("=" * 100)
+    print("Zlibrary 封面批量获取工具")
+    print("=" * 100)
+
+    catalog_file = next((arg for arg in sys.argv[1:] if not arg.startswith("--")), DEFAULT_CATALOG_FILE)
+    max_age = 0 if "--refresh" in sys.argv else COVER_MAX_AGE
+
+    if not os.path.exists(catalog_file):
+        print(f"\n❌ 本地书目不存在: {catalog_file}")
+        print("  请先运行 batch_search.py 生成本地书目")
+        return
+
+    catalog = Catalog(catalog_file)
+    books = catalog.all_books()
+    catalog.close()
+    print(f"\n本地书目: {catalog_file} ({len(books)} 本书籍记录)")
+
+    cache = CoverCache(DEFAULT_COVER_DIR)
+    start_time = time.time()
+    # 封面图片不需要登录
+    stats = fetch_covers(Zlibrary(), books, cache, max_age=max_age)
+    elapsed_time = time.time() - start_time
+
+    print("\n" + "=" * 100)
+    print(f"📊 统计信息:")
+    print(f"  本地缓存: {stats['cached']} 张")
+    print(f"  未变化(304): {stats['not_modified']} 张")
+    print(f"  新下载: {stats['downloaded']} 张")
+    print(f"  失败: {stats['failed']} 张")
+    print(f"  耗时: {elapsed_time:.2f}秒")
+    print(f"\n📁 封面保存位置: {os.path.abspath(DEFAULT_COVER_DIR)}")
+    print("=" * 100)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+相似书籍爬取工具 - 从种子书籍出发，按层（广度优先）并发调用 getSimilar 发现相关书籍
+
+- 种子文件: JSON数组或JSONL，每项包含 id 和 hash（如 [{"id": "123", "hash": "abc"}]）
+- 已访问的书籍（id+hash）只请求一次；限制最大层数和总请求数
+- 发现的书籍边爬取边写入候选文件（与 batch_search 的结果文件格式相同，
+  可直接用 batch_download.py --input <候选文件> 下载），并保存到本地书目
+"""
+import sys
+import os
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+# Windows终端设置UTF-8编码
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', write_through=True)
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', write_through=True)
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Zlibrary import Zlibrary
+from catalog import Catalog
+from records import BookRecord
+from batch_search import (DEFAULT_CATALOG_FILE, ResultWriter, get_arg_value, get_positional_args,
+                          iter_search_requests, login_and_check)
+
+# ========== 配置区域 ==========
+DEFAULT_OUTPUT_FILE = "similar.txt"
+CRAWL_WORKERS = 4  # 并发请求数
+CRAWL_MAX_DEPTH = 2  # 最大层数（种子的相似书籍为第1层）
+CRAWL_MAX_REQUESTS = 200  # getSimilar 总请求数上限
+# ===============================
+
+# 需要带值的命令行参数（读取位置参数时跳过其值）
+VALUE_OPTIONS = ("--catalog", "--depth", "--max-requests", "--workers")
+
+
+def book_key(book: dict) -> str:
+    """书籍的唯一标识（id_hash）"""
+    return f"{book['id']}_{book['hash']}"
+
+
+def load_seeds(seed_file: str) -> list:
+    """
+    读取种子书籍
+
+    Args:
+        seed_file: 种子文件路径
+
+    Returns:
+        [{"id", "hash", "title"}]（缺少id或hash的项跳过）
+    """
+    seeds = []
+    for idx, item in iter_search_requests(seed_file):
+        if item.get("id") and item.get("hash"):
+            seeds.append({"id": str(item["id"]), "hash": str(item["hash"]), "title": item.get("title")})
+        else:
+            print(f"  [警告] 第 {idx} 项缺少 id 或 hash，已跳过")
+    return seeds
+
+
+def fetch_similar(zlib: Zlibrary, book: dict) -> list:
+    """
+    获取一本书的相似书籍
+
+    Returns:
+        书籍列表，请求失败时返回None
+    """
+    result = zlib.getSimilar(book["id"], book["hash"])
+    if not result.get("success"):
+        return None
+    return [b for b in result.get("books", []) if isinstance(b, dict) and b.get("id") and b.get("hash")]
+
+
+def crawl_similar(zlib: Zlibrary, seeds: list, writer: ResultWriter, catalog: Catalog = None,
+                  max_depth: int = CRAWL_MAX_DEPTH, max_requests: int = CRAWL_MAX_REQUESTS,
+                  workers: int = CRAWL_WORKERS) -> list:
+    """
+    按层爬取相似书籍，发现的书籍立即写入候选文件
+
+    Args:
+        zlib: Zlibrary实例
+        seeds: 种子书籍列表
+        writer: 候选文件写入器
+        catalog: 本地书目（为None时不保存）
+        max_depth: 最大层数
+        max_requests: 总请求数上限
+        workers: 并发请求数
+
+    Returns:
+        每层的统计信息 [{depth, requests, failed, found, elapsed}]
+    """
+    visited = {book_key(book) for book in seeds}
+    frontier = seeds
+    requests_made = 0
+    written = 0
+    level_stats = []
+
+    for depth in range(1, max_depth + 1):
+        if not frontier or requests_made >= max_requests:
+            break
+        batch = frontier[:max_requests - requests_made]
+        requests_made += len(batch)
+        stats = {"depth": depth, "requests": len(batch), "failed": 0, "found": 0}
+        next_frontier = []
+        level_start = time.time()
+
+        print(f"\n{'─' * 100}")
+        print(f" 第 {depth} 层: 请求 {len(batch)} 本书的相似书籍"
+              f"{f'（达到请求上限，跳过 {len(frontier) - len(batch)} 本）' if len(batch) < len(frontier) else ''}")
+        print(f"{'─' * 100}")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch_similar, zlib, book): book for book in batch}
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    similar = future.result()
+                except Exception as e:
+                    print(f"  ❌ 请求失败: {source.get('title') or book_key(source)} ({e})")
+                    similar = None
+                if similar is None:
+                    stats["failed"] += 1
+                    continue
+
+                new_books = []
+                for book in similar:
+                    key = book_key(book)
+                    if key in visited:
+                        continue
+                    visited.add(key)
+                    new_books.append(BookRecord.from_dict(book, file_size=book.get("filesize") or "N/A"))
+                if not new_books:
+                    continue
+
+                if catalog is not None:
+                    catalog.add_books(new_books)
+                for book in new_books:
+                    written += 1
+                    source_desc = source.get("title") or book_key(source)
+                    writer.submit(written, f"{book['title']} | 来源: {source_desc} | 第{depth}层", book, [book],
+                                  f"getSimilar 第{depth}层（来源: {source_desc}）")
+                stats["found"] += len(new_books)
+                next_frontier.extend(new_books)
+
+        stats["elapsed"] = time.time() - level_start
+        level_stats.append(stats)
+        rate = stats["requests"] / stats["elapsed"] if stats["elapsed"] > 0 else 0
+        print(f"  ✅ 第 {depth} 层完成: 新书籍 {stats['found']} 本，失败 {stats['failed']} 次，"
+              f"耗时 {stats['elapsed']:.2f}秒（{rate:.1f} 请求/秒）")
+        frontier = [{"id": str(book["id"]), "hash": str(book["hash"]), "title": book["title"]}
+                    for book in next_frontier]
+
+    return level_stats
+
+
+def main():
+    """主函数"""
+    program_start = time.time()
+
+    print("=" * 100)
+    print("Zlibrary 相似书籍爬取工具")
+    print("=" * 100)
+
+    args = get_positional_args(VALUE_OPTIONS)
+    if len(args) < 1:
+        print("\n使用方法:")
+        print("  python crawl_similar.py <种子文件> [输出文件] [选项]")
+        print("\n选项:")
+        print(f"  --depth <层数>      最大层数（默认: {CRAWL_MAX_DEPTH}）")
+        print(f"  --max-requests <数> getSimilar 总请求数上限（默认: {CRAWL_MAX_REQUESTS}）")
+        print(f"  --workers <数>      并发请求数（默认: {CRAWL_WORKERS}）")
+        print("  --no-catalog        不保存到本地书目")
+        print(f"  --catalog <文件>    本地书目文件（默认: {DEFAULT_CATALOG_FILE}）")
+        print("\n示例:")
+        print("  python crawl_similar.py seeds.json")
+        print("  python crawl_similar.py seeds.json similar.txt --depth 3 --max-requests 500")
+        print("  python batch_download.py --input similar.txt   # 先在要下载的书前标记 v")
+        print(f"\n默认输出文件: {DEFAULT_OUTPUT_FILE}")
+        return
+
+    seed_file = args[0]
+    output_file = args[1] if len(args) > 1 else DEFAULT_OUTPUT_FILE
+    max_depth = int(get_arg_value("--depth", CRAWL_MAX_DEPTH))
+    max_requests = int(get_arg_value("--max-requests", CRAWL_MAX_REQUESTS))
+    workers = int(get_arg_value("--workers", CRAWL_WORKERS))
+
+    try:
+        seeds = load_seeds(seed_file)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"\n❌ 读取种子文件失败: {e}")
+        return
+    if not seeds:
+        print("\n❌ 没有有效的种子书籍（每项需要 id 和 hash）")
+        return
+    print(f"\n✅ 种子书籍: {len(seeds)} 本")
+    print(f"✅ 最大层数: {max_depth}，请求上限: {max_requests}，并发: {workers}")
+
+    zlib = login_and_check()
+    if zlib is None:
+        return
+
+    catalog = None
+    if "--no-catalog" not in sys.argv:
+        catalog = Catalog(get_arg_value("--catalog", DEFAULT_CATALOG_FILE))
+
+    # 候选书籍都是单一版本的结果块，要求手动标记v后才下载，避免一次下载全部候选耗尽下载次数
+    writer = ResultWriter(output_file, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "相似书籍",
+                          manual_selection=True)
+    crawl_start = time.time()
+    try:
+        level_stats = crawl_similar(zlib, seeds, writer, catalog, max_depth, max_requests, workers)
+    finally:
+        writer.close()
+        if catalog is not None:
+            catalog.close()
+    crawl_time = time.time() - crawl_start
+
+    total_requests = sum(stats["requests"] for stats in level_stats)
+    print("\n" + "=" * 100)
+    print(f"📊 统计信息:")
+    for stats in level_stats:
+        rate = stats["requests"] / stats["elapsed"] if stats["elapsed"] > 0 else 0
+        print(f"  第 {stats['depth']} 层: 请求 {stats['requests']} 次，失败 {stats['failed']} 次，"
+              f"新书籍 {stats['found']} 本，{rate:.1f} 请求/秒")
+    print(f"  总请求: {total_requests} 次")
+    print(f"  发现书籍: {writer.found_count} 本")
+    print(f"  爬取耗时: {crawl_time:.2f}秒（{total_requests / crawl_time if crawl_time > 0 else 0:.1f} 请求/秒）")
+    print(f"  总耗时: {time.time() - program_start:.2f}秒")
+    print(f"\n✅ 候选书籍已保存到: {output_file}")
+    print(f"   下载: python batch_download.py --input {output_file}")
+    print("=" * 100)
+
+
+if __name__ == "__main__":
+    main()
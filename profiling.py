@@ -0,0 +1,453 @@
+"""
+性能分析开关 - batch_search.py / batch_download.py 的 --profile / --profile-sample / --profile-memory
+
+- --profile: cProfile 统计所有线程的函数调用（开销较大，用于排查问题）
+- --profile-sample: 定时采样各线程的调用栈（默认每20毫秒一次，开销很小，可以在正式运行时长期开启），
+                    输出 folded 格式的调用栈（可用 flamegraph.pl / speedscope 生成火焰图）
+- --profile-memory: tracemalloc 记录内存分配，在内存占用创新高时保存快照，输出峰值时的主要分配位置
+
+墙钟时间按网络请求划分：有网络请求进行中的时间 vs 没有网络请求的时间（本地处理），
+网络等待时间通过 Zlibrary.setNetworkObserver 在每一次HTTP请求处统计。
+报告写入 PROFILE_DIR（默认 profiles/），文件名为 <工具名>_<时间>.*；
+只统计主进程（--shards 的分片进程、下载后校验的进程池不统计）。
+
+cProfile / pstats / tracemalloc 在开启相应分析时才导入，不开启时导入本模块不影响启动时间。
+"""
+import io
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from Zlibrary import setNetworkObserver
+
+# 报告目录
+PROFILE_DIR = "profiles"
+# 报告中列出的函数/分配位置数量
+PROFILE_TOP_N = 40
+# 采样间隔（秒）
+PROFILE_SAMPLE_INTERVAL = 0.02
+# 采样模式下定期写出报告的间隔（秒），长期运行（如 --daemon）时进程异常退出也有最近的结果
+PROFILE_FLUSH_INTERVAL = 300
+# tracemalloc 保存的调用栈层数
+PROFILE_MEMORY_FRAMES = 10
+# 检查内存占用的间隔（秒）；比上一次快照增长超过 PROFILE_MEMORY_GROWTH 时保存新快照
+PROFILE_MEMORY_INTERVAL = 0.5
+PROFILE_MEMORY_GROWTH = 1.1
+
+# 采样时视为空闲（等待任务/锁）的栈顶模块
+IDLE_MODULES = ("threading.py", "queue.py", "selectors.py")
+
+# 当前运行中的分析器（track_network 使用）
+_active = None
+
+
+class NetworkTimer:
+    """
+    网络等待时间统计（线程安全）
+
+    记录每次请求的耗时，并统计"至少有一个请求进行中"的墙钟时间（多个并发请求只算一次）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._busy_since = None
+        self._busy_time = 0.0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.active_threads = {}  # 正在等待网络的线程 {线程ID: 嵌套层数}
+        self.endpoints = {}  # {请求类型: [次数, 累计耗时, 最长耗时]}
+
+    @contextmanager
+    def track(self, endpoint: str, count: bool = True):
+        """
+        统计一段网络等待
+
+        Args:
+            endpoint: 请求类型
+            count: 是否计为一次请求（读取下载数据块时为False，只累计耗时）
+        """
+        ident = threading.get_ident()
+        started = time.perf_counter()
+        with self._lock:
+            if self._inflight == 0:
+                self._busy_since = started
+            self._inflight += 1
+            self.active_threads[ident] = self.active_threads.get(ident, 0) + 1
+        try:
+            yield
+        finally:
+            ended = time.perf_counter()
+            elapsed = ended - started
+            with self._lock:
+                self._inflight -= 1
+                if self._inflight == 0:
+                    self._busy_time += ended - self._busy_since
+                if self.active_threads[ident] == 1:
+                    del self.active_threads[ident]
+                else:
+                    self.active_threads[ident] -= 1
+                self.waits += 1
+                self.wait_time += elapsed
+                stats = self.endpoints.setdefault(endpoint, [0, 0.0, 0.0])
+                stats[0] += 1 if count else 0
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+
+    def track_iter(self, iterable, endpoint: str):
+        """逐项统计从迭代器取数据的等待时间（如流式下载的数据块）"""
+        iterator = iter(iterable)
+        while True:
+            with self.track(endpoint, count=False):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def is_waiting(self, ident: int) -> bool:
+        """线程是否正在等待网络"""
+        return ident in self.active_threads
+
+    def busy_time(self) -> float:
+        """有网络请求进行中的墙钟时间（秒）"""
+        with self._lock:
+            busy = self._busy_time
+            if self._inflight:
+                busy += time.perf_counter() - self._busy_since
+            return busy
+
+
+def track_network(iterable, endpoint: str):
+    """
+    统计迭代器的网络等待时间（没有开启性能分析时原样返回）
+
+    用于请求之外的网络读取，如 batch_download 流式下载时逐块读取响应内容。
+    """
+    if _active is None:
+        return iterable
+    return _active.network.track_iter(iterable, endpoint)
+
+
+class Profiler:
+    """性能分析器：CPU（cProfile/采样）、内存（tracemalloc）和网络等待时间"""
+
+    def __init__(self, tool: str, cpu: bool = False, sample: bool = False, memory: bool = False,
+                 output_dir: str = PROFILE_DIR, sample_interval: float = PROFILE_SAMPLE_INTERVAL):
+        """
+        Args:
+            tool: 工具名称（报告文件名前缀）
+            cpu: 开启 cProfile
+            sample: 开启采样
+            memory: 开启 tracemalloc
+            output_dir: 报告目录
+            sample_interval: 采样间隔（秒）
+        """
+        self.tool = tool
+        self.cpu = cpu
+        self.sample = sample
+        self.memory = memory
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.base_path = os.path.join(output_dir, f"{tool}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        self.network = NetworkTimer()
+        self.reports = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._profiles = []
+        self._samples = Counter()  # {(状态, 调用栈): 次数}
+        self._sample_states = Counter()
+        self._peak_snapshot = None
+        self._peak_size = 0
+        self._started_at = None
+        self._cpu_started_at = None
+
+    def start(self):
+        """开始分析"""
+        global _active
+        _active = self
+        self._started_at = time.perf_counter()
+        self._cpu_started_at = time.process_time()
+        setNetworkObserver(self.network.track)
+        # 分片进程、校验进程池由 fork 创建时，子进程中停止分析
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._stop_in_child)
+
+        # 分析用的后台线程先启动，不计入 cProfile
+        if self.memory:
+            import tracemalloc
+
+            tracemalloc.start(PROFILE_MEMORY_FRAMES)
+            self._start_thread(self._memory_loop)
+        if self.sample:
+            self._start_thread(self._sample_loop)
+        if self.cpu:
+            # cProfile 只统计调用 enable 的线程，之后启动的线程各自创建一个
+            import cProfile
+
+            threading.setprofile(self._profile_thread)
+            profile = cProfile.Profile()
+            profile.enable()
+            self._profiles.append(profile)
+
+    def _start_thread(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _profile_thread(self, frame, event, arg):
+        """新线程的第一个事件：为该线程开启 cProfile"""
+        import cProfile
+
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ 的 cProfile 已统计所有线程
+            return
+        with self._lock:
+            self._profiles.append(profile)
+
+    def _stop_in_child(self):
+        """fork 出的子进程中停止分析（子进程不写报告）"""
+        global _active
+        if _active is not self:
+            return
+        _active = None
+        sys.setprofile(None)
+        threading.setprofile(None)
+        setNetworkObserver(None)
+        if self.memory:
+            import tracemalloc
+
+            tracemalloc.stop()
+
+    def _sample_loop(self):
+        """采样线程：定时记录各线程的调用栈和状态（网络等待/本地处理/空闲）"""
+        own_ident = threading.get_ident()
+        next_flush = time.monotonic() + PROFILE_FLUSH_INTERVAL
+        while not self._stop.wait(self.sample_interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                if self.network.is_waiting(ident):
+                    state = "network"
+                elif os.path.basename(frame.f_code.co_filename) in IDLE_MODULES:
+                    state = "idle"
+                else:
+                    state = "local"
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                with self._lock:
+                    self._samples[(state, ";".join(reversed(stack)))] += 1
+                    self._sample_states[state] += 1
+            if time.monotonic() >= next_flush:
+                next_flush = time.monotonic() + PROFILE_FLUSH_INTERVAL
+                self._write_sample_report()
+
+    def _memory_loop(self):
+        """内存监视线程：内存占用创新高时保存快照"""
+        while not self._stop.wait(PROFILE_MEMORY_INTERVAL):
+            self._check_memory()
+
+    def _check_memory(self):
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            return
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self._peak_size * PROFILE_MEMORY_GROWTH:
+            self._peak_snapshot = tracemalloc.take_snapshot()
+            self._peak_size = current
+
+    def stop(self) -> list:
+        """
+        停止分析并写出报告
+
+        Returns:
+            报告文件路径列表
+        """
+        global _active
+        wall_time = time.perf_counter() - self._started_at
+        cpu_time = time.process_time() - self._cpu_started_at
+        network_time = self.network.busy_time()
+        if self.memory:
+            self._check_memory()
+        if self.cpu:
+            threading.setprofile(None)
+            for profile in self._profiles:
+                profile.disable()
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        setNetworkObserver(None)
+        _active = None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        summary = self._format_summary(wall_time, cpu_time, network_time)
+        if self.memory:
+            self._write_memory_report()
+        if self.cpu:
+            self._write_cpu_report(summary)
+        if self.sample:
+            self._write_sample_report(summary)
+        if not (self.cpu or self.sample):
+            self._write_text(".time.txt", summary)
+        print("\n" + summary)
+        return self.reports
+
+    def _format_summary(self, wall_time: float, cpu_time: float, network_time: float) -> str:
+        """墙钟时间划分和网络请求统计"""
+        network = self.network
+        local_time = max(wall_time - network_time, 0.0)
+        percent = lambda value: value / wall_time * 100 if wall_time > 0 else 0
+        lines = [
+            f"⏱️  性能分析: {self.tool}",
+            f"  总耗时（墙钟）: {wall_time:.2f}秒",
+            f"    有网络请求进行中: {network_time:.2f}秒 ({percent(network_time):.1f}%)",
+            f"    没有网络请求（本地处理）: {local_time:.2f}秒 ({percent(local_time):.1f}%)",
+            f"  进程CPU时间: {cpu_time:.2f}秒 ({percent(cpu_time):.1f}%)",
+            f"  网络等待: 累计 {network.wait_time:.2f}秒"
+            f"（平均并发 {network.wait_time / network_time if network_time > 0 else 0:.1f}）",
+        ]
+        for endpoint, (count, total, longest) in sorted(network.endpoints.items(), key=lambda item: -item[1][1]):
+            average = f"，平均 {total / count:.3f}秒" if count else ""
+            lines.append(f"    {endpoint}: {count} 次，累计 {total:.2f}秒{average}，最长 {longest:.2f}秒")
+        return "\n".join(lines)
+
+    def _write_text(self, suffix: str, text: str) -> str:
+        path = self.base_path + suffix
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        if path not in self.reports:
+            self.reports.append(path)
+        return path
+
+    def _write_cpu_report(self, summary: str):
+        """cProfile 报告（文本）和原始数据（.pstats，可用 snakeviz 等工具查看）"""
+        import pstats
+
+        stats = None
+        for profile in self._profiles:
+            try:
+                stats = pstats.Stats(profile) if stats is None else stats.add(profile)
+            except TypeError:
+                # 没有记录到调用的线程
+                continue
+        if stats is None:
+            return
+        stats.dump_stats(self.base_path + ".pstats")
+        self.reports.append(self.base_path + ".pstats")
+
+        out = io.StringIO()
+        stats.stream = out
+        out.write(f"{summary}\n\n线程数: {len(self._profiles)}\n")
+        out.write(f"\n{'=' * 100}\n按累计时间（含子函数和网络等待）\n{'=' * 100}\n")
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        out.write(f"\n{'=' * 100}\n按自身时间\n{'=' * 100}\n")
+        stats.sort_stats("tottime").print_stats(PROFILE_TOP_N)
+        self._write_text(".cpu.txt", out.getvalue())
+
+    def _write_sample_report(self, summary: str = None):
+        """采样报告：各状态的样本占比、本地处理最多的函数，以及 folded 格式的调用栈"""
+        with self._lock:
+            samples = dict(self._samples)
+            states = Counter(self._sample_states)
+        total = sum(states.values())
+        if summary is None:
+            summary = f"⏱️  性能分析: {self.tool}（运行中，{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}）"
+        lines = [summary, "", f"采样: 每 {self.sample_interval * 1000:g} 毫秒，共 {total} 个样本（所有线程）"]
+        for state, label in (("local", "本地处理"), ("network", "网络等待"), ("idle", "空闲")):
+            lines.append(f"  {label}: {states[state]} ({states[state] / total * 100 if total else 0:.1f}%)")
+
+        leaf = Counter()
+        inclusive = Counter()
+        for (state, stack), count in samples.items():
+            if state != "local":
+                continue
+            frames = stack.split(";")
+            leaf[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        local_total = states["local"] or 1
+        lines.append(f"\n本地处理样本最多的函数（自身）:")
+        lines += [f"  {count / local_total * 100:5.1f}%  {frame}" for frame, count in leaf.most_common(PROFILE_TOP_N)]
+        lines.append(f"\n本地处理样本最多的函数（含子函数）:")
+        lines += [f"  {count / local_total * 100:5.1f}%  {frame}"
+                  for frame, count in inclusive.most_common(PROFILE_TOP_N)]
+        self._write_text(".sample.txt", "\n".join(lines) + "\n")
+        self._write_text(".folded", "".join(f"{state};{stack} {count}\n"
+                                            for (state, stack), count in sorted(samples.items())))
+
+    def _write_memory_report(self):
+        """内存报告：峰值、峰值附近快照中的主要分配位置，以及结束时仍占用的内存"""
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        final_snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        # 不统计分析工具自身的分配
+        filters = [tracemalloc.Filter(False, sys.modules[name].__file__)
+                   for name in ("tracemalloc", "cProfile", "pstats") if name in sys.modules]
+        filters.append(tracemalloc.Filter(False, __file__))
+
+        lines = [
+            f"💾 内存分析: {self.tool}",
+            f"  峰值: {peak / 1024 / 1024:.2f} MB",
+            f"  结束时: {current / 1024 / 1024:.2f} MB",
+        ]
+        snapshots = [("峰值附近", self._peak_snapshot, self._peak_size), ("结束时", final_snapshot, current)]
+        for label, snapshot, size in snapshots:
+            if snapshot is None:
+                continue
+            snapshot = snapshot.filter_traces(filters)
+            lines.append(f"\n{'=' * 100}\n{label}（{size / 1024 / 1024:.2f} MB）分配最多的位置\n{'=' * 100}")
+            for stat in snapshot.statistics("lineno")[:PROFILE_TOP_N]:
+                frame = stat.traceback[0]
+                lines.append(f"  {stat.size / 1024:10.1f} KB  {stat.count:8d} 个  {frame.filename}:{frame.lineno}")
+            if label == "峰值附近":
+                lines.append(f"\n{label}分配最多的调用栈（前5个）:")
+                for stat in snapshot.statistics("traceback")[:5]:
+                    lines.append(f"\n  {stat.size / 1024:.1f} KB，{stat.count} 个")
+                    lines += [f"    {line}" for line in stat.traceback.format(most_recent_first=True)]
+        self._write_text(".memory.txt", "\n".join(lines) + "\n")
+
+
+@contextmanager
+def session(tool: str, argv: list = None):
+    """
+    按命令行参数开启性能分析（没有相关参数时什么也不做）
+
+    Args:
+        tool: 工具名称（报告文件名前缀）
+        argv: 命令行参数（默认 sys.argv）
+    """
+    argv = sys.argv if argv is None else argv
+    cpu = "--profile" in argv
+    sample = "--profile-sample" in argv
+    memory = "--profile-memory" in argv
+    if not (cpu or sample or memory):
+        yield None
+        return
+
+    profiler = Profiler(tool, cpu=cpu, sample=sample, memory=memory)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        reports = profiler.stop()
+        if reports:
+            print("📄 性能分析报告:")
+            for path in reports:
+                print(f"   {os.path.abspath(path)}")
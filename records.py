@@ -0,0 +1,79 @@
+"""
+紧凑的书籍记录 - 从接口返回的书籍信息中只保留需要的字段
+
+搜索接口每本书返回几十个字段，批量搜索只用到其中十来个。
+BookRecord 使用 __slots__ 保存这些字段，比完整的字典占用更少内存；
+同时实现只读的映射接口（book["title"]、book.get("title")、dict(book)），
+原来按字典处理书籍的代码无需修改。
+"""
+from collections.abc import Mapping
+
+# 记录保存的字段（与搜索结果字段名一致；file_size 是结果文件中显示的文件大小）
+RECORD_FIELDS = ("id", "hash", "title", "author", "publisher", "year", "language",
+                 "extension", "pages", "cover", "filesize", "file_size")
+
+
+class BookRecord(Mapping):
+    """书籍记录（只读，字段固定，缺失的字段为None）"""
+
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, **fields):
+        for field in RECORD_FIELDS:
+            object.__setattr__(self, field, fields.get(field))
+
+    @classmethod
+    def from_dict(cls, book: Mapping, **overrides) -> "BookRecord":
+        """
+        从书籍字典中提取需要的字段
+
+        Args:
+            book: 书籍字典（接口返回结果或另一个BookRecord）
+            **overrides: 覆盖的字段值
+
+        Returns:
+            BookRecord
+        """
+        record = cls.__new__(cls)
+        get = book.get
+        for field in RECORD_FIELDS:
+            object.__setattr__(record, field, overrides[field] if field in overrides else get(field))
+        return record
+
+    @classmethod
+    def from_books(cls, books: list) -> list:
+        """批量转换书籍列表（跳过不是字典的项）"""
+        return [cls.from_dict(book) for book in books if isinstance(book, Mapping)]
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BookRecord是只读的")
+
+    def __getitem__(self, key: str):
+        if key not in RECORD_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(RECORD_FIELDS)
+
+    def __len__(self) -> int:
+        return len(RECORD_FIELDS)
+
+    def __contains__(self, key) -> bool:
+        return key in RECORD_FIELDS
+
+    def __reduce__(self):
+        # 只读对象的 pickle 支持（多进程间传递）
+        return (_rebuild, (tuple(getattr(self, field) for field in RECORD_FIELDS),))
+
+    def to_dict(self) -> dict:
+        """转换为普通字典（兼容需要可修改字典的旧代码）"""
+        return {field: getattr(self, field) for field in RECORD_FIELDS}
+
+    def __repr__(self) -> str:
+        return f"BookRecord(id={self.id!r}, title={self.title!r})"
+
+
+def _rebuild(values: tuple) -> BookRecord:
+    """按字段顺序重建记录（pickle使用）"""
+    return BookRecord(**dict(zip(RECORD_FIELDS, values)))
@@ -0,0 +1,278 @@
+"""
+批量发送到设备工具 - 把一批书通过 Zlibrary.sendTo 发送到 Kindle 或邮箱
+
+- 输入: list.txt 格式的结果文件（发送标记了v的版本），或 JSON数组/JSONL（每项包含 id 和 hash）
+- 并发发送，限制每分钟的发送次数；网络错误/超时按指数退避重试
+- 发送结果保存到状态文件，重新运行时已发送成功的书自动跳过
+"""
+import sys
+import os
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+# Windows终端设置UTF-8编码
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', write_through=True)
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', write_through=True)
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Zlibrary import Zlibrary
+from batch_download import parse_list_file
+from batch_search import get_arg_value, get_positional_args, iter_search_requests, login_and_check
+
+# ========== 配置区域 ==========
+DEFAULT_INPUT_FILE = "list.txt"
+DEFAULT_SEND_STATE_FILE = "send_state.json"
+DEFAULT_SEND_TARGET = "kindle"  # "kindle" 或 "email"
+SEND_WORKERS = 2  # 并发发送数
+SEND_RATE_PER_MINUTE = 20  # 每分钟最多发送次数（所有线程合计）
+SEND_MAX_ATTEMPTS = 3  # 网络错误/超时最多尝试次数（含第一次）
+SEND_RETRY_DELAY = 5  # 第一次重试前等待的秒数（之后每次加倍）
+# ===============================
+
+# 需要带值的命令行参数（读取位置参数时跳过其值）
+VALUE_OPTIONS = ("--to", "--workers", "--rate")
+
+SEND_TARGETS = ("kindle", "email")
+
+
+class SendState:
+    """发送状态（已发送/失败记录），按 书籍+发送目标 记录，重复运行不会重复发送"""
+
+    def __init__(self, state_file: str):
+        self.state_file = state_file
+        self.state = self._load_state()
+        self._lock = threading.Lock()
+
+    def _load_state(self) -> dict:
+        """加载状态文件"""
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"[警告] 加载发送状态失败: {e}，使用空状态")
+        return {
+            "sent": {},    # {id_hash_目标: {"title", "sent_at"}}
+            "failed": {},  # {id_hash_目标: {"title", "reason", "attempts", "failed_at"}}
+            "last_update": None
+        }
+
+    def save(self):
+        """保存状态到文件（先写临时文件再替换，中断时不会留下半个文件）"""
+        with self._lock:
+            self.state["last_update"] = datetime.now().isoformat()
+            tmp_file = self.state_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.state_file)
+
+    @staticmethod
+    def _key(book: dict, target: str) -> str:
+        return f"{book['id']}_{book['hash']}_{target}"
+
+    def is_sent(self, book: dict, target: str) -> bool:
+        """是否已发送成功"""
+        with self._lock:
+            return self._key(book, target) in self.state["sent"]
+
+    def add_sent(self, book: dict, target: str):
+        """记录发送成功"""
+        key = self._key(book, target)
+        with self._lock:
+            self.state["sent"][key] = {"title": book.get("title"), "sent_at": datetime.now().isoformat()}
+            self.state["failed"].pop(key, None)
+        self.save()
+
+    def add_failed(self, book: dict, target: str, reason: str, attempts: int):
+        """记录发送失败（下次运行时重新尝试）"""
+        with self._lock:
+            self.state["failed"][self._key(book, target)] = {
+                "title": book.get("title"), "reason": reason, "attempts": attempts,
+                "failed_at": datetime.now().isoformat(),
+            }
+        self.save()
+
+
+class RateLimiter:
+    """发送限速：所有线程合计每分钟不超过 rate_per_minute 次（均匀间隔）"""
+
+    def __init__(self, rate_per_minute: float):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """等到可以发送的时间"""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def load_books(input_file: str) -> list:
+    """
+    读取要发送的书籍
+
+    Args:
+        input_file: list.txt 格式的结果文件，或 .json/.jsonl 文件
+
+    Returns:
+        书籍列表（至少包含 id 和 hash）
+    """
+    if input_file.lower().endswith((".json", ".jsonl")):
+        books = []
+        for idx, item in iter_search_requests(input_file):
+            if item.get("id") and item.get("hash"):
+                books.append({"id": str(item["id"]), "hash": str(item["hash"]), "title": item.get("title") or ""})
+            else:
+                print(f"  [警告] 第 {idx} 项缺少 id 或 hash，已跳过")
+        return books
+    return parse_list_file(input_file)
+
+
+def send_book(zlib: Zlibrary, limiter: RateLimiter, book: dict, target: str) -> tuple:
+    """
+    发送一本书（网络错误/超时按指数退避重试）
+
+    每次尝试只发送一次（sendTo 内部不重试），每次发送都经过速率限制并计入尝试次数
+
+    Returns:
+        (是否成功, 消息, 尝试次数)
+    """
+    message = ""
+    for attempt in range(1, SEND_MAX_ATTEMPTS + 1):
+        limiter.acquire()
+        result = zlib.sendTo(book["id"], book["hash"], target, max_retries=1) or {}
+        if result.get("success"):
+            return True, result.get("message") or "发送成功", attempt
+        message = result.get("error") or result.get("message") or "发送失败"
+        if not result.get("retryable") or attempt == SEND_MAX_ATTEMPTS:
+            return False, message, attempt
+        time.sleep(SEND_RETRY_DELAY * 2 ** (attempt - 1))
+    return False, message, SEND_MAX_ATTEMPTS
+
+
+def dispatch(zlib: Zlibrary, books: list, state: SendState, target: str,
+             workers: int = SEND_WORKERS, rate_per_minute: float = SEND_RATE_PER_MINUTE) -> dict:
+    """
+    并发发送一批书（已发送成功的跳过）
+
+    Args:
+        zlib: Zlibrary实例
+        books: 书籍列表
+        state: 发送状态
+        target: 发送目标（kindle/email）
+        workers: 并发发送数
+        rate_per_minute: 每分钟最多发送次数
+
+    Returns:
+        统计信息 {"sent", "failed", "skipped", "attempts", "elapsed"}
+    """
+    stats = {"sent": 0, "failed": 0, "skipped": 0, "attempts": 0, "elapsed": 0.0}
+    todo = []
+    for book in books:
+        if state.is_sent(book, target):
+            stats["skipped"] += 1
+        else:
+            todo.append(book)
+    if stats["skipped"]:
+        print(f"⏭️  {stats['skipped']} 本已发送过，跳过")
+    if not todo:
+        return stats
+
+    limiter = RateLimiter(rate_per_minute)
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(send_book, zlib, limiter, book, target): book for book in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            book = futures[future]
+            try:
+                success, message, attempts = future.result()
+            except Exception as e:
+                success, message, attempts = False, str(e), 1
+            stats["attempts"] += attempts
+            if success:
+                state.add_sent(book, target)
+                stats["sent"] += 1
+                print(f"  ✅ [{done}/{len(todo)}] {book.get('title') or book['id']}")
+            else:
+                state.add_failed(book, target, message, attempts)
+                stats["failed"] += 1
+                print(f"  ❌ [{done}/{len(todo)}] {book.get('title') or book['id']}: {message}"
+                      f"{f'（已尝试 {attempts} 次）' if attempts > 1 else ''}")
+    stats["elapsed"] = time.time() - start_time
+    return stats
+
+
+def main():
+    """主函数"""
+    print("=" * 100)
+    print("Zlibrary 批量发送到设备工具")
+    print("=" * 100)
+
+    args = get_positional_args(VALUE_OPTIONS)
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print("\n使用方法:")
+        print("  python send_to_device.py [输入文件] [选项]")
+        print("\n选项:")
+        print(f"  --to <目标>         发送目标: kindle 或 email（默认: {DEFAULT_SEND_TARGET}）")
+        print(f"  --workers <数>      并发发送数（默认: {SEND_WORKERS}）")
+        print(f"  --rate <次数>       每分钟最多发送次数（默认: {SEND_RATE_PER_MINUTE}）")
+        print("\n示例:")
+        print("  python send_to_device.py")
+        print("  python send_to_device.py books.json --to email --rate 10")
+        print(f"\n默认输入文件: {DEFAULT_INPUT_FILE}（发送标记了v的版本）")
+        return
+
+    input_file = args[0] if args else DEFAULT_INPUT_FILE
+    target = get_arg_value("--to", DEFAULT_SEND_TARGET)
+    if target not in SEND_TARGETS:
+        print(f"\n❌ 未知的发送目标: {target}（可选: {', '.join(SEND_TARGETS)}）")
+        return
+    workers = int(get_arg_value("--workers", SEND_WORKERS))
+    rate = float(get_arg_value("--rate", SEND_RATE_PER_MINUTE))
+
+    try:
+        books = load_books(input_file)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"\n❌ 读取输入文件失败: {e}")
+        return
+    if not books:
+        print(f"\n❌ {input_file} 中没有要发送的书")
+        return
+    print(f"\n✅ 从 {input_file} 读取到 {len(books)} 本书，发送到: {target}")
+
+    zlib = login_and_check()
+    if zlib is None:
+        return
+    profile = zlib.getCachedProfile() or {}
+    if target == "kindle" and not profile.get("user", {}).get("kindle_email"):
+        print("\n⚠️  账号未设置 Kindle 邮箱，发送可能失败（可在网站个人设置中添加）")
+
+    state = SendState(DEFAULT_SEND_STATE_FILE)
+    print(f"\n开始发送...（并发 {workers}，每分钟最多 {rate:g} 次）")
+    stats = dispatch(zlib, books, state, target, workers, rate)
+
+    print("\n" + "=" * 100)
+    print(f"📊 统计信息:")
+    print(f"  发送成功: {stats['sent']} 本")
+    print(f"  已发送过: {stats['skipped']} 本")
+    print(f"  失败: {stats['failed']} 本（下次运行时重新尝试）")
+    if stats["elapsed"] > 0:
+        print(f"  耗时: {stats['elapsed']:.2f}秒（{stats['attempts']} 次请求，"
+              f"{(stats['sent'] + stats['failed']) / stats['elapsed'] * 60:.1f} 本/分钟）")
+    print(f"\n📄 状态文件: {os.path.abspath(DEFAULT_SEND_STATE_FILE)}")
+    print("=" * 100)
+
+
+if __name__ == "__main__":
+    main()
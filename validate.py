@@ -0,0 +1,258 @@
+"""
+下载文件校验与元数据提取 - 检查EPUB/PDF文件结构是否完整，并读出内嵌的元数据
+
+只通过内存映射（mmap）读取需要的部分，不把整个文件读入内存：
+- EPUB: 从文件末尾找到ZIP的中央目录，检查 mimetype / META-INF/container.xml，
+        再按 container.xml 找到 OPF 文件，读出 dc:title / dc:creator 等元数据
+- PDF:  检查文件头、末尾的 %%EOF 和 startxref 指向的交叉引用表，读出 /Info 字典中的标题/作者
+
+validate_file 是模块级函数，可以直接提交给进程池（ProcessPoolExecutor）执行。
+"""
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+# ZIP 结构签名
+ZIP_EOCD_SIGNATURE = b"PK\x05\x06"
+ZIP_CENTRAL_SIGNATURE = b"PK\x01\x02"
+ZIP_LOCAL_SIGNATURE = b"PK\x03\x04"
+ZIP_EOCD_MAX_SEARCH = 22 + 65535  # 结束记录（22字节）+ 最长注释
+
+# PDF 末尾检查的字节数（%%EOF 和 startxref 应在这个范围内）
+PDF_TAIL_BYTES = 4096
+# EPUB 中读取的 XML 文件大小上限（container.xml / OPF）
+EPUB_MAX_XML_BYTES = 4 * 1024 * 1024
+
+# OPF 中提取的 Dublin Core 元数据字段
+EPUB_METADATA_FIELDS = ("title", "creator", "publisher", "language", "date", "identifier")
+# PDF /Info 字典中提取的字段
+PDF_INFO_FIELDS = ("Title", "Author", "Publisher", "Producer", "CreationDate")
+
+
+class ValidationError(Exception):
+    """文件结构损坏"""
+
+
+def detect_format(mm) -> str:
+    """按文件头判断实际格式（epub/pdf/zip/html/unknown）"""
+    head = mm[:64]
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head.startswith(ZIP_LOCAL_SIGNATURE):
+        return "epub" if b"mimetypeapplication/epub+zip" in head else "zip"
+    if head.lstrip().lower().startswith((b"<!doctype html", b"<html")):
+        return "html"
+    return "unknown"
+
+
+def _read_zip_directory(mm) -> dict:
+    """
+    读取ZIP中央目录
+
+    Returns:
+        {文件名: (压缩方式, 压缩后大小, 本地文件头偏移)}
+    """
+    size = len(mm)
+    eocd = mm.rfind(ZIP_EOCD_SIGNATURE, max(0, size - ZIP_EOCD_MAX_SEARCH))
+    if eocd < 0 or eocd + 22 > size:
+        raise ValidationError("找不到ZIP结束记录（文件可能不完整）")
+    entries, cd_size, cd_offset = struct.unpack("<10xHII", mm[eocd + 0:eocd + 20])
+    if cd_offset + cd_size > eocd:
+        raise ValidationError("ZIP中央目录超出文件范围（文件可能不完整）")
+
+    directory = {}
+    pos = cd_offset
+    for _ in range(entries):
+        if mm[pos:pos + 4] != ZIP_CENTRAL_SIGNATURE:
+            raise ValidationError("ZIP中央目录损坏")
+        (method, compressed_size, name_len, extra_len,
+         comment_len, local_offset) = struct.unpack("<10xH8xI4xHHH8xI", mm[pos:pos + 46])
+        name = mm[pos + 46:pos + 46 + name_len].decode("utf-8", "replace")
+        if local_offset + compressed_size > cd_offset:
+            raise ValidationError(f"ZIP条目超出文件范围: {name}")
+        directory[name] = (method, compressed_size, local_offset)
+        pos += 46 + name_len + extra_len + comment_len
+    return directory
+
+
+def _read_zip_entry(mm, directory: dict, name: str) -> bytes:
+    """读取ZIP中的一个文件（只支持存储和deflate）"""
+    if name not in directory:
+        raise ValidationError(f"缺少 {name}")
+    method, compressed_size, local_offset = directory[name]
+    if mm[local_offset:local_offset + 4] != ZIP_LOCAL_SIGNATURE:
+        raise ValidationError(f"ZIP本地文件头损坏: {name}")
+    name_len, extra_len = struct.unpack("<HH", mm[local_offset + 26:local_offset + 30])
+    start = local_offset + 30 + name_len + extra_len
+    data = mm[start:start + compressed_size]
+    if method == 0:
+        return data
+    if method == 8:
+        try:
+            decompressor = zlib.decompressobj(-15)
+            return decompressor.decompress(data, EPUB_MAX_XML_BYTES)
+        except zlib.error as e:
+            raise ValidationError(f"解压失败: {name} ({e})")
+    raise ValidationError(f"不支持的压缩方式 {method}: {name}")
+
+
+def _local_name(tag: str) -> str:
+    """去掉XML命名空间"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def validate_epub(mm) -> dict:
+    """校验EPUB结构并读出OPF元数据"""
+    directory = _read_zip_directory(mm)
+    if _read_zip_entry(mm, directory, "mimetype").strip() != b"application/epub+zip":
+        raise ValidationError("mimetype 不是 application/epub+zip")
+
+    try:
+        container = ET.fromstring(_read_zip_entry(mm, directory, "META-INF/container.xml"))
+    except ET.ParseError as e:
+        raise ValidationError(f"container.xml 解析失败 ({e})")
+    rootfile = next((el.get("full-path") for el in container.iter() if _local_name(el.tag) == "rootfile"), None)
+    if not rootfile:
+        raise ValidationError("container.xml 中没有 rootfile")
+
+    try:
+        opf = ET.fromstring(_read_zip_entry(mm, directory, rootfile))
+    except ET.ParseError as e:
+        raise ValidationError(f"OPF 解析失败 ({e})")
+
+    metadata = {}
+    for el in opf.iter():
+        field = _local_name(el.tag)
+        if field in EPUB_METADATA_FIELDS and field not in metadata and el.text and el.text.strip():
+            metadata[field] = el.text.strip()
+    metadata["files"] = len(directory)
+    return metadata
+
+
+def _pdf_string(raw: bytes) -> str:
+    """PDF 字符串对象 -> 文本（支持 (literal) 和 <hex>，UTF-16BE带BOM时按UTF-16解码）"""
+    if raw.startswith(b"<"):
+        try:
+            data = bytes.fromhex(raw[1:-1].decode("ascii"))
+        except ValueError:
+            return ""
+    else:
+        data = re.sub(rb"\\([()\\])", rb"\1", raw[1:-1])
+    if data.startswith(b"\xfe\xff"):
+        return data[2:].decode("utf-16-be", "replace")
+    return data.decode("latin-1")
+
+
+def validate_pdf(mm) -> dict:
+    """校验PDF结构（文件头、%%EOF、startxref）并读出 /Info 元数据"""
+    size = len(mm)
+    tail = mm[max(0, size - PDF_TAIL_BYTES):]
+    if b"%%EOF" not in tail:
+        raise ValidationError("末尾缺少 %%EOF（文件可能不完整）")
+    match = re.search(rb"startxref\s+(\d+)", tail)
+    if not match:
+        raise ValidationError("末尾缺少 startxref")
+    xref_offset = int(match.group(1))
+    if xref_offset >= size:
+        raise ValidationError("startxref 超出文件范围（文件可能不完整）")
+    # 交叉引用表（xref）或交叉引用流（N 0 obj）
+    if not re.match(rb"\s*(xref|\d+\s+\d+\s+obj)", mm[xref_offset:xref_offset + 32]):
+        raise ValidationError("startxref 没有指向交叉引用表")
+
+    metadata = {"version": mm[5:8].decode("latin-1", "replace")}
+    # /Info 在 trailer 字典或交叉引用流字典中（都位于 startxref 之后）；直接在 mmap 上搜索，不复制
+    info_ref = re.compile(rb"/Info\s+(\d+)\s+(\d+)\s+R").search(mm, xref_offset)
+    if info_ref:
+        obj = re.compile(rb"(?<!\d)" + info_ref.group(1) + rb"\s+" + info_ref.group(2) + rb"\s+obj").search(mm)
+        if obj:
+            end = mm.find(b"endobj", obj.start())
+            body = mm[obj.start():end if end >= 0 else obj.start() + 4096]
+            for field in PDF_INFO_FIELDS:
+                value = re.search(rb"/" + field.encode() + rb"\s*(\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>)", body)
+                if value:
+                    metadata[field.lower()] = _pdf_string(value.group(1))
+    return metadata
+
+
+def validate_file(path: str, expected_format: str = None) -> dict:
+    """
+    校验一个下载的文件并提取元数据
+
+    Args:
+        path: 文件路径
+        expected_format: 期望的格式（如 "epub"，默认取文件扩展名）
+
+    Returns:
+        {"path", "size", "format", "expected_format", "valid", "error", "metadata"}
+    """
+    expected_format = (expected_format or os.path.splitext(path)[1].lstrip(".")).lower()
+    result = {"path": path, "size": 0, "format": None, "expected_format": expected_format,
+              "valid": False, "error": None, "metadata": {}}
+    try:
+        result["size"] = os.path.getsize(path)
+        if result["size"] == 0:
+            raise ValidationError("文件为空")
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            actual = detect_format(mm)
+            result["format"] = actual
+            # mimetype 条目带扩展字段时文件头里看不出是EPUB，按ZIP结构继续检查
+            compatible = actual == expected_format or (expected_format == "epub" and actual == "zip")
+            if expected_format in ("epub", "pdf") and not compatible:
+                raise ValidationError(f"格式不符: 期望 {expected_format.upper()}，实际是 {actual.upper()}")
+            if actual == "epub" or (actual == "zip" and expected_format == "epub"):
+                result["metadata"] = validate_epub(mm)
+            elif actual == "pdf":
+                result["metadata"] = validate_pdf(mm)
+        result["valid"] = True
+    except ValidationError as e:
+        result["error"] = str(e)
+    except (OSError, ValueError, struct.error) as e:
+        result["error"] = f"读取失败: {e}"
+    return result
+
+
+class MetadataIndex:
+    """
+    校验结果和元数据的旁路索引（JSON）
+
+    记录 书籍(id+hash) -> 校验结果（路径、实际格式、是否完整、错误、元数据）
+    """
+
+    def __init__(self, index_file: str):
+        self.index_file = index_file
+        self.index = self._load_index()
+        self._lock = threading.Lock()
+
+    def _load_index(self) -> dict:
+        """加载索引文件"""
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"[警告] 加载元数据索引失败: {e}，使用空索引")
+        return {}
+
+    def save(self):
+        """保存索引到文件"""
+        with self._lock:
+            tmp_file = self.index_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.index_file)
+
+    def add(self, book_id: str, book_hash: str, result: dict):
+        """记录一个文件的校验结果"""
+        with self._lock:
+            self.index[f"{book_id}_{book_hash}"] = {**result, "checked_at": datetime.now().isoformat()}
+
+    def get(self, book_id: str, book_hash: str) -> dict:
+        """查找校验结果，没有时返回None"""
+        with self._lock:
+            return self.index.get(f"{book_id}_{book_hash}")
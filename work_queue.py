@@ -0,0 +1,324 @@
+"""
+共享下载队列 - 多台机器（各自的账号）从同一个待下载队列取书，不会重复下载（SQLite）
+
+队列文件放在共享文件系统上（NFS/SMB等），各节点直接打开同一个文件，不需要中心服务：
+- claim: 在 BEGIN IMMEDIATE 事务中取出一本书并加上租约（节点名 + 到期时间），同一时间只有一个节点能取到
+- heartbeat: 后台线程定期延长本节点持有的租约
+- complete: 下载完成（或放弃）后标记为 done / failed，其他节点不再下载（只标记本节点持有租约的任务）
+- 节点崩溃或断网时租约不再延长，到期后书籍自动回到队列，由其他节点继续下载
+
+共享文件系统上不能使用 WAL（依赖共享内存），这里使用默认的回滚日志模式，靠文件锁保证原子性；
+各节点的时钟需要大致同步（误差远小于租约时长）。
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# 任务状态
+STATUS_QUEUED = "queued"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class SharedWorkQueue:
+    """
+    基于租约的共享下载队列
+
+    与 batch_download.DownloadQueue 接口相同（take / put / put_back / remaining），
+    另外提供 enqueue（加入新书，已有的不变）和 complete（标记完成）。
+    """
+
+    # 与 DownloadQueue 的优先级相同
+    PRIORITY_PUT_BACK = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_RETRY = 2
+
+    # 队列保存在文件中，剩余的书不需要另存为待下载任务
+    persistent = True
+
+    def __init__(self, db_file: str, owner: str = None, lease_seconds: float = 600,
+                 poll_interval: float = 5, busy_timeout: float = 30):
+        """
+        Args:
+            db_file: 队列文件（放在各节点都能访问的共享目录中）
+            owner: 本节点名称（默认: 主机名:进程号）
+            lease_seconds: 租约时长（秒），每 1/3 租约时长续约一次
+            poll_interval: 等待其他节点的书或重试时间时，重新检查的间隔（秒）
+            busy_timeout: 其他节点持有写锁时最多等待的秒数
+        """
+        self.db_file = db_file
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._held = set()  # 本节点持有租约的任务
+        self._lock = threading.Lock()
+        # isolation_level=None: 自己控制事务（claim 需要 BEGIN IMMEDIATE）
+        self._conn = sqlite3.connect(db_file, timeout=busy_timeout, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._init_schema()
+        self._stop = threading.Event()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat_thread.start()
+
+    def _init_schema(self):
+        """创建数据表（已存在时跳过）"""
+        with self._transaction():
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    key TEXT PRIMARY KEY,
+                    book TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    ready_at REAL NOT NULL,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    claims INTEGER NOT NULL DEFAULT 0,
+                    finished_by TEXT,
+                    updated_at REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority, ready_at)")
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：BEGIN IMMEDIATE 立即取得写锁，其他节点的写操作等待到提交"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _key(book: dict) -> str:
+        return f"{book['id']}_{book['hash']}"
+
+    def enqueue(self, books: list, priority: int = PRIORITY_NORMAL, ready_at: float = 0.0,
+                requeue: tuple = ()) -> int:
+        """
+        加入一批书（队列中已有的书不变）
+
+        Args:
+            books: 书籍列表
+            priority: 优先级
+            ready_at: 最早可以开始下载的时间戳
+            requeue: 这些状态的已有任务重新放回队列（如 ("failed",) 重新尝试已放弃的书）
+
+        Returns:
+            新加入或重新放回队列的数量
+        """
+        now = time.time()
+        statuses = tuple(requeue) or ("",)
+        placeholders = ", ".join("?" * len(statuses))
+        with self._transaction():
+            before = self._conn.total_changes
+            for book in books:
+                self._conn.execute(f"""
+                    INSERT INTO jobs (key, book, status, priority, ready_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        book = excluded.book, status = excluded.status, priority = excluded.priority,
+                        ready_at = excluded.ready_at, finished_by = NULL, updated_at = excluded.updated_at
+                    WHERE jobs.status IN ({placeholders})
+                """, (self._key(book), json.dumps(dict(book), ensure_ascii=False), STATUS_QUEUED,
+                      priority, ready_at, now, *statuses))
+            return self._conn.total_changes - before
+
+    def claim(self) -> dict:
+        """
+        取出一本可以开始下载的书并加上租约（到期的租约先放回队列）
+
+        Returns:
+            书籍字典，没有可以开始下载的书时返回None
+        """
+        now = time.time()
+        with self._transaction():
+            # 持有者已失联的任务：放回队首，由其他节点优先继续
+            self._conn.execute("""
+                UPDATE jobs SET status = ?, priority = ?, lease_owner = NULL, lease_expires_at = NULL,
+                                updated_at = ?
+                WHERE status = ? AND lease_expires_at < ?
+            """, (STATUS_QUEUED, self.PRIORITY_PUT_BACK, now, STATUS_LEASED, now))
+            row = self._conn.execute("""
+                SELECT key, book FROM jobs WHERE status = ? AND ready_at <= ?
+                ORDER BY priority, ready_at, rowid LIMIT 1
+            """, (STATUS_QUEUED, now)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("""
+                UPDATE jobs SET status = ?, lease_owner = ?, lease_expires_at = ?, claims = claims + 1,
+                                updated_at = ?
+                WHERE key = ?
+            """, (STATUS_LEASED, self.owner, now + self.lease_seconds, now, row["key"]))
+            self._held.add(row["key"])
+        return json.loads(row["book"])
+
+    def heartbeat(self) -> int:
+        """
+        延长本节点持有的所有租约
+
+        Returns:
+            续约的任务数（租约已过期并被其他节点取走的任务不再续约）
+        """
+        with self._lock:
+            held = list(self._held)
+        if not held:
+            return 0
+        now = time.time()
+        renewed = 0
+        lost = []
+        with self._transaction():
+            for key in held:
+                cursor = self._conn.execute("""
+                    UPDATE jobs SET lease_expires_at = ?, updated_at = ?
+                    WHERE key = ? AND status = ? AND lease_owner = ?
+                """, (now + self.lease_seconds, now, key, STATUS_LEASED, self.owner))
+                if cursor.rowcount:
+                    renewed += 1
+                else:
+                    lost.append(key)
+            self._held.difference_update(lost)
+        for key in lost:
+            print(f"  [警告] 共享队列租约已失效: {key}（可能已由其他节点下载）")
+        return renewed
+
+    def _heartbeat_loop(self):
+        """后台续约线程"""
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.heartbeat()
+            except sqlite3.Error as e:
+                print(f"  [警告] 共享队列续约失败: {e}")
+
+    def complete(self, book: dict, failed: bool = False) -> bool:
+        """
+        标记下载完成（failed=True: 已放弃，不再重试），其他节点不再下载
+
+        只更新本节点持有租约的任务（或本节点已完成的任务，如下载后校验失败而放弃）；
+        租约已过期并被其他节点取走时不改变队列中的状态
+
+        Returns:
+            是否已标记；False 表示租约已失效
+        """
+        key = self._key(book)
+        with self._transaction():
+            cursor = self._conn.execute("""
+                UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires_at = NULL,
+                                finished_by = ?, updated_at = ?
+                WHERE key = ? AND ((status = ? AND lease_owner = ?) OR (status IN (?, ?) AND finished_by = ?))
+            """, (STATUS_FAILED if failed else STATUS_DONE, self.owner, time.time(), key,
+                  STATUS_LEASED, self.owner, STATUS_DONE, STATUS_FAILED, self.owner))
+            self._held.discard(key)
+        if not cursor.rowcount:
+            print(f"  [警告] 共享队列租约已失效，未标记完成: {key}（已由其他节点取走）")
+            return False
+        return True
+
+    def put(self, book: dict, priority: int = PRIORITY_NORMAL, ready_at: float = 0.0):
+        """
+        把一本书放回队列（释放本节点的租约），ready_at为最早可以开始下载的时间戳
+
+        已完成的书也会重新放回（如下载后校验失败）；其他节点持有租约的书不变。
+        """
+        key = self._key(book)
+        now = time.time()
+        with self._transaction():
+            self._conn.execute("""
+                INSERT INTO jobs (key, book, status, priority, ready_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    status = excluded.status, priority = excluded.priority, ready_at = excluded.ready_at,
+                    lease_owner = NULL, lease_expires_at = NULL, finished_by = NULL,
+                    updated_at = excluded.updated_at
+                WHERE jobs.status != ? OR jobs.lease_owner = ?
+            """, (key, json.dumps(dict(book), ensure_ascii=False), STATUS_QUEUED, priority, ready_at, now,
+                  STATUS_LEASED, self.owner))
+            self._held.discard(key)
+
+    def put_back(self, book: dict):
+        """将未能下载的书放回队首"""
+        self.put(book, self.PRIORITY_PUT_BACK)
+
+    def _next_ready_at(self) -> float:
+        """队列中最早可以开始的时间（等待重试的书或其他节点到期的租约），没有时返回None"""
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT MIN(CASE WHEN status = ? THEN ready_at ELSE lease_expires_at END)
+                FROM jobs WHERE status IN (?, ?)
+            """, (STATUS_QUEUED, STATUS_QUEUED, STATUS_LEASED)).fetchone()
+        return row[0]
+
+    def take(self, max_wait: float = 0) -> dict:
+        """
+        取出下一本可以开始下载的书
+
+        Args:
+            max_wait: 只剩等待重试的书（或其他节点持有租约的书）时，最多等待的秒数
+
+        Returns:
+            书籍字典，队列为空或最近的可下载时间超过等待时间时返回None
+        """
+        give_up_at = time.time() + max_wait
+        while True:
+            book = self.claim()
+            if book is not None:
+                return book
+            next_at = self._next_ready_at()
+            if next_at is None or next_at > give_up_at:
+                return None
+            time.sleep(max(min(next_at - time.time(), self.poll_interval, give_up_at - time.time()), 0.1))
+
+    def remaining(self, include_retries: bool = False) -> list:
+        """返回队列中等待下载的书籍（默认不含等待重试的书）"""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT book FROM jobs WHERE status = ? AND (? OR priority != ?)
+                ORDER BY priority, ready_at, rowid
+            """, (STATUS_QUEUED, include_retries, self.PRIORITY_RETRY)).fetchall()
+        return [json.loads(row["book"]) for row in rows]
+
+    def ready_count(self) -> int:
+        """现在就可以开始下载的书籍数量（含已过期的租约）"""
+        now = time.time()
+        with self._lock:
+            return self._conn.execute("""
+                SELECT COUNT(*) FROM jobs
+                WHERE (status = ? AND ready_at <= ?) OR (status = ? AND lease_expires_at < ?)
+            """, (STATUS_QUEUED, now, STATUS_LEASED, now)).fetchone()[0]
+
+    def counts(self) -> dict:
+        """各状态的任务数 {"queued", "leased", "done", "failed"}"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {STATUS_QUEUED: 0, STATUS_LEASED: 0, STATUS_DONE: 0, STATUS_FAILED: 0}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)",
+                                      (STATUS_QUEUED, STATUS_LEASED)).fetchone()[0]
+
+    def close(self):
+        """停止续约，把仍持有租约的书放回队首，关闭队列文件"""
+        self._stop.set()
+        self._heartbeat_thread.join()
+        now = time.time()
+        with self._transaction():
+            for key in self._held:
+                self._conn.execute("""
+                    UPDATE jobs SET status = ?, priority = ?, lease_owner = NULL, lease_expires_at = NULL,
+                                    updated_at = ?
+                    WHERE key = ? AND status = ? AND lease_owner = ?
+                """, (STATUS_QUEUED, self.PRIORITY_PUT_BACK, now, key, STATUS_LEASED, self.owner))
+            self._held.clear()
+        with self._lock:
+            self._conn.close()